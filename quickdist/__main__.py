@@ -2,17 +2,45 @@
 
 import argparse
 import json
+import multiprocessing
 import os.path
 from typing import Dict
 
-from quickdist.node import Node
+from quickdist.node import Node, NodeOptions, ADMISSION_WAIT
 from quickdist.file import quickdist_config_json
+from quickdist.process import START_METHODS
+from quickdist.shm import DEFAULT_THRESHOLD
+from quickdist.scheduler import DEFAULT_AGING
+from quickdist.affinity import AFFINITY_MODES
+from quickdist.memory import parse_size
+from quickdist.discovery import Announcer, DEFAULT_GROUP, DEFAULT_PORT
+from quickdist.pyzmq.binding import TransportOptions
 
 
 def serve(args: argparse.Namespace):
     port = args.port
     processes = args.processes
-    node = Node(port=port, processes=processes)
+    options = NodeOptions(start_method=args.start_method, shm_threshold=args.shm_threshold,
+                          direct=args.direct, call_port=args.call_port, local_ipc=not args.no_ipc,
+                          backlog=args.backlog, aging=args.aging,
+                          affinity=args.affinity, worker_threads=args.worker_threads,
+                          memory_watermark=parse_size(args.memory_watermark) if args.memory_watermark else None,
+                          admission_wait=args.admission_wait,
+                          max_tasks_per_worker=args.max_tasks_per_worker,
+                          max_worker_memory=parse_size(args.max_worker_memory) if args.max_worker_memory else None,
+                          spare_workers=args.spare_workers,
+                          transport=TransportOptions(io_threads=args.io_threads,
+                                                     sndhwm=args.sndhwm, rcvhwm=args.rcvhwm,
+                                                     sndbuf=args.sndbuf, rcvbuf=args.rcvbuf,
+                                                     keepalive=args.keepalive, linger=args.linger,
+                                                     immediate=args.immediate))
+    node = Node(port=port, processes=processes, options=options)
+    if args.announce:
+        labels = [label for label in (args.labels or '').split(',') if label]
+        announcer = Announcer(port, processes or multiprocessing.cpu_count(), labels=labels,
+                              host=args.announce_host,
+                              group=args.discovery_group, discovery_port=args.discovery_port)
+        announcer.start()
     node.run()
 
 
@@ -88,6 +116,48 @@ def build_parser():
     serve_parser = subparsers.add_parser('serve', help='Start the node service')
     serve_parser.add_argument('--port', type=int, default=8421, help='serve port')
     serve_parser.add_argument('-n', '--processes', type=int, help='serve port')
+    serve_parser.add_argument('--start-method', type=str, choices=START_METHODS, default=None,
+                              help='worker start method, forkserver share preloaded modules, default spawn')
+    serve_parser.add_argument('--shm-threshold', type=int, default=DEFAULT_THRESHOLD,
+                              help='pass buffers not smaller than this bytes to workers by shared memory, e.g. 1048576, '
+                                   'default 0 for disable')
+    serve_parser.add_argument('--direct', action='store_true',
+                              help='workers take calls from a load balancer over ipc, bypass handler threads')
+    serve_parser.add_argument('--call-port', type=int, default=None, help='call port in direct mode, default port + 1')
+    serve_parser.add_argument('--backlog', type=int, default=None,
+                              help='tasks waiting in priority scheduler beyond processes, default processes')
+    serve_parser.add_argument('--aging', type=float, default=DEFAULT_AGING,
+                              help='seconds a waiting task gains one priority level, 0 for strict priority')
+    serve_parser.add_argument('--affinity', type=str, choices=AFFINITY_MODES, default='none',
+                              help='pin each worker to a cpu (core) or to the cpus of a NUMA node (numa)')
+    serve_parser.add_argument('--worker-threads', type=int, default=None,
+                              help='BLAS and OpenMP threads of each worker, e.g. 1 when all cores run workers')
+    serve_parser.add_argument('--memory-watermark', type=str, default=None,
+                              help='available memory kept free, e.g. 4G, tasks wait for memory beyond it')
+    serve_parser.add_argument('--admission-wait', type=float, default=ADMISSION_WAIT,
+                              help='seconds a task waits for memory before monster sends it to other nodes')
+    serve_parser.add_argument('--max-tasks-per-worker', type=int, default=None,
+                              help='replace a worker after this many tasks, against leaks of scripts')
+    serve_parser.add_argument('--max-worker-memory', type=str, default=None,
+                              help='replace a worker whose resident memory exceeds this after a task, e.g. 2G')
+    serve_parser.add_argument('--spare-workers', type=int, default=None,
+                              help='workers started ahead for replacing, default 1 with a limit above')
+    serve_parser.add_argument('--no-ipc', action='store_true',
+                              help='not serve on unix sockets for monster on the same host')
+    serve_parser.add_argument('--io-threads', type=int, default=1, help='zmq I/O threads, more for 10GbE links')
+    serve_parser.add_argument('--sndhwm', type=int, default=None, help='max queued outgoing messages of a socket')
+    serve_parser.add_argument('--rcvhwm', type=int, default=None, help='max queued incoming messages of a socket')
+    serve_parser.add_argument('--sndbuf', type=int, default=None, help='tcp send buffer bytes')
+    serve_parser.add_argument('--rcvbuf', type=int, default=None, help='tcp receive buffer bytes')
+    serve_parser.add_argument('--keepalive', action='store_true', help='tcp keepalive')
+    serve_parser.add_argument('--linger', type=int, default=None, help='milliseconds to keep pending messages on close')
+    serve_parser.add_argument('--immediate', action='store_true', help='queue messages only on completed connections')
+    serve_parser.add_argument('--announce', action='store_true', help='announce node for monster discovery')
+    serve_parser.add_argument('--announce-host', type=str, default=None,
+                              help='announced host, default the address seen by monster')
+    serve_parser.add_argument('--labels', type=str, default=None, help='comma separated labels announced')
+    serve_parser.add_argument('--discovery-group', type=str, default=DEFAULT_GROUP, help='multicast group')
+    serve_parser.add_argument('--discovery-port', type=int, default=DEFAULT_PORT, help='multicast port')
     serve_parser.set_defaults(func=serve)
 
     config_parser = subparsers.add_parser('config', help='Config mount point')
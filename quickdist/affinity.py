@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+from typing import Dict, List, Optional
+
+from .logger import logger
+
+__all__ = [
+    'AFFINITY_MODES',
+    'parse_cpus',
+    'numa_nodes',
+    'worker_cpus',
+    'pin_worker',
+    'thread_env',
+]
+
+# none leaves workers to the kernel, core pins each worker to one cpu, numa to the cpus of one NUMA node
+AFFINITY_MODES = ('none', 'core', 'numa')
+
+# thread pools of BLAS and OpenMP libraries, read once when the library is loaded
+THREAD_ENV = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+NODE_DIR = '/sys/devices/system/node'
+
+
+def parse_cpus(text: str) -> List[int]:
+    """
+    Parse cpu list like `0-3,8,10-11`.
+    """
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def allowed_cpus() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes() -> List[List[int]]:
+    """
+    :return: allowed cpus of each NUMA node, one node of all cpus if topology is unknown
+    """
+    allowed = set(allowed_cpus())
+    nodes = []
+    paths = glob.glob(os.path.join(NODE_DIR, 'node[0-9]*', 'cpulist'))
+    for path in sorted(paths, key=lambda p: int(os.path.basename(os.path.dirname(p))[4:])):
+        with open(path, 'r') as f:
+            cpus = [cpu for cpu in parse_cpus(f.read()) if cpu in allowed]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(allowed)]
+
+
+def worker_cpus(mode: str, processes: int) -> Optional[List[List[int]]]:
+    """
+    Cpus of each worker index.
+    Workers are spread over NUMA nodes in turn, so a half loaded node uses the memory bandwidth of all sockets.
+    :param mode: none|core|numa
+    :param processes: workers
+    :return: cpus for worker `index % len(result)`, None for no pinning
+    """
+    if mode is None or mode == 'none':
+        return None
+    if mode not in AFFINITY_MODES:
+        raise ValueError(f'The affinity should be {"|".join(AFFINITY_MODES)}, got {mode}')
+    nodes = numa_nodes()
+    if mode == 'numa':
+        return [nodes[i % len(nodes)] for i in range(processes)]
+    # take cpus of nodes in turn, lower cpu ids first, they are distinct physical cores on most hosts
+    cpus = []
+    for i in range(max(len(node) for node in nodes)):
+        cpus.extend(node[i] for node in nodes if i < len(node))
+    return [[cpus[i % len(cpus)]] for i in range(processes)]
+
+
+def process_threads(pid: int = 0) -> List[int]:
+    """
+    :param pid: process, 0 for the calling one
+    :return: thread ids of process, only pid itself if they are unknown
+    """
+    try:
+        return [int(tid) for tid in os.listdir(f'/proc/{pid or "self"}/task')]
+    except OSError:
+        return [pid]
+
+
+def pin_worker(index: int, cpus: Optional[List[List[int]]], pid: int = 0):
+    """
+    Bind worker with all its threads to the cpus of its index,
+    e.g. a spare taking the index of a replaced worker after its initializer started thread pools.
+    :param pid: worker process, 0 for the calling one
+    """
+    if not cpus:
+        return
+    if not hasattr(os, 'sched_setaffinity'):
+        logger.warning('CPU affinity is not supported on this platform')
+        return
+    target = cpus[index % len(cpus)]
+    for tid in process_threads(pid):
+        try:
+            os.sched_setaffinity(tid, target)
+        except ProcessLookupError:
+            # thread exited
+            pass
+
+
+def thread_env(threads: int) -> Dict[str, str]:
+    """
+    Environment limiting BLAS and OpenMP thread pools of each worker.
+    It must be set before workers, or the forkserver preloading numpy, are started.
+    """
+    return {name: str(threads) for name in THREAD_ENV}
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
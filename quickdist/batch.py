@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import threading
+from itertools import islice
+from typing import Any, Iterable, Iterator, List
+
+__all__ = [
+    'batches',
+]
+
+# end of items put by reader thread
+__END = object()
+# seconds a blocked reader thread waits before checking it is stopped
+READER_POLL = 0.1
+
+
+def batches(iterable: Iterable[Any], size: int, latency: float = None) -> Iterator[List[Any]]:
+    """
+    Gather items into batches for `main_batch` on nodes.
+    :param iterable: items
+    :param size: max items in a batch
+    :param latency: seconds a batch waits for more items after its first item, None for always full batches
+    :return: batches in items order
+    """
+    if size < 1:
+        raise ValueError(f'Batch size must be positive, got {size}')
+    if latency is None:
+        iterator = iter(iterable)
+        while True:
+            batch = list(islice(iterator, size))
+            if not batch:
+                return
+            yield batch
+    else:
+        yield from __gather(iterable, size, latency)
+
+
+def __gather(iterable: Iterable[Any], size: int, latency: float) -> Iterator[List[Any]]:
+    items = queue.Queue(maxsize=size)
+    errors: List[BaseException] = []
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=READER_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        put(__END)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is __END:
+                break
+            batch = [item]
+            deadline = time.monotonic() + latency
+            ended = False
+            while len(batch) < size:
+                wait = deadline - time.monotonic()
+                try:
+                    item = items.get(timeout=wait) if wait > 0 else items.get_nowait()
+                except queue.Empty:
+                    break
+                if item is __END:
+                    ended = True
+                    break
+                batch.append(item)
+            yield batch
+            if ended:
+                break
+    finally:
+        # also on GeneratorExit of a consumer stopped early, the reader stops after its current item
+        stop.set()
+        reader.join()
+
+    if errors:
+        raise errors[0]
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+from typing import List
+
+__all__ = [
+    'BloomFilter',
+]
+
+# 8 KiB filter, false positives under 1% up to ~6000 files with 4 hashes, about 1.5% at 7000
+DEFAULT_BITS = 1 << 16
+DEFAULT_HASHES = 4
+
+
+def positions(key: str, bits: int = DEFAULT_BITS, hashes: int = DEFAULT_HASHES) -> List[int]:
+    """
+    Bit positions of key, by double hashing of one digest.
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class BloomFilter(object):
+    def __init__(self, bits: int = DEFAULT_BITS, hashes: int = DEFAULT_HASHES, data: bytes = None):
+        """
+        Compact set of keys with false positives but no false negatives.
+        :param bits: size of filter, multiple of 8
+        :param hashes: bits set for each key
+        :param data: bytes of another filter of same size
+        """
+        if bits % 8:
+            raise ValueError(f'Bloom filter bits must be multiple of 8, got {bits}')
+        self.__bits = bits
+        self.__hashes = hashes
+        if data is None:
+            self.__data = bytearray(bits // 8)
+        elif len(data) != bits // 8:
+            raise ValueError(f'Bloom filter of {bits} bits can not load {len(data)} bytes')
+        else:
+            self.__data = bytearray(data)
+
+    @property
+    def bits(self) -> int:
+        return self.__bits
+
+    @property
+    def hashes(self) -> int:
+        return self.__hashes
+
+    def add(self, key: str):
+        for p in positions(key, self.__bits, self.__hashes):
+            self.__data[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.__data[p >> 3] & (1 << (p & 7)) for p in positions(key, self.__bits, self.__hashes))
+
+    def clear(self):
+        self.__data[:] = bytes(len(self.__data))
+
+    def bytes(self) -> bytes:
+        return bytes(self.__data)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
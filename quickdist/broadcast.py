@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import os
+import queue
+import hashlib
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .proxy import Proxy
+from .tunnel import Message
+from .file import File, Location
+
+__all__ = [
+    'Relay',
+    'BroadcastReceiver',
+    'read_chunks',
+]
+
+# bytes of data in one BCAST_CHUNK
+CHUNK_SIZE = 1 << 22
+# chunks buffered for each child, a slow child holds back its parent only after this
+QUEUE_CHUNKS = 8
+# seconds between pings of child while waiting its reply
+HEARTBEAT = 5.0
+
+Address = Tuple[str, int]
+
+
+def split(nodes: List[Address], fanout: int) -> List[Tuple[Address, List[Address]]]:
+    """
+    Children of a sender, each with an even part of the rest nodes to forward to.
+    Fanout 1 makes a chain.
+    :return: child and nodes under it
+    """
+    fanout = max(fanout, 1)
+    count = min(fanout, len(nodes))
+    if count == 0:
+        return []
+    size, extra = divmod(len(nodes), count)
+    groups = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        groups.append((nodes[start], nodes[start + 1:end]))
+        start = end
+    return groups
+
+
+def read_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+class Relay(object):
+    def __init__(self, bcast_id: str, header: Dict, nodes: List[Address], fanout: int, timeout: float = None):
+        """
+        Send a broadcast to children, each child forwards it to nodes under it while receiving.
+        One thread for each child, so a slow child holds back others only when its queue is full.
+        :param bcast_id: broadcast id
+        :param header: path, origin, md5 and size of file
+        :param nodes: nodes to broadcast to
+        :param fanout: children of each sender
+        :param timeout: seconds for each reply of child, None for waiting while child is alive
+        """
+        self.__bcast_id = bcast_id
+        self.__timeout = timeout
+        self.__threads: List[threading.Thread] = []
+        self.__queues: List[queue.Queue] = []
+        # child address to error of it or nodes under it
+        self.__errors: Dict[str, str] = {}
+        self.__lock = threading.Lock()
+        for child, rest in split(nodes, fanout):
+            q = queue.Queue(maxsize=QUEUE_CHUNKS)
+            q.put(Message('BCAST_BEGIN', bcast_id, header, rest, fanout, timeout=timeout).bytes())
+            thread = threading.Thread(target=self.__run, args=(child, q), daemon=True)
+            thread.start()
+            self.__queues.append(q)
+            self.__threads.append(thread)
+
+    def __run(self, child: Address, q: queue.Queue):
+        host, port = child
+        proxy: Optional[Proxy] = None
+        failed = False
+        try:
+            proxy = Proxy(host, port)
+            while True:
+                body = q.get()
+                if body is None:
+                    return
+                if failed:
+                    # keep draining, parent is not blocked by a lost child
+                    continue
+                ret = proxy.request(body, timeout=self.__timeout, heartbeat=HEARTBEAT)
+                if ret.cmd != 'OK':
+                    failed = True
+                    self.__fail(child, str(ret))
+        except Exception as e:
+            self.__fail(child, repr(e))
+            while q.get() is not None:
+                pass
+        finally:
+            if proxy is not None:
+                proxy.close()
+
+    def __fail(self, child: Address, error: str):
+        with self.__lock:
+            self.__errors[f'{child[0]}:{child[1]}'] = error
+
+    def put(self, offset: int, data: bytes):
+        """
+        Queue chunk to all children, blocked while a child queue is full.
+        """
+        body = Message('BCAST_CHUNK', self.__bcast_id, offset, data).bytes()
+        for q in self.__queues:
+            q.put(body)
+
+    def finish(self) -> Dict[str, str]:
+        """
+        Wait children and nodes under them.
+        :return: child address to error
+        """
+        body = Message('BCAST_END', self.__bcast_id).bytes()
+        for q in self.__queues:
+            q.put(body)
+            q.put(None)
+        for thread in self.__threads:
+            thread.join()
+        return dict(self.__errors)
+
+    def abort(self):
+        for q in self.__queues:
+            q.put(None)
+
+
+class BroadcastReceiver(object):
+    def __init__(self, bcast_id: str, header: Dict, nodes: List[Address], fanout: int, timeout: float = None):
+        """
+        File of a broadcast received by node into local dir, chunks are forwarded before written.
+        """
+        self.__file = File(Location.local, header['path'], header.get('origin', None), md5=header['md5'])
+        self.__size = header['size']
+        self.__path = self.__file.path()
+        self.__part = f'{self.__path}.{bcast_id}.{os.getpid()}.part'
+        os.makedirs(os.path.dirname(self.__part) or '.', exist_ok=True)
+        self.__f = open(self.__part, 'wb')
+        self.__md5 = hashlib.md5()
+        self.__offset = 0
+        self.__relay = Relay(bcast_id, header, nodes, fanout, timeout)
+
+    @property
+    def file(self) -> File:
+        return self.__file
+
+    def write(self, offset: int, data: bytes):
+        if offset != self.__offset:
+            raise ValueError(f'Broadcast chunk at {offset}, expected {self.__offset}')
+        self.__relay.put(offset, data)
+        self.__f.write(data)
+        self.__md5.update(data)
+        self.__offset += len(data)
+
+    def finish(self) -> Dict[str, str]:
+        """
+        Move file in place after checking it, and wait children.
+        :return: address to error of nodes under this node
+        """
+        errors = self.__relay.finish()
+        self.__f.close()
+        if self.__offset != self.__size or self.__md5.hexdigest() != self.__file.md5:
+            os.remove(self.__part)
+            raise ValueError(f'Broadcast {self.__file.relpath} received {self.__offset} of {self.__size} bytes '
+                             f'with md5 {self.__md5.hexdigest()}, expected {self.__file.md5}')
+        os.replace(self.__part, self.__path)
+        return errors
+
+    def abort(self):
+        self.__relay.abort()
+        self.__f.close()
+        if os.path.exists(self.__part):
+            os.remove(self.__part)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import os
+import os.path as osp
+import pickle
+import hashlib
+import tempfile
+from typing import Any, Tuple, Dict, Optional
+
+from .file import File, calculate_md5
+from .logger import logger
+
+__all__ = [
+    'ResultCache',
+    'script_digest',
+]
+
+
+def script_digest(script_content: str) -> str:
+    return hashlib.sha256(script_content.encode('utf-8')).hexdigest()
+
+
+class Uncacheable(Exception):
+    """
+    Argument has no stable identity, e.g. a file without content digest.
+    """
+    pass
+
+
+def file_digest(value: File) -> Optional[str]:
+    """
+    :return: md5 of file content, declared by file or computed from it on this host, None if unknown
+    """
+    if value.md5 is not None:
+        return value.md5
+    try:
+        path = value.path()
+    except ValueError as _:
+        return None
+    return calculate_md5(path) if osp.isfile(path) else None
+
+
+def canonicalize(value: Any) -> Any:
+    """
+    Make equal arguments pickle to equal bytes, files are keyed by their content.
+    :raise Uncacheable: a file has no content digest
+    """
+    if isinstance(value, File):
+        digest = file_digest(value)
+        if digest is None:
+            raise Uncacheable(value.relpath)
+        return 'File', value.origin, value.relpath, digest
+    if isinstance(value, dict):
+        items = [(canonicalize(k), canonicalize(v)) for k, v in value.items()]
+        return 'dict', tuple(sorted(items, key=repr))
+    if isinstance(value, (set, frozenset)):
+        return 'set', tuple(sorted((canonicalize(v) for v in value), key=repr))
+    if isinstance(value, list):
+        return 'list', tuple(canonicalize(v) for v in value)
+    if isinstance(value, tuple):
+        return tuple(canonicalize(v) for v in value)
+    return value
+
+
+class ResultCache(object):
+    def __init__(self, root: str = None, max_bytes: int = 1 << 30):
+        """
+        Results of deterministic calls on disk, evict least recently used entries over `max_bytes`.
+        Use a directory on shared storage to share results between monsters.
+        :param root: cache directory, default in system temp
+        :param max_bytes: max bytes of cached results
+        """
+        if root is None:
+            root = osp.join(tempfile.gettempdir(), 'quickdist', 'results')
+        self.__root = root
+        self.__max_bytes = max_bytes
+        # bytes estimated in this process, scanned on first put
+        self.__size: Optional[int] = None
+
+    @property
+    def root(self) -> str:
+        return self.__root
+
+    def key(self, script: str, args: Tuple, kwargs: Dict) -> Optional[str]:
+        """
+        :param script: script digest
+        :return: cache key of a call, None if the call is not cached, e.g. a file of unknown content
+        """
+        try:
+            body = pickle.dumps((script, canonicalize(args), canonicalize(kwargs)), protocol=4)
+        except Uncacheable as e:
+            logger.debug(f'Skip cache of call with file {e} of unknown content')
+            return None
+        return hashlib.sha256(body).hexdigest()
+
+    def __path(self, key: str) -> str:
+        return osp.join(self.__root, key[:2], f'{key}.pkl')
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        :return: hit and cached result
+        """
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:
+            logger.warning(f'Ignore broken cache {path}: {e}')
+            return False, None
+        return True, value
+
+    def put(self, key: str, value: Any):
+        path = self.__path(key)
+        root = osp.dirname(path)
+        os.makedirs(root, exist_ok=True)
+        body = pickle.dumps(value)
+        fd, temp = tempfile.mkstemp(dir=root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(temp, path)
+        except Exception as _:
+            if osp.exists(temp):
+                os.unlink(temp)
+            raise
+
+        if self.__size is None:
+            self.evict()
+        else:
+            self.__size += len(body)
+            if self.__size > self.__max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until cache is under `max_bytes`.
+        """
+        entries = []
+        total = 0
+        for root, _, filenames in os.walk(self.__root):
+            for filename in filenames:
+                if not filename.endswith('.pkl'):
+                    continue
+                path = osp.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.__max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.__size = total
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+__all__ = [
+    'AdaptiveChunker',
+    'DEFAULT_OVERHEAD',
+]
+
+# max share of round trip spent outside main on node
+DEFAULT_OVERHEAD = 0.05
+# max items in one chunk
+MAX_CHUNK = 4096
+# weight of the latest measurement in moving averages
+SMOOTHING = 0.3
+# a chunk grows at most this times the last size, one slow first item does not make a huge chunk
+MAX_GROWTH = 4
+# chunks left for each slot near the end of items, smaller chunks there shorten the tail
+TAIL_CHUNKS = 2
+
+
+class NodeTiming(object):
+    def __init__(self):
+        # seconds of main per item, and seconds of round trip beyond main per chunk
+        self.item = 0.0
+        self.overhead = 0.0
+        self.samples = 0
+
+    def update(self, items: int, elapsed: float, round_trip: float):
+        item = elapsed / max(items, 1)
+        overhead = max(round_trip - elapsed, 0.0)
+        if self.samples == 0:
+            self.item, self.overhead = item, overhead
+        else:
+            self.item += SMOOTHING * (item - self.item)
+            self.overhead += SMOOTHING * (overhead - self.overhead)
+        self.samples += 1
+
+    def size(self, overhead: float) -> float:
+        """
+        :return: items keeping overhead / (overhead + items * item) under target share
+        """
+        if self.item <= 0:
+            return MAX_CHUNK
+        return self.overhead * (1 - overhead) / (overhead * self.item)
+
+
+class AdaptiveChunker(object):
+    def __init__(self, slots: int, total: int = 0, overhead: float = DEFAULT_OVERHEAD, max_size: int = MAX_CHUNK):
+        """
+        Chunk sizes from per-item time and round trip overhead measured on each node while a map runs.
+        Chunks start with one item, grow until overhead is under target on all nodes,
+        and shrink near the end of items so that slots finish together.
+        :param slots: tasks running at once
+        :param total: items count, 0 for unknown, then chunks are not shrunk at the end
+        :param overhead: target share of round trip spent outside main
+        :param max_size: max items in a chunk
+        """
+        if not 0 < overhead < 1:
+            raise ValueError(f'Overhead must be in (0, 1), got {overhead}')
+        self.__slots = max(slots, 1)
+        self.__total = total
+        self.__overhead = overhead
+        self.__max_size = max_size
+        self.__size = 1
+        self.__taken = 0
+        self.__timings: Dict[Any, NodeTiming] = {}
+        self.__lock = threading.Lock()
+
+    def record(self, node: Any, items: int, elapsed: float, round_trip: float):
+        """
+        :param node: node ran the chunk
+        :param items: items of chunk
+        :param elapsed: seconds node ran the chunk
+        :param round_trip: seconds from sending chunk to its reply
+        """
+        with self.__lock:
+            timing = self.__timings.get(node, None)
+            if timing is None:
+                timing = self.__timings[node] = NodeTiming()
+            timing.update(items, elapsed, round_trip)
+            wanted = max(t.size(self.__overhead) for t in self.__timings.values())
+            self.__size = int(max(1, min(wanted, self.__size * MAX_GROWTH, self.__max_size)))
+
+    def size(self) -> int:
+        """
+        :return: items of next chunk
+        """
+        with self.__lock:
+            size = self.__size
+            if self.__total > 0:
+                left = self.__total - self.__taken
+                size = min(size, max(left // (self.__slots * TAIL_CHUNKS), 1))
+            return size
+
+    def chunks(self, iterable: Iterable[Any]) -> Iterator[List[Any]]:
+        """
+        Split items lazily, each chunk is sized when it is taken.
+        """
+        iterator = iter(iterable)
+        while True:
+            chunk = list(islice(iterator, self.size()))
+            if not chunk:
+                return
+            with self.__lock:
+                self.__taken += len(chunk)
+            yield chunk
+
+    def timings(self) -> Dict[Any, Tuple[float, float]]:
+        """
+        :return: node to seconds per item and seconds of overhead per chunk
+        """
+        with self.__lock:
+            return {node: (t.item, t.overhead) for node, t in self.__timings.items()}
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
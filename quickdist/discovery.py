@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import socket
+import struct
+import threading
+from typing import List, Dict, Optional, Iterable
+
+from .logger import logger
+from .mount import get_nodeid
+
+__all__ = [
+    'Announcer',
+    'discover',
+]
+
+DEFAULT_GROUP = '239.255.84.21'
+DEFAULT_PORT = 8420
+
+
+def load_average() -> float:
+    try:
+        return os.getloadavg()[0]
+    except OSError:
+        return 0.0
+
+
+class Announcer(object):
+    def __init__(self, port: int, processes: int,
+                 labels: Iterable[str] = None,
+                 host: str = None,
+                 group: str = DEFAULT_GROUP,
+                 discovery_port: int = DEFAULT_PORT,
+                 interval: float = 2.0,
+                 ttl: int = 1):
+        """
+        Publish node address, cores and load by UDP multicast.
+        :param port: node serve port
+        :param processes: node processes
+        :param labels: labels for monster to filter nodes
+        :param host: announced host, default the sender address seen by monster
+        :param group: multicast group
+        :param discovery_port: multicast port
+        :param interval: seconds between announcements
+        :param ttl: multicast hops, 1 for local network
+        """
+        self.__port = port
+        self.__processes = processes
+        self.__labels = sorted(set(labels or []))
+        self.__host = host
+        self.__group = group
+        self.__discovery_port = discovery_port
+        self.__interval = interval
+        self.__ttl = ttl
+        self.__stopped = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def message(self) -> bytes:
+        return json.dumps({
+            'quickdist': 1,
+            'nodeid': get_nodeid(),
+            'host': self.__host,
+            'port': self.__port,
+            'processes': self.__processes,
+            'cpus': os.cpu_count(),
+            'load': load_average(),
+            'labels': self.__labels,
+        }).encode('utf-8')
+
+    def start(self):
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        logger.info(f'Announce node :{self.__port} on {self.__group}:{self.__discovery_port}')
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.__ttl)
+            while not self.__stopped.is_set():
+                try:
+                    sock.sendto(self.message(), (self.__group, self.__discovery_port))
+                except OSError as e:
+                    logger.warning(f'Announce failed: {e}')
+                self.__stopped.wait(self.__interval)
+
+
+def discover(timeout: float = 3.0,
+             labels: Iterable[str] = None,
+             group: str = DEFAULT_GROUP,
+             discovery_port: int = DEFAULT_PORT) -> List[Dict]:
+    """
+    Listen announcements of nodes.
+    :param timeout: seconds of listening, should be longer than announce interval
+    :param labels: only nodes with all these labels
+    :return: announcements with `host` and `port`, one for each node
+    """
+    required = set(labels or [])
+    found: Dict[tuple, Dict] = {}
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', discovery_port))
+        membership = struct.pack('4sl', socket.inet_aton(group), socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, (address, _) = sock.recvfrom(65536)
+            except socket.timeout:
+                break
+            try:
+                info = json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+            if not isinstance(info, dict) or 'quickdist' not in info:
+                continue
+            if not required.issubset(info.get('labels', [])):
+                continue
+            info['host'] = info.get('host') or address
+            found[(info['host'], info['port'])] = info
+
+    return list(found.values())
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
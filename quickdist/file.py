@@ -236,6 +236,15 @@ class File(object):
         self.__from = None
         return self
 
+    @property
+    def locality_key(self) -> Optional[str]:
+        """
+        Identity of file content copied to local dir of nodes, None for other files.
+        """
+        if self.__location is not Location.local or self.__md5 is None:
+            return None
+        return f'{self.__origin or ""}:{self.__path}:{self.__md5}'
+
     def path(self, location: Location = None) -> str:
         if location is None:
             location = self.__location
@@ -247,6 +256,18 @@ class File(object):
             return osp.join(get_workdir(self.__origin), self.__path)
         return self.__path
 
+    @property
+    def relpath(self) -> str:
+        return self.__path
+
+    @property
+    def origin(self) -> Optional[str]:
+        return self.__origin
+
+    @property
+    def md5(self) -> Optional[str]:
+        return self.__md5
+
     @property
     def parent(self):
         return File(self.__location, os.path.dirname(self.__path))
@@ -286,10 +307,11 @@ def each_file(a: Any) -> Generator[File, None, None]:
         yield a
         return
 
+    # by id, lists and dicts are not hashable
     cache = set()
     iters = deque()
     if isinstance(a, (list, tuple, dict)):
-        cache.add(a)
+        cache.add(id(a))
         iters.append(a)
 
     while iters:
@@ -298,15 +320,15 @@ def each_file(a: Any) -> Generator[File, None, None]:
             for v in values.values():
                 if isinstance(v, File):
                     yield v
-                elif isinstance(v, (list, tuple, dict)) and v not in cache:
-                    cache.add(v)
+                elif isinstance(v, (list, tuple, dict)) and id(v) not in cache:
+                    cache.add(id(v))
                     iters.append(v)
         else:
             for v in values:
                 if isinstance(v, File):
                     yield v
-                elif isinstance(v, (list, tuple, dict)) and v not in cache:
-                    cache.add(v)
+                elif isinstance(v, (list, tuple, dict)) and id(v) not in cache:
+                    cache.add(id(v))
                     iters.append(v)
 
 
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import os.path as osp
+import pickle
+import hashlib
+import itertools
+from collections.abc import Sized
+from typing import Any, Iterable, Optional, Set, Tuple
+
+from .logger import logger
+from .sink import SpillSink, HEADER
+
+__all__ = [
+    'Journal',
+    'map_fingerprint',
+]
+
+# index of the first record holding fingerprint of the map
+FINGERPRINT = -1
+# first items of a map digested into its fingerprint
+FINGERPRINT_ITEMS = 64
+
+
+def map_fingerprint(script_digest: str, iterable: Iterable[Any]) -> Tuple[str, Iterable[Any]]:
+    """
+    Identity of a map: script, count of items if sized, and digest of the first items pickled.
+    Items after the first ones of an unsized iterable are not checked, they must be the same on rerun.
+    :return: fingerprint, and items to map, including the first ones read for the digest
+    """
+    count = len(iterable) if isinstance(iterable, Sized) else None
+    iterator = iter(iterable)
+    head = list(itertools.islice(iterator, FINGERPRINT_ITEMS))
+    digest = hashlib.md5()
+    for item in head:
+        digest.update(pickle.dumps(item, protocol=4))
+    return f'{script_digest}:{count}:{digest.hexdigest()}', itertools.chain(head, iterator)
+
+
+class Journal(SpillSink):
+    def __init__(self, path: str, spill_threshold: int = None, fsync: bool = False, fingerprint: str = None):
+        """
+        Append-only log of finished (index, result) of a map, reopen same path to resume it.
+        :param path: journal file
+        :param spill_threshold: results pickled not smaller than this are spilled to files beside journal
+        :param fsync: sync to disk after each record, survive reboot instead of process crash only
+        :param fingerprint: identity of the map, see `match`
+        """
+        self.__spill_threshold = spill_threshold
+        self.__fsync = fsync
+        self.__fingerprint: Optional[str] = None
+        super().__init__(path)
+        if fingerprint is not None:
+            try:
+                self.match(fingerprint)
+            except ValueError:
+                self.close()
+                raise
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        return self.__fingerprint
+
+    def match(self, fingerprint: str):
+        """
+        Check journal is resumed by the map that wrote it, a new journal records fingerprint first.
+        :param fingerprint: identity of the map, e.g. by `map_fingerprint`
+        """
+        if self.__fingerprint is not None:
+            if self.__fingerprint != fingerprint:
+                raise ValueError(f'Journal {self.path} was written by another map, '
+                                 f'fingerprint {self.__fingerprint}, got {fingerprint}')
+            return
+        if self._records:
+            # journal of older version without fingerprint
+            logger.warning(f'Journal {self.path} has no fingerprint, resume it unchecked')
+            return
+        body = fingerprint.encode('utf-8')
+        self._append(FINGERPRINT, body, len(body), fsync=self.__fsync)
+        self._records.pop(FINGERPRINT)
+        self.__fingerprint = fingerprint
+
+    def __spill_path(self, index: int) -> str:
+        return osp.join(f'{self.path}.d', f'{index}.pkl')
+
+    def _open(self):
+        if not osp.exists(self.path):
+            return
+        size = osp.getsize(self.path)
+        offset = 0
+        with open(self.path, 'rb') as f:
+            while offset + HEADER.size <= size:
+                index, length = HEADER.unpack(f.read(HEADER.size))
+                end = offset + HEADER.size + max(length, 0)
+                if end > size:
+                    break
+                if length < 0 and not osp.exists(self.__spill_path(index)):
+                    break
+                if index == FINGERPRINT:
+                    self.__fingerprint = f.read(length).decode('utf-8')
+                else:
+                    self._records[index] = (offset + HEADER.size, length)
+                f.seek(end)
+                offset = end
+        if offset < size:
+            # drop torn record written by a crash
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._records
+
+    def completed(self) -> Set[int]:
+        return set(self._records.keys())
+
+    def put(self, index: int, result: Any):
+        body = pickle.dumps(result)
+        length = len(body)
+        if self.__spill_threshold is not None and length >= self.__spill_threshold:
+            spill = self.__spill_path(index)
+            os.makedirs(osp.dirname(spill), exist_ok=True)
+            with open(spill, 'wb') as f:
+                f.write(body)
+                if self.__fsync:
+                    os.fsync(f.fileno())
+            body = b''
+            length = -1
+        self._append(index, body, length, fsync=self.__fsync)
+
+    def read(self, index: int) -> Any:
+        offset, length = self._records[index]
+        if length < 0:
+            with open(self.__spill_path(index), 'rb') as f:
+                return pickle.load(f)
+        return super().read(index)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
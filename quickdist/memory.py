@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from typing import Callable, Dict, Optional
+
+__all__ = [
+    'AdmissionControl',
+    'available_memory',
+    'process_memory',
+    'reset_peak',
+    'parse_size',
+]
+
+# seconds an admitted task keeps its memory reserved, most tasks allocate soon after start
+SETTLE = 2.0
+# seconds between checks of available memory while tasks wait
+ADMISSION_POLL = 0.1
+# weight of the latest task in learned memory of tasks
+SMOOTHING = 0.3
+
+UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(text: str) -> int:
+    """
+    Parse bytes like `512M`, `2G` or `1048576`.
+    """
+    text = text.strip().upper().rstrip('B').rstrip('I')
+    unit = text[-1:] if text[-1:] in UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+
+def read_fields(path: str) -> Dict[str, int]:
+    """
+    Read `Name: value kB` lines of /proc files into bytes.
+    """
+    fields = {}
+    with open(path, 'r') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            parts = value.split()
+            if parts and parts[0].isdigit():
+                fields[name] = int(parts[0]) * (1024 if parts[1:2] == ['kB'] else 1)
+    return fields
+
+
+def available_memory() -> Optional[int]:
+    """
+    :return: bytes available for new allocations without swapping, None if unknown
+    """
+    try:
+        return read_fields('/proc/meminfo').get('MemAvailable', None)
+    except OSError:
+        return None
+
+
+def process_memory(pid: int) -> Optional[Dict[str, int]]:
+    """
+    :return: `rss` and `peak` resident bytes of process, None if unknown
+    """
+    try:
+        fields = read_fields(f'/proc/{pid}/status')
+    except OSError:
+        return None
+    if 'VmRSS' not in fields:
+        return None
+    return dict(rss=fields['VmRSS'], peak=fields.get('VmHWM', fields['VmRSS']))
+
+
+def reset_peak(pid: int) -> bool:
+    """
+    Reset peak resident bytes of process to its current resident bytes, so the peak is of the next task only.
+    :return: reset, False if not supported, e.g. not Linux 4.0+ or no access to the process
+    """
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+class AdmissionControl(object):
+    def __init__(self, watermark: int, wait: float, hint: int = None):
+        """
+        Tasks start only while available memory stays above watermark after their memory,
+        otherwise they wait, and are refused after `wait` seconds so that monster tries other nodes.
+        One task is always admitted when none runs, a node never stalls.
+        :param watermark: bytes of available memory kept free
+        :param wait: seconds a task waits for memory before refused
+        :param hint: bytes of memory of each task, None for learning it from workers
+        """
+        self.__watermark = watermark
+        self.__wait = wait
+        self.__hint = hint
+        self.__learned = 0.0
+        self.__running = 0
+        # start time of admitted tasks still settling
+        self.__settling: Dict[int, float] = {}
+        self.__serial = 0
+        self.__lock = threading.Lock()
+
+    def reset(self, hint: int = None):
+        """
+        Forget learned memory for a new script.
+        :param hint: bytes of memory of each task, None for learning it
+        """
+        with self.__lock:
+            self.__hint = hint
+            self.__learned = 0.0
+
+    def task_memory(self) -> int:
+        """
+        :return: bytes expected for a task, declared hint or learned from workers
+        """
+        return self.__hint if self.__hint is not None else int(self.__learned)
+
+    def learn(self, growth: int):
+        """
+        :param growth: bytes a worker grew above its resident memory before a task
+        """
+        with self.__lock:
+            self.__learned += SMOOTHING * (max(growth, 0) - self.__learned)
+
+    def __reserved(self, now: float) -> int:
+        for serial in [s for s, start in self.__settling.items() if now - start >= SETTLE]:
+            del self.__settling[serial]
+        return len(self.__settling) * self.task_memory()
+
+    def __try_admit(self) -> Optional[int]:
+        with self.__lock:
+            now = time.monotonic()
+            available = available_memory()
+            if self.__running > 0 and available is not None:
+                if available - self.__reserved(now) - self.task_memory() < self.__watermark:
+                    return None
+            self.__running += 1
+            self.__serial += 1
+            self.__settling[self.__serial] = now
+            return self.__serial
+
+    def admit(self, check: Callable[[], None] = None) -> Optional[int]:
+        """
+        Wait for memory of a task.
+        :param check: called while waiting, raises to stop waiting, e.g. `CancelToken.check`
+        :return: ticket to release, None if refused
+        """
+        deadline = time.monotonic() + self.__wait
+        while True:
+            ticket = self.__try_admit()
+            if ticket is not None:
+                return ticket
+            if time.monotonic() >= deadline:
+                return None
+            if check is not None:
+                check()
+            time.sleep(ADMISSION_POLL)
+
+    def release(self, ticket: int):
+        with self.__lock:
+            self.__running -= 1
+            self.__settling.pop(ticket, None)
+
+    def pressure(self) -> Dict:
+        """
+        :return: available bytes, watermark, expected bytes of a task, and whether new tasks are deferred
+        """
+        available = available_memory()
+        with self.__lock:
+            needed = self.__reserved(time.monotonic()) + self.task_memory() + self.__watermark
+        return dict(available=available, watermark=self.__watermark, task=self.task_memory(),
+                    pressure=available is not None and available < needed)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
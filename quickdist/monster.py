@@ -1,17 +1,148 @@
 # -*- coding: utf-8 -*-
 
-from typing import List, Optional, Tuple, Any, Iterator
+import os
+import uuid
+import operator
+import threading
+import weakref
+from multiprocessing.pool import AsyncResult
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Optional, Tuple, Any, Iterator, Callable, Dict, TypeVar, Union
 
 from .logger import logger
-from .proxy import Proxy
-from .monster_proxy import ProxyPool
-from .mount import Mount
+from .proxy import Proxy, ClusterError, setup_request
+from .pyzmq.binding import TransportOptions, set_transport
+from .monster_proxy import ProxyPool, BUSY_PAUSE
+from .mount import Mount, get_nodeid
+from .file import File, Location, calculate_md5
+from .cache import ResultCache, script_digest
+from .retry import RetryPolicy
+from .registry import ACTIVE, DRAINING
+from .discovery import discover, DEFAULT_GROUP, DEFAULT_PORT
+from .journal import Journal, map_fingerprint
+from .sink import ResultSink
+from .batch import batches
+from .chunking import DEFAULT_OVERHEAD
+from .stream import ResultStream
+from .objects import ObjectRef, put_request
+from .broadcast import Relay, read_chunks, CHUNK_SIZE
+
+T = TypeVar('T')
+
+# seconds waiting nodes to reply CANCEL
+CANCEL_TIMEOUT = 5.0
+# chunk size measured while running
+AUTO = 'auto'
+
+
+class TaskResult(object):
+    def __init__(self, task_id: str, result: AsyncResult, cancel: Callable[[str], bool]):
+        """
+        Result of `Monster.call_async`, like `multiprocessing.pool.AsyncResult` with `cancel`.
+        """
+        self.__task_id = task_id
+        self.__result = result
+        self.__cancel = cancel
+
+    @property
+    def task_id(self) -> str:
+        return self.__task_id
+
+    def get(self, timeout: float = None) -> Any:
+        return self.__result.get(timeout)
+
+    def wait(self, timeout: float = None):
+        self.__result.wait(timeout)
+
+    def ready(self) -> bool:
+        return self.__result.ready()
+
+    def successful(self) -> bool:
+        return self.__result.successful()
+
+    def cancel(self) -> bool:
+        """
+        Cancel task on nodes, its worker is replaced and `get` raises TaskCancelled.
+        :return: task was running on a node, False if it is finished or not sent yet
+        """
+        if self.__result.ready():
+            return False
+        return self.__cancel(self.__task_id)
+
+
+def fan_out(action: str, nodes: List[Proxy], target: Callable[[Proxy], T]) -> List[T]:
+    """
+    Run target on all nodes concurrently, raise ClusterError with all failures.
+    :return: results in nodes order
+    """
+    if not nodes:
+        return []
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        futures = [executor.submit(target, node) for node in nodes]
+        results = []
+        errors: Dict[str, BaseException] = {}
+        for node, future in zip(nodes, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors[f'{node.host}:{node.port}'] = e
+    if errors:
+        raise ClusterError(action, errors)
+    return results
+
+
+def local_endpoints(info: Dict) -> Optional[Tuple[str, str]]:
+    """
+    :param info: INFO of node
+    :return: ipc endpoints for calls and others of node on the same host, None for remote node
+    """
+    endpoint = info.get('ipc', None)
+    if not endpoint or info.get('nodeid', None) != get_nodeid():
+        return None
+    call_endpoint = info.get('call_ipc', endpoint)
+    # same nodeid from a shared home on another host has no socket here
+    for url in (endpoint, call_endpoint):
+        if not os.path.exists(url[len('ipc://'):]):
+            return None
+    return call_endpoint, endpoint
 
 
 class Monster(object):
-    def __init__(self):
+    def __init__(self, start_method: str = None, cache: ResultCache = None, retry: RetryPolicy = None,
+                 max_slots: int = None, locality_delay: float = 0.0, local_ipc: bool = True,
+                 transport: TransportOptions = None, chunk_overhead: float = DEFAULT_OVERHEAD):
+        """
+        :param start_method: start method of local proxy processes, spawn|forkserver|fork
+        :param cache: reuse results of calls with same script and arguments, only for deterministic `main`
+        :param retry: heartbeat, deadline and resubmission of tasks on lost nodes, default RetryPolicy()
+        :param max_slots: proxy processes, max concurrent tasks including nodes joined later,
+                          default processes of nodes, grown as nodes join
+        :param locality_delay: seconds a task with `File.to_local()` arguments waits for a slot
+                               on nodes already holding the files, before taking other nodes
+        :param local_ipc: call nodes on the same host by their `ipc://` unix sockets instead of tcp
+        :param transport: zmq I/O threads and default socket options of monster and proxy processes
+        :param chunk_overhead: target share of round trip spent outside main on node for `chunk_size='auto'`
+        """
+        if transport is not None:
+            set_transport(transport)
         self.__nodes: List[Proxy] = []
         self.__pool: Optional[ProxyPool] = None
+        self.__start_method = start_method
+        self.__cache = cache
+        self.__retry = retry
+        self.__max_slots = max_slots
+        self.__locality_delay = locality_delay
+        self.__local_ipc = local_ipc
+        self.__transport = transport
+        self.__chunk_overhead = chunk_overhead
+
+        # replayed on nodes joined after setup
+        self.__mounts: List[Mount] = []
+        self.__setup: Optional[bytes] = None
+        self.__script_digest: Optional[str] = None
+        self.__indices: Dict[Tuple[str, int], int] = {}
+        # PUT requests of objects, replayed on nodes connected later
+        self.__objects: Dict[str, bytes] = {}
 
     def close(self):
         for node in self.__nodes:
@@ -19,29 +150,224 @@ class Monster(object):
         if self.__pool is not None:
             self.__pool.shutdown()
 
-    def connect(self, host: str, port: int = 8421):
-        self.__nodes.append(Proxy(host, port))
+    def connect(self, host: str, port: int = 8421, timeout: float = None, transport: TransportOptions = None):
+        """
+        Connect node, after setup the node joins running work with mounts and setup replayed.
+        Objects put before are put on the node.
+        :param timeout: seconds of replaying on node, None for waiting forever
+        :param transport: socket options for this node, e.g. larger buffers on a 10GbE link
+        """
+        node = Proxy(host, port, transport=transport)
+        try:
+            for body in self.__objects.values():
+                node.put_bytes(body, timeout=timeout)
+        except Exception as _:
+            node.close()
+            raise
+        if self.__pool is not None:
+            try:
+                for mount in self.__mounts:
+                    node.mount(mount, timeout=timeout)
+                info = self.__setup_node(node, self.__setup, timeout)
+            except Exception as _:
+                node.close()
+                raise
+            self.__register(node, info)
+        self.__nodes.append(node)
 
-    def mount(self, mount: Mount):
-        for node in self.__nodes:
-            node.mount(mount)
+    def discover(self, timeout: float = 3.0,
+                 labels: List[str] = None,
+                 group: str = DEFAULT_GROUP,
+                 discovery_port: int = DEFAULT_PORT,
+                 connect_timeout: float = None) -> List[Dict]:
+        """
+        Connect nodes announced by `quickdist serve --announce`.
+        :param timeout: seconds of listening announcements
+        :param labels: only nodes with all these labels
+        :param connect_timeout: seconds of replaying on node joined after setup
+        :return: announcements of newly connected nodes
+        """
+        connected = {(node.host, node.port) for node in self.__nodes}
+        found = []
+        for info in discover(timeout, labels, group, discovery_port):
+            if (info['host'], info['port']) in connected:
+                continue
+            self.connect(info['host'], info['port'], timeout=connect_timeout)
+            found.append(info)
+        logger.info(f'Discovered {len(found)} nodes with {sum(info["processes"] for info in found)} processes')
+        return found
 
-    def setup(self, script_file: str):
-        for node in self.__nodes:
-            node.setup(script_file)
+    def remove(self, host: str, port: int = 8421, timeout: float = None) -> bool:
+        """
+        Drain node, wait its running tasks and disconnect.
+        :param timeout: seconds of waiting, None for waiting forever
+        :return: node finished running tasks in timeout
+        """
+        node = next((n for n in self.__nodes if n.host == host and n.port == port), None)
+        if node is None:
+            raise ValueError(f'Node {host}:{port} not connected')
+        index = self.__indices.pop((host, port), None)
+        left = True
+        if index is not None:
+            left = self.__pool.registry.leave(index, timeout)
+        self.__nodes.remove(node)
+        node.close()
+        return left
 
-        # build pipeline
-        links: List[Tuple[str, int]] = []
+    def drain(self, host: str, port: int = 8421):
+        """
+        Stop sending new tasks to node, running tasks go on.
+        """
+        index = self.__indices.get((host, port), None)
+        if index is not None:
+            self.__pool.registry.drain(index)
 
-        for node in self.__nodes:
-            info = node.info()
-            processes = info.get('processes', 1)
-            links.extend([(node.host, node.port)] * processes)
+    def refresh(self, timeout: float = None):
+        """
+        Follow processes, cached files and memory pressure reported by nodes.
+        """
+        if self.__pool is None:
+            return
+        infos = fan_out('INFO', self.__nodes, lambda node: node.info(timeout=timeout))
+        for node, info in zip(self.__nodes, infos):
+            index = self.__indices.get((node.host, node.port), None)
+            if index is not None:
+                self.__pool.registry.resize(index, info.get('processes', 1))
+                if 'files' in info:
+                    self.__pool.registry.merge_files(index, info['files'])
+                if info.get('memory', {}).get('pressure', False):
+                    self.__pool.registry.pause(index, BUSY_PAUSE)
+        self.__grow()
+
+    def __register(self, node: Proxy, info: Dict):
+        processes = info.get('processes', 1)
+        # nodes in direct mode take calls on another port
+        port = info.get('call_port', node.port)
+        registry = self.__pool.registry
+        record = (node.host, port, node.port)
+        local = local_endpoints(info) if self.__local_ipc else None
+        if local is not None:
+            call_endpoint, endpoint = local
+            record = (call_endpoint, None, endpoint)
+            logger.info(f'Call local node {node.host}:{node.port} by {call_endpoint}')
+        if node.transport is not None:
+            # hashable, records are keys of proxies
+            record = (*record, tuple(sorted(node.transport.changed().items())))
+        index = registry.add(record, processes)
+        if 'files' in info:
+            registry.merge_files(index, info['files'])
+        self.__indices[(node.host, node.port)] = index
+        self.__grow()
+
+    def __grow(self):
+        """
+        Add proxy processes for slots of nodes joined or grown after setup, up to max_slots.
+        """
+        capacity = self.__pool.registry.capacity()
+        if capacity <= self.__pool.processes:
+            return
+        if self.__max_slots is None:
+            self.__pool.grow(capacity)
+        else:
+            logger.warning(f'Nodes have {capacity} slots, '
+                           f'only {self.__pool.processes} used, set max_slots to use all')
+
+    @staticmethod
+    def __setup_node(node: Proxy, body: bytes, timeout: float = None) -> Dict:
+        node.setup_bytes(body, timeout=timeout)
+        return node.info(timeout=timeout)
+
+    def mount(self, mount: Mount, timeout: float = None):
+        """
+        Mount on all nodes concurrently.
+        :param mount: Mount
+        :param timeout: seconds for each node, None for waiting forever
+        """
+        fan_out('MOUNT', self.__nodes, lambda node: node.mount(mount, timeout=timeout))
+        self.__mounts.append(mount)
+
+    def put(self, obj: Any, timeout: float = None) -> ObjectRef:
+        """
+        Put object on all nodes once, pass the returned ObjectRef in arguments instead of the object,
+        workers load it from shared memory of node and keep it for later tasks.
+        ObjectRef in arguments, or directly in their lists, tuples and dicts, are resolved.
+        :param obj: picklable object, e.g. a lookup table used by every task
+        :param timeout: seconds for each node, None for waiting forever
+        :return: ObjectRef of object
+        """
+        ref, body = put_request(obj)
+        if ref.object_id not in self.__objects:
+            fan_out('PUT', self.__nodes, lambda node: node.put_bytes(body, timeout=timeout))
+            self.__objects[ref.object_id] = body
+        return ref
+
+    def free(self, ref: ObjectRef, timeout: float = None):
+        """
+        Remove object from nodes, later tasks referencing it fail in workers not holding it yet.
+        """
+        self.__objects.pop(ref.object_id, None)
+        fan_out('FREE', self.__nodes, lambda node: node.free(ref, timeout=timeout))
+
+    def broadcast(self, file: File, fanout: int = 2, chunk_size: int = CHUNK_SIZE,
+                  timeout: float = None) -> File:
+        """
+        Send file to local dir of all nodes along a tree, each node forwards chunks to `fanout` nodes
+        while receiving, so the monster uplink sends the file only `fanout` times.
+        Nodes connected later do not have the file.
+        :param file: file readable by monster, e.g. WorkFile
+        :param fanout: children of each sender, 1 for a chain
+        :param chunk_size: bytes of each chunk
+        :param timeout: seconds for each chunk reply, None for waiting while nodes are alive
+        :return: File in local dir of nodes, passed in arguments without copying
+        """
+        path = file.path()
+        header = dict(path=file.relpath, origin=file.origin, md5=calculate_md5(path), size=os.path.getsize(path))
+        nodes = [(node.host, node.port) for node in self.__nodes]
+        relay = Relay(uuid.uuid4().hex, header, nodes, fanout, timeout)
+        offset = 0
+        try:
+            for chunk in read_chunks(path, chunk_size):
+                relay.put(offset, chunk)
+                offset += len(chunk)
+        except BaseException:
+            relay.abort()
+            raise
+        errors = relay.finish()
+        if errors:
+            raise ClusterError('BROADCAST', {k: RuntimeError(v) for k, v in errors.items()})
+        logger.info(f'Broadcast {file.relpath} of {offset} bytes to {len(nodes)} nodes')
+        return File(Location.local, file.relpath, file.origin, md5=header['md5'])
+
+    def setup(self, script_file: str, preload: List[str] = None, timeout: float = None, memory: int = None):
+        """
+        Setup script on all nodes concurrently.
+        :param script_file: script with `main` and optional `init`
+        :param preload: modules preloaded by forkserver on nodes, append to `PRELOAD` declared in script
+        :param timeout: seconds for each node, None for waiting forever
+        :param memory: bytes of memory of each task, nodes serving with `--memory-watermark` start tasks
+                       only while it is available, None for learning it from resident memory of workers
+        """
+        with open(script_file, 'r', encoding='utf-8') as f:
+            script_content = f.read()
+        body = setup_request(script_content, preload, memory)
+
+        infos = fan_out('SETUP', self.__nodes, lambda node: self.__setup_node(node, body, timeout))
 
         if self.__pool is not None:
             self.__pool.shutdown()
+            self.__pool = None
+        self.__indices.clear()
 
-        self.__pool = ProxyPool(links)
+        # build pipeline
+        processes = self.__max_slots or max(sum(info.get('processes', 1) for info in infos), 1)
+        self.__script_digest = script_digest(script_content)
+        self.__pool = ProxyPool(processes, start_method=self.__start_method,
+                                cache=self.__cache, script_digest=self.__script_digest,
+                                retry=self.__retry, locality_delay=self.__locality_delay,
+                                transport=self.__transport)
+        self.__setup = body
+        for node, info in zip(self.__nodes, infos):
+            self.__register(node, info)
 
     def _test(self, *args, **kwargs):
         # use pipeline
@@ -59,25 +385,222 @@ class Monster(object):
     def join(self):
         self.__pool.join()
 
-    def call_async(self, *args, **kwargs):
+    def call_async(self, *args, **kwargs) -> TaskResult:
         assert self.__pool is not None
-        return self.__pool.call_async(*args, **kwargs)
+        task_id = uuid.uuid4().hex
+        return TaskResult(task_id, self.__pool.submit(task_id, None, args, kwargs), self.cancel)
+
+    def call_timeout(self, timeout: float, *args, **kwargs) -> Any:
+        """
+        Call that node stops after timeout seconds by replacing its worker, raise TaskTimeout.
+        """
+        assert self.__pool is not None
+        return self.__pool.submit(None, timeout, args, kwargs).get()
+
+    def submit(self, args: Tuple = (), kwargs: Dict = None, priority: int = 0, timeout: float = None) -> TaskResult:
+        """
+        Call with priority, nodes run waiting tasks of higher priority first.
+        Tasks above priority 0 are sent by separate processes and may take slots of busy nodes,
+        so they wait only for running tasks on node, not for queued map items.
+        :param priority: higher runs first, waiting tasks gain priority over time
+        :param timeout: seconds node runs the task, then raises TaskTimeout
+        """
+        assert self.__pool is not None
+        task_id = uuid.uuid4().hex
+        return TaskResult(task_id, self.__pool.submit(task_id, timeout, args, kwargs or {}, priority), self.cancel)
+
+    def __runs_tasks(self, node: Proxy) -> bool:
+        """
+        :return: node is registered in current setup and not lost or left
+        """
+        index = self.__indices.get((node.host, node.port), None)
+        if self.__pool is None or index is None:
+            return False
+        return self.__pool.registry.state(index) in (ACTIVE, DRAINING)
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancel task on nodes that may run it, active or draining, a task not arrived yet is cancelled on arrival.
+        A node failed to reply is taken as not running the task.
+        :return: task was running on a node
+        """
+        nodes = [node for node in self.__nodes if self.__runs_tasks(node)]
+
+        def cancel(node: Proxy) -> bool:
+            try:
+                return node.cancel(task_id, timeout=CANCEL_TIMEOUT)
+            except Exception as e:
+                logger.warning(f'Failed to cancel task {task_id} on {node.host}:{node.port}: {e}')
+                return False
+
+        return any(fan_out('CANCEL', nodes, cancel))
 
     def call(self, *args, **kwargs) -> Any:
         assert self.__pool is not None
         return self.__pool.call(*args, **kwargs)
 
-    def map(self, iterable, chunk_size=None) -> List[Any]:
+    def map(self, iterable, chunk_size: Union[int, str] = None,
+            journal: Union[str, Journal] = None,
+            sink: ResultSink = None,
+            batch_size: int = None,
+            batch_latency: float = None,
+            timeout: float = None,
+            priority: int = 0) -> Any:
+        """
+        :param chunk_size: items of each proxy task, or 'auto' for items of each request to `main_batch` on node
+                           sized by measured item time and round trip, smaller near the end of items
+        :param journal: journal path or Journal, finished results are logged in it and skipped on rerun,
+                        then results are read from it on access, items must come in the same order on rerun,
+                        a journal of another script, count or first items is refused,
+                        a journal opened from path is closed when the results are released
+        :param sink: put results to sink as they arrive, return `sink.result(count)`,
+                     e.g. SpillSink for result sets larger than memory
+        :param batch_size: send items in batches of this size to `main_batch` in script,
+                           node calls `main` on each item if script has no `main_batch`
+        :param batch_latency: seconds a batch waits for more items, None for always full batches
+        :param timeout: seconds node runs each item or batch, then replaces its worker and raises TaskTimeout,
+                        freeing the slot of hung items at once
+        :param priority: higher runs first in node scheduler, e.g. -1 for background work
+        :return: list of results, or result of journal or sink
+        """
+        assert self.__pool is not None
+        owned = isinstance(journal, str)
+        if journal is not None:
+            sink = Journal(journal) if owned else journal
+            try:
+                fingerprint, iterable = map_fingerprint(self.__script_digest, iterable)
+                sink.match(fingerprint)
+            except BaseException:
+                if owned:
+                    sink.close()
+                raise
+        if sink is None:
+            if batch_size is not None or chunk_size == AUTO:
+                return list(self.imap(iterable, chunk_size=chunk_size, batch_size=batch_size,
+                                      batch_latency=batch_latency, timeout=timeout, priority=priority))
+            return self.__pool.map(iterable, chunk_size=chunk_size, timeout=timeout, priority=priority)
+
+        count = 0
+
+        def pending():
+            nonlocal count
+            for index, item in enumerate(iterable):
+                count = index + 1
+                if index not in sink:
+                    yield index, item
+
+        skipped = len(sink) if isinstance(sink, Journal) else 0
+        if chunk_size == AUTO:
+            total = max(operator.length_hint(iterable) - len(sink), 0)
+            results = self.__pool.imap_indexed_adaptive(pending(), total, timeout=timeout, priority=priority,
+                                                        overhead=self.__chunk_overhead)
+        elif batch_size is not None:
+            results = self.__pool.imap_indexed_batched(batches(pending(), batch_size, batch_latency),
+                                                       timeout=timeout, priority=priority)
+        else:
+            results = self.__pool.imap_indexed(pending(), chunk_size=chunk_size or 1,
+                                               timeout=timeout, priority=priority)
+        try:
+            for index, result in results:
+                sink.put(index, result)
+        except BaseException:
+            if owned:
+                sink.close()
+            raise
+        if skipped:
+            logger.info(f'Resumed map from {sink.path}, skipped {skipped} finished items')
+        result = sink.result(count)
+        if owned:
+            weakref.finalize(result, sink.close)
+        return result
+
+    def __result_stream(self, ref: Tuple[int, Optional[Tuple[str, int]], Any]) -> ResultStream:
+        index, address, value = ref
+        timeout = self.__retry.timeout if self.__retry is not None else None
+        registry = self.__pool.registry
+        if address is None:
+            registry.release(index)
+            return ResultStream(values=value, timeout=timeout)
+        host, port = address
+        return ResultStream(host, port, value, timeout=timeout, release=lambda: registry.release(index))
+
+    def stream(self, *args, **kwargs) -> ResultStream:
+        """
+        Call and pull result from node in chunks as iterated,
+        each value yielded by generator `main`, or the only value returned by `main`.
+        """
         assert self.__pool is not None
-        return self.__pool.map(iterable, chunk_size=chunk_size)
+        return self.__result_stream(self.__pool.stream_async(*args, **kwargs).get())
+
+    def subscribe(self, callback: Callable[[Any], None], *args, **kwargs) -> Future:
+        """
+        Call and pass each value to callback in a thread as generator `main` yields them on node.
+        :return: Future of values count
+        """
+        future = Future()
+
+        def run():
+            try:
+                count = 0
+                for value in self.stream(*args, **kwargs):
+                    callback(value)
+                    count += 1
+                future.set_result(count)
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def __imap_stream(self, iterable) -> Iterator[ResultStream]:
+        # each open stream holds a slot and a node worker, streams are opened as taken,
+        # and when opening the next would need more than all slots, idle ones are pulled into memory
+        opened: List[weakref.ref] = []
+        for item in iterable:
+            while True:
+                streams = [s for s in (ref() for ref in opened) if s is not None and s.holding]
+                opened = [weakref.ref(s) for s in streams]
+                idle = [s for s in streams if not s.started]
+                if not idle or len(streams) < max(self.__pool.registry.capacity(), 1):
+                    break
+                idle[0].buffer()
+            del streams, idle
+            stream = self.stream(item)
+            opened.append(weakref.ref(stream))
+            yield stream
 
-    def imap(self, iterable, chunk_size=1) -> Iterator[Any]:
+    def imap(self, iterable, chunk_size: Union[int, str] = 1,
+             batch_size: int = None, batch_latency: float = None,
+             stream: bool = False, timeout: float = None, priority: int = 0) -> Iterator[Any]:
+        """
+        :param stream: yield ResultStream of each item, result is pulled from node in chunks as iterated,
+            streams are opened as taken, each holds a slot until pulled to the end or closed,
+            streams not iterated yet are pulled into memory when taking the next would exceed all slots
+        :param timeout: seconds node runs each item or batch, not for stream
+        :param priority: higher runs first in node scheduler, not for stream
+        """
         assert self.__pool is not None
-        return self.__pool.imap(iterable, chunk_size=chunk_size)
+        if stream:
+            return self.__imap_stream(iterable)
+        if chunk_size == AUTO:
+            return self.__pool.imap_adaptive(iterable, timeout=timeout, priority=priority,
+                                             overhead=self.__chunk_overhead)
+        if batch_size is not None:
+            return self.__pool.imap_batched(batches(iterable, batch_size, batch_latency),
+                                            timeout=timeout, priority=priority)
+        return self.__pool.imap(iterable, chunk_size=chunk_size, timeout=timeout, priority=priority)
 
-    def imap_unordered(self, iterable, chunk_size=1) -> Iterator[Any]:
+    def imap_unordered(self, iterable, chunk_size: Union[int, str] = 1,
+                       batch_size: int = None, batch_latency: float = None,
+                       timeout: float = None, priority: int = 0) -> Iterator[Any]:
         assert self.__pool is not None
-        return self.__pool.imap_unordered(iterable, chunk_size=chunk_size)
+        if chunk_size == AUTO:
+            return self.__pool.imap_adaptive(iterable, ordered=False, timeout=timeout, priority=priority,
+                                             overhead=self.__chunk_overhead)
+        if batch_size is not None:
+            return self.__pool.imap_batched(batches(iterable, batch_size, batch_latency), ordered=False,
+                                            timeout=timeout, priority=priority)
+        return self.__pool.imap_unordered(iterable, chunk_size=chunk_size, timeout=timeout, priority=priority)
 
     def __call__(self, *args, **kwargs) -> Any:
         assert self.__pool is not None
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+import asyncio
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+import zmq
+import zmq.asyncio
+
+from .logger import logger
+from .proxy import setup_request
+from .pyzmq.binding import TransportOptions, set_transport, get_transport, shared_context, endpoint
+from .monster import ClusterError, local_endpoints
+from .monster_proxy import BUSY_PAUSE
+from .mount import Mount
+from .objects import ObjectRef, put_request
+from .retry import RetryPolicy
+from .tunnel import Message
+from .workers import TaskCancelled, TaskTimeout
+from .file import each_file
+
+__all__ = [
+    'AsyncMonster',
+]
+
+# seconds waiting node to reply CANCEL
+CANCEL_TIMEOUT = 5.0
+
+
+class AsyncNode(object):
+    def __init__(self, host: str, port: int, transport: TransportOptions = None):
+        """
+        Node connected by AsyncMonster, control requests on serve port and calls on call endpoint.
+        """
+        self.host = host
+        self.port = port
+        self.transport = transport
+        self.endpoint = endpoint(host, port)
+        self.call_endpoint = self.endpoint
+        # slots of node in current setup, 0 for lost nodes
+        self.slots = 0
+
+    def __str__(self):
+        return f'{self.host}:{self.port}'
+
+
+class Slot(object):
+    def __init__(self, ctx: zmq.asyncio.Context, node: AsyncNode, generation: int):
+        """
+        One concurrent task on node, by its own REQ socket.
+        """
+        self.__ctx = ctx
+        self.node = node
+        self.generation = generation
+        self.__socket: Optional[zmq.asyncio.Socket] = None
+
+    def __open(self) -> zmq.asyncio.Socket:
+        if self.__socket is None:
+            self.__socket = open_socket(self.__ctx, self.node.call_endpoint, self.node.transport)
+        return self.__socket
+
+    async def request(self, body: bytes, timeout: float = None) -> Message:
+        socket = self.__open()
+        try:
+            await socket.send(body)
+            if not await socket.poll(None if timeout is None else int(timeout * 1000)):
+                raise TimeoutError(f'No reply in {timeout}s from {self.node}')
+            return Message.load(await socket.recv())
+        except BaseException:
+            # REQ socket is stuck after a lost reply, e.g. cancelled, open a new one for next task
+            self.close()
+            raise
+
+    def close(self):
+        if self.__socket is not None:
+            self.__socket.close(linger=0)
+            self.__socket = None
+
+
+def open_socket(ctx: zmq.asyncio.Context, url: str, options: TransportOptions = None) -> zmq.asyncio.Socket:
+    socket = ctx.socket(zmq.REQ)
+    (options or get_transport()).apply(socket)
+    socket.connect(url)
+    return socket
+
+
+def unpack(ret: Message) -> Any:
+    for arg in each_file(ret.args):
+        if arg.copied:
+            arg.copy()
+    if len(ret.args) == 1:
+        return ret.args[0]
+    return ret.args
+
+
+class AsyncMonster(object):
+    def __init__(self, retry: RetryPolicy = None, local_ipc: bool = True, transport: TransportOptions = None):
+        """
+        Monster driven by asyncio event loop, each task waits for a free slot of nodes without threads.
+        Cancel a task or `asyncio.wait_for` it for timeout, the task is cancelled on node,
+        the slot is reset and reused by other tasks.
+        :param retry: deadline and resubmission of tasks, heartbeat is not used
+        :param local_ipc: call nodes on the same host by their `ipc://` unix sockets instead of tcp
+        :param transport: zmq I/O threads and default socket options
+        """
+        if transport is not None:
+            set_transport(transport)
+        self.__ctx = zmq.asyncio.Context.shadow(shared_context())
+        self.__retry = retry if retry is not None else RetryPolicy()
+        self.__local_ipc = local_ipc
+        self.__nodes: List[AsyncNode] = []
+        # free slots of all nodes, in order of release, None wakes waiting tasks when all nodes are lost
+        self.__slots: asyncio.Queue = asyncio.Queue()
+        self.__generation = 0
+        # CANCEL requests in flight
+        self.__cancels = set()
+
+        # replayed on nodes connected later
+        self.__mounts: List[Mount] = []
+        self.__objects: Dict[str, bytes] = {}
+        self.__setup: Optional[bytes] = None
+
+    @property
+    def slots(self) -> int:
+        """
+        Concurrent tasks of alive nodes.
+        """
+        return sum(node.slots for node in self.__nodes)
+
+    async def __control(self, node: AsyncNode, body: bytes, timeout: float = None, reply: str = 'OK') -> Message:
+        """
+        Send a control request to serve port of node by a socket of its own.
+        :param reply: expected cmd of reply
+        """
+        socket = open_socket(self.__ctx, node.endpoint, node.transport)
+        try:
+            await socket.send(body)
+            if not await socket.poll(None if timeout is None else int(timeout * 1000)):
+                raise TimeoutError(f'No reply in {timeout}s from {node}')
+            ret = Message.load(await socket.recv())
+        finally:
+            socket.close(linger=0)
+        if ret.cmd != reply:
+            raise RuntimeError(f'{ret} on {node}')
+        return ret
+
+    async def __fan_out(self, action: str, nodes: List[AsyncNode], body: bytes, timeout: float = None) \
+            -> List[Message]:
+        results = await asyncio.gather(*(self.__control(node, body, timeout) for node in nodes),
+                                       return_exceptions=True)
+        errors = {str(node): e for node, e in zip(nodes, results) if isinstance(e, BaseException)}
+        if errors:
+            raise ClusterError(action, errors)
+        return results
+
+    def __register(self, node: AsyncNode, info: Dict):
+        node.call_endpoint = node.endpoint
+        if 'call_port' in info:
+            node.call_endpoint = endpoint(node.host, info['call_port'])
+        local = local_endpoints(info) if self.__local_ipc else None
+        if local is not None:
+            node.call_endpoint = local[0]
+            logger.info(f'Call local node {node} by {node.call_endpoint}')
+        node.slots = info.get('processes', 1)
+        for _ in range(node.slots):
+            self.__slots.put_nowait(Slot(self.__ctx, node, self.__generation))
+
+    async def __join(self, node: AsyncNode, timeout: float = None):
+        for body in self.__objects.values():
+            await self.__control(node, body, timeout)
+        if self.__setup is None:
+            return
+        for mount in self.__mounts:
+            await self.__control(node, Message('MOUNT', mount).bytes(), timeout)
+        await self.__control(node, self.__setup, timeout)
+        ret = await self.__control(node, Message('INFO').bytes(), timeout)
+        self.__register(node, ret.kwargs)
+
+    async def connect(self, host: str, port: int = 8421, timeout: float = None, transport: TransportOptions = None):
+        """
+        Connect node, after setup the node joins running work with objects, mounts and setup replayed.
+        :param timeout: seconds of replaying on node, None for waiting forever
+        :param transport: socket options for this node
+        """
+        node = AsyncNode(host, port, transport)
+        await self.__join(node, timeout)
+        self.__nodes.append(node)
+
+    async def mount(self, mount: Mount, timeout: float = None):
+        await self.__fan_out('MOUNT', self.__nodes, Message('MOUNT', mount).bytes(), timeout)
+        self.__mounts.append(mount)
+
+    async def put(self, obj: Any, timeout: float = None) -> ObjectRef:
+        """
+        Put object on all nodes once, pass the returned ObjectRef in arguments instead of the object.
+        """
+        ref, body = put_request(obj)
+        if ref.object_id not in self.__objects:
+            await self.__fan_out('PUT', self.__nodes, body, timeout)
+            self.__objects[ref.object_id] = body
+        return ref
+
+    async def free(self, ref: ObjectRef, timeout: float = None):
+        self.__objects.pop(ref.object_id, None)
+        await self.__fan_out('FREE', self.__nodes, Message('FREE', ref).bytes(), timeout)
+
+    async def setup(self, script_file: str, preload: List[str] = None, timeout: float = None,
+                    memory: int = None):
+        """
+        Setup script on all nodes concurrently, tasks wait for slots until setup finished.
+        :param memory: bytes of memory of each task for admission control on nodes, None for learning it
+        """
+        with open(script_file, 'r', encoding='utf-8') as f:
+            script_content = f.read()
+        body = setup_request(script_content, preload, memory)
+        await self.__fan_out('SETUP', self.__nodes, body, timeout)
+        infos = await self.__fan_out('INFO', self.__nodes, Message('INFO').bytes(), timeout)
+
+        # slots of last setup are closed when released
+        self.__generation += 1
+        self.__drain()
+        self.__setup = body
+        for node, info in zip(self.__nodes, infos):
+            self.__register(node, info.kwargs)
+
+    def __usable(self, slot: Slot) -> bool:
+        return slot.generation == self.__generation and slot.node.slots > 0
+
+    def __drain(self):
+        while not self.__slots.empty():
+            slot: Optional[Slot] = self.__slots.get_nowait()
+            if slot is not None:
+                slot.close()
+
+    def __wake(self):
+        """
+        Wake tasks waiting for slots if no node is left, each passes the wake up on and raises.
+        """
+        if self.slots <= 0:
+            self.__slots.put_nowait(None)
+
+    async def __acquire(self) -> Slot:
+        while True:
+            if self.slots <= 0:
+                raise RuntimeError('No active node to call')
+            slot: Optional[Slot] = await self.__slots.get()
+            if slot is None:
+                # dropped if a node joined since
+                self.__wake()
+                continue
+            if self.__usable(slot):
+                return slot
+            slot.close()
+
+    def __release(self, slot: Slot):
+        if self.__usable(slot):
+            self.__slots.put_nowait(slot)
+        else:
+            slot.close()
+            self.__wake()
+
+    async def __check(self, node: AsyncNode):
+        """
+        Ping node after a timeout, stop sending tasks to it if lost.
+        """
+        try:
+            await self.__control(node, Message('PING').bytes(), self.__retry.heartbeat, reply='PONG')
+        except Exception as _:
+            if node.slots > 0:
+                node.slots = 0
+                logger.warning(f'Lost node {node}')
+                self.__wake()
+
+    def __cancel(self, node: AsyncNode, task_id: str):
+        future = asyncio.ensure_future(self.__control(node, Message('CANCEL', task_id).bytes(), CANCEL_TIMEOUT))
+        self.__cancels.add(future)
+        future.add_done_callback(self.__cancels.discard)
+
+    async def request(self, body: bytes, task_id: str = None) -> Message:
+        """
+        Send serialized task to a free slot, resubmit it by RetryPolicy.
+        Raise ClusterError when all alive nodes replied BUSY in more rounds than `retries` of RetryPolicy.
+        :param task_id: task id in headers of body, cancelled on node when the request is cancelled
+        :return: reply of node
+        """
+        attempt = 0
+        # nodes replied BUSY in this round, a round ends when all alive nodes refused the task
+        refused: Dict[str, BaseException] = {}
+        rounds = 0
+        while True:
+            slot = await self.__acquire()
+            busy = False
+            try:
+                ret = await slot.request(body, self.__retry.timeout)
+            except TimeoutError as e:
+                error = e
+                await self.__check(slot.node)
+                if task_id is not None:
+                    # the task may still run on node, stop it before it runs twice
+                    self.__cancel(slot.node, task_id)
+                    task_id = uuid.uuid4().hex
+                    body = Message.load(body).header(task=task_id).bytes()
+                # tasks of lost nodes are resubmitted, others only by retry_timeouts
+                if not self.__retry.retry_timeouts and slot.node.slots > 0:
+                    raise
+            except asyncio.CancelledError:
+                if task_id is not None:
+                    self.__cancel(slot.node, task_id)
+                raise
+            else:
+                if ret.cmd == 'OK':
+                    return ret
+                if ret.cmd == 'BUSY':
+                    # slot is back after a pause, the task takes slots of other nodes first
+                    busy = True
+                    logger.info(f'Node {slot.node} busy by {ret.args[0]}, send task to others')
+                    asyncio.get_running_loop().call_later(BUSY_PAUSE, self.__release, slot)
+                    refused[str(slot.node)] = RuntimeError(f'Busy by {ret.args[0]}')
+                    if {str(node) for node in self.__nodes if node.slots > 0}.issubset(refused):
+                        rounds += 1
+                        if rounds > self.__retry.retries:
+                            raise ClusterError('TASK', refused)
+                        refused = {}
+                    continue
+                if ret.cmd == 'CANCELLED':
+                    raise TaskCancelled(f'Task {ret.args[0]} cancelled on {slot.node}')
+                if ret.cmd == 'TIMEOUT':
+                    raise TaskTimeout(f'Task {ret.args[0]} timed out after {ret.args[1]}s on {slot.node}')
+                error = RuntimeError(f'{ret} on {slot.node}')
+                if not self.__retry.retry_errors:
+                    raise error
+            finally:
+                if not busy:
+                    self.__release(slot)
+
+            attempt += 1
+            if attempt > self.__retry.retries:
+                raise error
+            delay = self.__retry.delay(attempt)
+            logger.warning(f'Resubmit task in {delay}s ({attempt}/{self.__retry.retries}): {error}')
+            await asyncio.sleep(delay)
+
+    async def call(self, *args, **kwargs) -> Any:
+        return await self.call_timeout(None, *args, **kwargs)
+
+    async def call_timeout(self, timeout: Optional[float], *args, **kwargs) -> Any:
+        """
+        Call that node stops after timeout seconds by replacing its worker, raise TaskTimeout.
+        """
+        task_id = uuid.uuid4().hex
+        body = Message('CALL', *args, **kwargs).header(task=task_id, timeout=timeout).bytes()
+        ret = await self.request(body, task_id)
+        if any(arg.copied for arg in each_file(ret.args)):
+            return await asyncio.get_running_loop().run_in_executor(None, unpack, ret)
+        return unpack(ret)
+
+    async def imap_unordered(self, iterable: Union[Iterable, AsyncIterable], concurrency: int = None) \
+            -> AsyncIterator[Any]:
+        """
+        Call each item, yield results in completion order.
+        :param iterable: items, or async iterable of items
+        :param concurrency: max tasks in flight, default twice the slots
+        """
+        async for _, result in self.__imap_indexed(iterable, concurrency):
+            yield result
+
+    async def map(self, iterable: Union[Iterable, AsyncIterable], concurrency: int = None) -> List[Any]:
+        results: Dict[int, Any] = {}
+        async for index, result in self.__imap_indexed(iterable, concurrency):
+            results[index] = result
+        return [results[i] for i in range(len(results))]
+
+    async def __imap_indexed(self, iterable: Union[Iterable, AsyncIterable], concurrency: int = None) \
+            -> AsyncIterator[Tuple[int, Any]]:
+        limit = concurrency or max(self.slots * 2, 1)
+        items = aiter_items(iterable)
+        pending = set()
+        index = 0
+
+        async def run(i: int, item: Any) -> Tuple[int, Any]:
+            return i, await self.call(item)
+
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < limit:
+                    try:
+                        item = await items.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.ensure_future(run(index, item)))
+                    index += 1
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def close(self):
+        self.__drain()
+        for node in self.__nodes:
+            node.slots = 0
+        self.__wake()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+async def aiter_items(iterable: Union[Iterable, AsyncIterable]) -> AsyncIterator[Any]:
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
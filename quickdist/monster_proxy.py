@@ -4,102 +4,565 @@
 This file only run in subprocess
 """
 
+import time
+import uuid
+import queue
+import operator
+import functools
+import threading
 import multiprocessing
 from multiprocessing.pool import Pool
-from typing import Optional, List, Tuple, Any, Iterator
+from typing import Optional, List, Tuple, Any, Iterator, Dict, Iterable
 
-from .proxy import Proxy
-from .file import File
+from .proxy import Proxy, NodeLostError, ClusterError
+from .pyzmq.binding import TransportOptions, set_transport, endpoint
+from .registry import NodeRegistry
+from .file import File, each_file
+from .process import get_context
+from .cache import ResultCache
+from .retry import RetryPolicy
+from .chunking import AdaptiveChunker, DEFAULT_OVERHEAD
+from .tunnel import Message
+from .workers import TaskCancelled, TaskTimeout
+from .logger import logger
+
+# seconds waiting reply beyond timeout of task, node replies TIMEOUT in it
+TIMEOUT_GRACE = 5.0
+# seconds waiting node to reply CANCEL of a task timed out in proxy
+CANCEL_TIMEOUT = 5.0
+# proxy processes sending tasks above priority 0 of ProxyPool.submit
+URGENT_PROCESSES = 2
+# seconds a node replied BUSY under memory pressure takes no tasks
+BUSY_PAUSE = 1.0
 
-proxy: Optional[Proxy] = None
 pid: Optional[int] = None
+cache: Optional[ResultCache] = None
+script: Optional[str] = None
+policy: Optional[RetryPolicy] = None
+registry: Optional[NodeRegistry] = None
+locality: float = 0.0
+proxies: Dict[Tuple, Proxy] = {}
 
 
 def main(*args, **kwargs):
-    global proxy
-    global pid
+    return main_task(None, None, args, kwargs)
+
+
+def main_task(task_id: Optional[str], timeout: Optional[float], args: Tuple, kwargs: Dict,
+              priority: int = 0) -> Any:
+    """
+    :param task_id: id to cancel the task on node, default a new one
+    :param timeout: seconds node runs the task before replacing its worker, None for no deadline
+    :param priority: higher runs first in node scheduler
+    """
+    if cache is None:
+        return call(task_id, timeout, args, kwargs, priority)
+
+    key = cache.key(script, args, kwargs)
+    if key is None:
+        return call(task_id, timeout, args, kwargs, priority)
+    hit, value = cache.get(key)
+    if hit:
+        return value
+    value = call(task_id, timeout, args, kwargs, priority)
+    cache.put(key, value)
+    return value
+
+
+def main_item(timeout: Optional[float], priority: int, item: Any) -> Any:
+    return main_task(None, timeout, (item, ), {}, priority)
+
+
+def main_indexed(task: Tuple[int, Any], timeout: float = None, priority: int = 0) -> Tuple[int, Any]:
+    index, item = task
+    return index, main_task(None, timeout, (item, ), {}, priority)
+
+
+def main_batch(items: List[Any], timeout: float = None, priority: int = 0) -> List[Any]:
+    """
+    Call a batch of items by one BATCH request, cached items are not sent.
+    """
+    results, _ = __batch(items, timeout, priority)
+    return results
+
+
+def main_batch_measured(tasks: List[Tuple[int, Any]], timeout: float = None,
+                        priority: int = 0) -> Tuple[List[Tuple[int, Any]], Optional[int], float, float]:
+    """
+    Call a chunk of (index, item) by one BATCH request, with timing of it for adaptive chunk sizes.
+    :return: (index, result) of items, index of node, seconds on node and seconds of round trip,
+             node is None if all items are cached
+    """
+    indices = [index for index, _ in tasks]
+    results, (node, ret) = __batch([item for _, item in tasks], timeout, priority)
+    if ret is None:
+        return list(zip(indices, results)), None, 0.0, 0.0
+    return list(zip(indices, results)), node, ret.headers.get('elapsed', 0.0), ret.headers.get('round_trip', 0.0)
+
+
+def __batch(items: List[Any], timeout: Optional[float],
+            priority: int) -> Tuple[List[Any], Tuple[int, Optional[Message]]]:
+    if cache is None:
+        index, ret = request_batch(items, timeout, priority)
+        return ret.args[0], (index, ret)
+
+    keys = [cache.key(script, (item, ), {}) for item in items]
+    results: List[Any] = [None] * len(items)
+    missing: List[int] = []
+    for i, key in enumerate(keys):
+        hit, value = cache.get(key) if key is not None else (False, None)
+        if hit:
+            results[i] = value
+        else:
+            missing.append(i)
+    if not missing:
+        return results, (-1, None)
+    index, ret = request_batch([items[i] for i in missing], timeout, priority)
+    for i, value in zip(missing, ret.args[0]):
+        if keys[i] is not None:
+            cache.put(keys[i], value)
+        results[i] = value
+    return results, (index, ret)
+
+
+def main_batch_indexed(tasks: List[Tuple[int, Any]], timeout: float = None,
+                       priority: int = 0) -> List[Tuple[int, Any]]:
+    indices = [index for index, _ in tasks]
+    return list(zip(indices, main_batch([item for _, item in tasks], timeout, priority)))
+
+
+def get_proxy(link: Tuple) -> Proxy:
+    if link not in proxies:
+        host, port, heartbeat_port, *transport = link
+        options = TransportOptions(**dict(transport[0])) if transport else None
+        proxies[link] = Proxy(host, port, heartbeat_port, transport=options)
+    return proxies[link]
+
+
+def locality_keys(values: Any) -> List[str]:
+    return [f.locality_key for f in each_file(values) if f.locality_key is not None]
+
+
+def request(body: bytes, files: List[str] = None, hold: bool = False, timeout: float = None,
+            priority: int = 0) -> Tuple[int, Message]:
+    """
+    Send task to a free slot of registered nodes, resubmit it to others if node lost.
+    Tasks cancelled or timed out on node are not resubmitted, tasks refused by BUSY nodes are sent to others,
+    raise ClusterError when all active nodes refused it in more rounds than `policy.retries`.
+    :param files: locality keys of task files, prefer nodes holding them
+    :param hold: keep slot after reply, released by caller with `registry.release`
+    :param timeout: seconds of task on node
+    :param priority: tasks above 0 may take slots over capacity of nodes, waiting in node scheduler
+    :return: index of node replied, reply
+    """
+    wait = policy.timeout
+    if timeout is not None:
+        wait = timeout + TIMEOUT_GRACE if wait is None else min(wait, timeout + TIMEOUT_GRACE)
+    attempt = 0
+    # nodes replied BUSY in this round, a round ends when all active nodes refused the task
+    refused: Dict[int, Tuple[str, BaseException]] = {}
+    rounds = 0
+    while True:
+        index = registry.acquire(timeout=policy.max_backoff, files=files, locality_delay=locality,
+                                 priority=priority)
+        if index is None:
+            if not registry.active():
+                raise RuntimeError('No active node to call')
+            continue
+
+        link = registry.record(index)
+        proxy = get_proxy(link)
+        lost = False
+        held = False
+        try:
+            sent = time.perf_counter()
+            ret = proxy.request(body, timeout=wait,
+                                heartbeat=policy.heartbeat, liveness=policy.liveness)
+            if ret.cmd == 'OK':
+                # measured here, not sent by node
+                ret.header(round_trip=time.perf_counter() - sent)
+                if files:
+                    registry.add_files(index, files)
+                held = hold
+                return index, ret
+            if ret.cmd == 'BUSY':
+                # not an attempt, the task has not run, rounds of all nodes refusing it are counted instead
+                logger.info(f'Node {proxy.host}:{proxy.port} busy by {ret.args[0]}, send task to others')
+                registry.pause(index, BUSY_PAUSE)
+                refused[index] = (f'{proxy.host}:{proxy.port}', RuntimeError(f'Busy by {ret.args[0]}'))
+                if set(registry.active()).issubset(refused):
+                    rounds += 1
+                    if rounds > policy.retries:
+                        raise ClusterError('TASK', dict(refused.values()))
+                    refused.clear()
+                continue
+            if ret.cmd == 'CANCELLED':
+                raise TaskCancelled(f'Task {ret.args[0]} cancelled on {proxy.host}:{proxy.port}')
+            if ret.cmd == 'TIMEOUT':
+                raise TaskTimeout(f'Task {ret.args[0]} timed out after {ret.args[1]}s on {proxy.host}:{proxy.port}')
+            error = RuntimeError(f'{ret} on {proxy.host}:{proxy.port}')
+            if not policy.retry_errors:
+                raise error
+        except NodeLostError as e:
+            error = e
+            lost = True
+            logger.warning(f'Lost node {proxy.host}:{proxy.port}')
+            registry.fail(index)
+        except TimeoutError as e:
+            error = e
+            # the task may still run on node, stop it before it runs twice
+            body = cancel_timed_out(link, body)
+            if not policy.retry_timeouts:
+                raise
+        finally:
+            if not held:
+                registry.release(index)
+            if lost:
+                proxies.pop(link).close()
+
+        attempt += 1
+        if attempt > policy.retries:
+            raise error
+        delay = policy.delay(attempt)
+        logger.warning(f'Resubmit task in {delay}s ({attempt}/{policy.retries}): {error}')
+        time.sleep(delay)
+
+
+def cancel_timed_out(link: Tuple, body: bytes) -> bytes:
+    """
+    Cancel task without reply in time on node.
+    :return: body to resubmit, with a new task id, the old one may be cancelled on arrival
+    """
+    msg = Message.load(body)
+    task_id = msg.headers.get('task', None)
+    if task_id is None:
+        return body
+    host, port, heartbeat_port, *_ = link
+    # serve port of node, the call port of direct mode only takes tasks
+    url = heartbeat_port if isinstance(heartbeat_port, str) else endpoint(host, heartbeat_port or port)
+    control = Proxy(url, transport=get_proxy(link).transport)
+    try:
+        control.cancel(task_id, timeout=CANCEL_TIMEOUT)
+    except Exception as e:
+        logger.warning(f'Failed to cancel task {task_id} on {url}: {e}')
+    finally:
+        control.close()
+    return msg.header(task=uuid.uuid4().hex).bytes()
 
-    ret = proxy.call(*args, **kwargs)
 
-    if ret.cmd == 'OK':
-        # copy temp files to work dir
-        for arg in ret.args:
-            if isinstance(arg, File):
-                if arg.copied:
-                    # print(f'[{datetime.now()}] [DEBUG] COPY(TEMP->WORK): {arg.path}')
-                    arg.copy()
-    else:
-        raise RuntimeError(f'{ret} on {proxy.host}:{proxy.port}')
+def call(task_id: Optional[str], timeout: Optional[float], args: Tuple, kwargs: Dict, priority: int = 0):
+    if task_id is None:
+        task_id = uuid.uuid4().hex
+    # serialize once for resubmission
+    body = Message('CALL', *args, **kwargs).header(task=task_id, timeout=timeout, priority=priority or None).bytes()
+    _, ret = request(body, locality_keys((args, kwargs)), timeout=timeout, priority=priority)
+
+    # copy temp files to work dir
+    for arg in ret.args:
+        if isinstance(arg, File):
+            if arg.copied:
+                # print(f'[{datetime.now()}] [DEBUG] COPY(TEMP->WORK): {arg.path}')
+                arg.copy()
 
     if len(ret.args) == 1:
         return ret.args[0]
     return ret.args
 
 
-def init_ex(links: List[Tuple],
-            serial: multiprocessing.Value):
-    global proxy
+def call_batch(items: List[Any], timeout: float = None, priority: int = 0) -> List[Any]:
+    _, ret = request_batch(items, timeout, priority)
+    return ret.args[0]
+
+
+def request_batch(items: List[Any], timeout: float = None, priority: int = 0) -> Tuple[int, Message]:
+    batch = [(item, ) for item in items]
+    body = Message('BATCH', batch).header(task=uuid.uuid4().hex, timeout=timeout, priority=priority or None).bytes()
+    index, ret = request(body, locality_keys(batch), timeout=timeout, priority=priority)
+
+    # copy temp files to work dir
+    for arg in each_file(ret.args[0]):
+        if arg.copied:
+            arg.copy()
+
+    return index, ret
+
+
+def main_stream(*args, **kwargs) -> Tuple[int, Optional[Tuple[str, int]], Any]:
+    """
+    Start task as STREAM, values are pulled from node by main process.
+    The slot is held while node runs the generator, released by main process at the end of stream.
+    :return: node index, (host, port) and stream id on node, or node index, None and values replied at once
+    """
+    index, ret = request(Message('STREAM', *args, **kwargs).bytes(), locality_keys((args, kwargs)), hold=True)
+    if 'values' in ret.kwargs:
+        return index, None, ret.kwargs['values']
+    host, _, port, *_ = registry.record(index)
+    if isinstance(port, str):
+        # local node by endpoint URL
+        host, port = port, None
+    return index, (host, port), ret.kwargs['stream']
+
+
+def init_ex(node_registry: NodeRegistry,
+            serial: multiprocessing.Value,
+            result_cache: ResultCache = None,
+            script_digest: str = None,
+            retry_policy: RetryPolicy = None,
+            locality_delay: float = 0.0,
+            transport: Dict[str, Any] = None):
     global pid
+    global cache
+    global script
+    global policy
+    global registry
+    global locality
 
     with serial.get_lock():
         index = serial.value
         serial.value += 1
 
-    if len(links) == 0:
-        raise ValueError('Links empty.')
-
-    while index < 0:
-        index += len(links)
-    index = index % len(links)
-
-    host, port = links[index]
-
-    proxy = Proxy(host, port)
     pid = index
+    registry = node_registry
+    cache = result_cache
+    script = script_digest
+    policy = retry_policy if retry_policy is not None else RetryPolicy()
+    locality = locality_delay
+    if transport:
+        set_transport(TransportOptions(**transport))
 
 
 class ProxyPool(object):
-    def __init__(self, links: List[Tuple[str, int]]):
-        self.__ctx = multiprocessing.get_context('spawn')
+    def __init__(self, processes: int, start_method: str = None,
+                 cache: ResultCache = None,
+                 script_digest: str = None,
+                 retry: RetryPolicy = None,
+                 max_nodes: int = 256,
+                 locality_delay: float = 0.0,
+                 transport: TransportOptions = None):
+        """
+        :param processes: proxy processes, max concurrent tasks
+        :param start_method: spawn|forkserver|fork
+        :param cache: skip calls with cached results
+        :param script_digest: digest of setup script, part of cache key
+        :param retry: resubmit tasks of lost nodes
+        :param max_nodes: max nodes joined in the life of pool
+        :param locality_delay: seconds a task waits for nodes holding its local files
+        :param transport: zmq I/O threads and default socket options of proxy processes
+        """
+        self.__ctx = get_context(start_method)
+        self.__registry = NodeRegistry(self.__ctx, max_nodes)
 
         serial = self.__ctx.Value('i', 0, lock=True)
+        self.__initargs = (self.__registry, serial, cache, script_digest, retry, locality_delay,
+                           transport.changed() if transport is not None else None)
+
+        self.__pool: Pool = self.__ctx.Pool(processes=processes, initializer=init_ex, initargs=self.__initargs)
+        # Pool hands out tasks in FIFO order, a priority task would wait behind all queued map items
+        # before node scheduler sees it, so tasks above priority 0 are sent by processes of their own
+        self.__urgent: Pool = self.__ctx.Pool(processes=URGENT_PROCESSES, initializer=init_ex,
+                                              initargs=self.__initargs)
+        # tasks below priority 0 have processes of their own, started on first use, so a long background map
+        # does not fill the FIFO of pool ahead of other tasks, it waits for slots in registry behind them
+        self.__background: Optional[Pool] = None
+        self.__processes = processes
+        # closed pools replaced by `grow`, finishing their tasks
+        self.__retired: List[Pool] = []
+        self.__lock = threading.Lock()
+
+    @property
+    def registry(self) -> NodeRegistry:
+        """
+        Nodes to call, add or remove at any time.
+        """
+        return self.__registry
 
-        self.__pool: Pool = self.__ctx.Pool(
-            processes=len(links),
-            initializer=init_ex,
-            initargs=(links, serial),
-        )
+    @property
+    def processes(self) -> int:
+        return self.__processes
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__urgent.__exit__(exc_type, exc_val, exc_tb)
         self.__pool.__exit__(exc_type, exc_val, exc_tb)
+        for pool in self.__others():
+            pool.terminate()
+
+    def __others(self) -> List[Pool]:
+        return [*self.__retired, *([self.__background] if self.__background is not None else [])]
+
+    def __pool_of(self, priority: int) -> Pool:
+        if priority >= 0:
+            return self.__pool
+        with self.__lock:
+            if self.__background is None:
+                self.__background = self.__ctx.Pool(processes=self.__processes, initializer=init_ex,
+                                                    initargs=self.__initargs)
+            return self.__background
+
+    def grow(self, processes: int):
+        """
+        Use more proxy processes for nodes joined later, the registry still limits concurrent tasks.
+        New tasks go to a larger pool, the old pool finishes tasks already sent to it and exits.
+        :param processes: proxy processes
+        """
+        with self.__lock:
+            if processes <= self.__processes:
+                return
+            for retired in (self.__pool, self.__background):
+                if retired is not None:
+                    retired.close()
+                    self.__retired.append(retired)
+            self.__pool = self.__ctx.Pool(processes=processes, initializer=init_ex, initargs=self.__initargs)
+            if self.__background is not None:
+                self.__background = self.__ctx.Pool(processes=processes, initializer=init_ex,
+                                                    initargs=self.__initargs)
+            self.__processes = processes
 
     def close(self):
         self.__pool.close()
+        self.__urgent.close()
+        if self.__background is not None:
+            self.__background.close()
 
     def join(self):
+        for pool in self.__others():
+            pool.join()
         self.__pool.join()
+        self.__urgent.join()
 
     def shutdown(self):
-        self.__pool.close()
-        self.__pool.join()
+        self.close()
+        self.join()
 
     def call_async(self, *args, **kwargs):
         return self.__pool.apply_async(main, args, kwargs)
 
+    def submit(self, task_id: str, timeout: Optional[float], args: Tuple, kwargs: Dict, priority: int = 0):
+        """
+        Call with task id to cancel it on node, and timeout of node running it.
+        :param priority: higher runs first on node, above 0 is sent by urgent processes of pool
+        :return: AsyncResult
+        """
+        pool = self.__urgent if priority > 0 else self.__pool_of(priority)
+        return pool.apply_async(main_task, (task_id, timeout, args, kwargs, priority))
+
     def call(self, *args, **kwargs) -> Any:
         return self.__pool.apply(main, args, kwargs)
 
-    def map(self, iterable, chunk_size=None) -> List[Any]:
-        return self.__pool.map(main, iterable, chunksize=chunk_size)
+    @staticmethod
+    def __item_func(timeout: Optional[float], priority: int):
+        if timeout is None and not priority:
+            return main
+        return functools.partial(main_item, timeout, priority)
+
+    def map(self, iterable, chunk_size=None, timeout: float = None, priority: int = 0) -> List[Any]:
+        """
+        :param timeout: seconds node runs each item before replacing its worker, raise TaskTimeout
+        :param priority: higher runs first in node scheduler
+        """
+        return self.__pool_of(priority).map(self.__item_func(timeout, priority), iterable, chunksize=chunk_size)
+
+    def imap(self, iterable, chunk_size=1, timeout: float = None, priority: int = 0) -> Iterator[Any]:
+        return self.__pool_of(priority).imap(self.__item_func(timeout, priority), iterable, chunksize=chunk_size)
+
+    def imap_unordered(self, iterable, chunk_size=1, timeout: float = None, priority: int = 0) -> Iterator[Any]:
+        pool = self.__pool_of(priority)
+        return pool.imap_unordered(self.__item_func(timeout, priority), iterable, chunksize=chunk_size)
+
+    def imap_indexed(self, iterable: Iterable[Tuple[int, Any]], chunk_size=1,
+                     timeout: float = None, priority: int = 0) -> Iterator[Tuple[int, Any]]:
+        """
+        Map (index, item) to (index, result) in completion order.
+        """
+        func = functools.partial(main_indexed, timeout=timeout, priority=priority)
+        return self.__pool_of(priority).imap_unordered(func, iterable, chunksize=chunk_size)
+
+    def imap_batched(self, iterable: Iterable[List[Any]], ordered: bool = True,
+                     timeout: float = None, priority: int = 0) -> Iterator[Any]:
+        """
+        Call each batch of items by one request to `main_batch` on node, yield results of items.
+        :param iterable: batches, e.g. from `quickdist.batch.batches`
+        :param ordered: yield in batches order, or completion order of batches
+        :param timeout: seconds node runs each batch
+        """
+        pool = self.__pool_of(priority)
+        imap = pool.imap if ordered else pool.imap_unordered
+        for results in imap(functools.partial(main_batch, timeout=timeout, priority=priority), iterable):
+            yield from results
+
+    def imap_indexed_batched(self, iterable: Iterable[List[Tuple[int, Any]]],
+                             timeout: float = None, priority: int = 0) -> Iterator[Tuple[int, Any]]:
+        """
+        Map batches of (index, item) to (index, result) in completion order of batches.
+        """
+        func = functools.partial(main_batch_indexed, timeout=timeout, priority=priority)
+        for results in self.__pool_of(priority).imap_unordered(func, iterable):
+            yield from results
+
+    def imap_adaptive(self, iterable: Iterable[Any], ordered: bool = True,
+                      timeout: float = None, priority: int = 0,
+                      overhead: float = DEFAULT_OVERHEAD) -> Iterator[Any]:
+        """
+        Call items in chunks sized by AdaptiveChunker, by `main_batch` on node like batches.
+        :param ordered: yield in items order, or completion order of chunks
+        :param overhead: target share of round trip spent outside main on node
+        """
+        results = self.imap_indexed_adaptive(enumerate(iterable), operator.length_hint(iterable),
+                                             timeout=timeout, priority=priority, overhead=overhead)
+        if not ordered:
+            for _, result in results:
+                yield result
+            return
+        buffered: Dict[int, Any] = {}
+        position = 0
+        for index, result in results:
+            buffered[index] = result
+            while position in buffered:
+                yield buffered.pop(position)
+                position += 1
 
-    def imap(self, iterable, chunk_size=1) -> Iterator[Any]:
-        return self.__pool.imap(main, iterable, chunksize=chunk_size)
+    def imap_indexed_adaptive(self, iterable: Iterable[Tuple[int, Any]], total: int = 0,
+                              timeout: float = None, priority: int = 0,
+                              overhead: float = DEFAULT_OVERHEAD) -> Iterator[Tuple[int, Any]]:
+        """
+        Map (index, item) to (index, result) in completion order of adaptive chunks.
+        Chunks are made only when a proxy process is free to send them, so their sizes follow the latest timings.
+        :param total: items count for shrinking chunks at the end, 0 for unknown
+        """
+        slots = self.__registry.capacity() or self.__processes
+        chunker = AdaptiveChunker(slots, total, overhead)
+        chunks = chunker.chunks(iterable)
+        func = functools.partial(main_batch_measured, timeout=timeout, priority=priority)
+        done = queue.Queue()
+        pending = 0
+        exhausted = False
+        while True:
+            # backpressure, at most one chunk for each proxy process
+            while not exhausted and pending < self.__processes:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                # pool taken each time, it is replaced by `grow`
+                self.__pool_of(priority).apply_async(func, (chunk, ),
+                                                     callback=lambda value: done.put((True, value)),
+                                                     error_callback=lambda e: done.put((False, e)))
+                pending += 1
+            if pending == 0:
+                return
+            ok, value = done.get()
+            pending -= 1
+            if not ok:
+                raise value
+            results, node, elapsed, round_trip = value
+            if node is not None:
+                chunker.record(node, len(results), elapsed, round_trip)
+            yield from results
 
-    def imap_unordered(self, iterable, chunk_size=1) -> Iterator[Any]:
-        return self.__pool.imap_unordered(main, iterable, chunksize=chunk_size)
+    def stream_async(self, *args, **kwargs):
+        return self.__pool.apply_async(main_stream, args, kwargs)
 
     def __call__(self, *args, **kwargs) -> Any:
         return self.__pool.apply(main, args, kwargs)
@@ -1,18 +1,57 @@
 # -*- coding: utf-8 -*-
 
+import inspect
 import os.path
+import time
+import signal
 import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.context import BaseContext
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
-from typing import Dict, List
+from typing import Any, Callable, Dict, Iterator, List, NoReturn, Optional
 
-from .mount import Mount
-from .pyzmq.binding import *
+import zmq
+
+from .mount import Mount, get_nodeid
+from .pyzmq.binding import Socket, LoadBalancer, MultiThreadRep, READY, TransportOptions, set_transport
 from .tunnel import Message
-from .process import ProcessDistribute
+from .process import ProcessDistribute, get_context, script_preload, init_subprocess, run_subprocess, \
+    run_subprocess_batch, run_subprocess_iter
+from .shm import DEFAULT_THRESHOLD
+from .bloom import BloomFilter
+from .stream import StreamTable
+from .objects import ObjectStore
+from .broadcast import BroadcastReceiver
+from .workers import CancelToken, TaskCancelled, TaskTimeout
+from .scheduler import PriorityScheduler, DEFAULT_AGING
+from .affinity import worker_cpus, thread_env
+from .memory import AdmissionControl
 from .logger import logger
 from .file import File, each_file
 
 
+# handler threads beyond processes, keep PING and control commands responsive under full load
+CONTROL_THREADS = 2
+# requests waiting for a handler thread or direct worker, per process, beyond which node replies at once
+MAX_PENDING_PER_PROCESS = 64
+
+# seconds a task waits for memory on node before replied BUSY
+ADMISSION_WAIT = 5.0
+
+# ids of tasks cancelled before they arrive, e.g. still queued in monster
+MAX_CANCELLED = 4096
+# shared with workers in direct mode, checked on each task start
+MAX_DIRECT_CANCELLED = 256
+TASK_ID_SIZE = 64
+
+# task running in worker of direct mode, its slot and tasks shared with node
+__direct_task: Optional[str] = None
+__direct_slot: Optional[int] = None
+__direct_tasks: Optional['DirectTasks'] = None
+
+
 def script_cache_dir():
     return os.path.join(tempfile.gettempdir(), 'quickdist', 'jobs')
 
@@ -25,14 +64,257 @@ def copy_file(file: File):
     file.copy()
 
 
+def direct_socket_path(port: int) -> str:
+    return os.path.join(tempfile.gettempdir(), 'quickdist', 'sockets', f'node-{port}.ipc')
+
+
+def local_socket_path(port: int) -> str:
+    """
+    Unix socket beside tcp port, for monster on the same host.
+    """
+    return os.path.join(tempfile.gettempdir(), 'quickdist', 'sockets', f'node-{port}-local.ipc')
+
+
+def raise_timeout(signum, frame):
+    raise TaskTimeout('Task timed out')
+
+
+def raise_cancelled(signum, frame):
+    # signal may come late, after the task ended, stop only a cancelled task
+    if __direct_task is not None and __direct_tasks.cancelled(__direct_task):
+        raise TaskCancelled('Task cancelled')
+
+
+class DirectTasks(object):
+    def __init__(self, ctx: BaseContext, processes: int):
+        """
+        Tasks run by workers in direct mode, calls bypass node, so workers report their task in a slot.
+        :param processes: count of workers, one slot each
+        """
+        self.__running = ctx.Array('c', TASK_ID_SIZE * processes, lock=False)
+        # ring of latest cancelled ids, a task cancelled before start is refused
+        self.__cancelled = ctx.Array('c', TASK_ID_SIZE * MAX_DIRECT_CANCELLED, lock=False)
+        self.__next = ctx.Value('i', 0, lock=False)
+        self.__lock = ctx.Lock()
+
+    @staticmethod
+    def __key(task_id: str) -> bytes:
+        return task_id.encode('utf-8')[:TASK_ID_SIZE].ljust(TASK_ID_SIZE, b'\0')
+
+    @staticmethod
+    def __find(array, key: bytes) -> Optional[int]:
+        raw = array.raw
+        for i in range(0, len(raw), TASK_ID_SIZE):
+            if raw[i:i + TASK_ID_SIZE] == key:
+                return i // TASK_ID_SIZE
+        return None
+
+    def cancelled(self, task_id: str) -> bool:
+        """
+        Without lock, called in signal handler.
+        """
+        return self.__find(self.__cancelled, self.__key(task_id)) is not None
+
+    def start(self, slot: int, task_id: str) -> bool:
+        """
+        :return: False if the task was cancelled before start
+        """
+        key = self.__key(task_id)
+        with self.__lock:
+            if self.__find(self.__cancelled, key) is not None:
+                return False
+            self.__running[slot * TASK_ID_SIZE:(slot + 1) * TASK_ID_SIZE] = key
+        return True
+
+    def finish(self, slot: int):
+        with self.__lock:
+            self.__running[slot * TASK_ID_SIZE:(slot + 1) * TASK_ID_SIZE] = bytes(TASK_ID_SIZE)
+
+    def cancel(self, task_id: str) -> Optional[int]:
+        """
+        :return: slot of worker running the task, None if not running
+        """
+        key = self.__key(task_id)
+        with self.__lock:
+            if self.__find(self.__cancelled, key) is None:
+                start = self.__next.value * TASK_ID_SIZE
+                self.__cancelled[start:start + TASK_ID_SIZE] = key
+                self.__next.value = (self.__next.value + 1) % MAX_DIRECT_CANCELLED
+            return self.__find(self.__running, key)
+
+
+def direct_call(req: bytes) -> bytes:
+    global __direct_task
+
+    msg = None
+    timeout = None
+    try:
+        msg = Message.load(req)
+        task_id = msg.headers.get('task', None)
+        if task_id is not None and __direct_tasks is not None:
+            if not __direct_tasks.start(__direct_slot, task_id):
+                return Message('CANCELLED', task_id).bytes()
+            __direct_task = task_id
+        timeout = msg.headers.get('timeout', None)
+        if timeout is not None:
+            # no pool to replace workers in direct mode, interrupt main by alarm
+            signal.signal(signal.SIGALRM, raise_timeout)
+            signal.setitimer(signal.ITIMER_REAL, max(timeout, 0.001))
+        cmd = msg.cmd.upper()
+        if cmd not in ('CALL', 'BATCH', 'STREAM'):
+            return Message('ERROR', f'Received unsupported cmd {msg.cmd} on call port').bytes()
+
+        for arg in each_file(msg.args):
+            if arg.copied:
+                arg.copy()
+
+        if cmd == 'STREAM':
+            values = run_subprocess_iter(*msg.args, **msg.kwargs)
+            if inspect.isgenerator(values):
+                # NEXT can not be routed back to this worker, do not collect a generator in memory
+                values.close()
+                return Message('ERROR', 'Generator main can not be streamed in direct mode, '
+                                        'serve without --direct').bytes()
+            values = list(values)
+            for arg in each_file(values):
+                if arg.copied:
+                    arg.copy()
+            return Message('OK', values=values).bytes()
+        elapsed = None
+        if cmd == 'BATCH':
+            start = time.perf_counter()
+            args = (run_subprocess_batch(msg.args[0]), )
+            elapsed = time.perf_counter() - start
+        else:
+            ret = run_subprocess(*msg.args, **msg.kwargs)
+            args = ret if isinstance(ret, tuple) else (ret, )
+
+        for arg in each_file(args):
+            if arg.copied:
+                arg.copy()
+
+        return Message('OK', *args).header(elapsed=elapsed).bytes()
+    except TaskTimeout as _:
+        return Message('TIMEOUT', msg.headers.get('task', None), timeout).bytes()
+    except TaskCancelled as _:
+        return Message('CANCELLED', msg.headers.get('task', None)).bytes()
+    except Exception as e:
+        logger.error(e)
+        return Message('ERROR', str(e)).bytes()
+    finally:
+        if __direct_task is not None:
+            # cleared first, a late signal is ignored
+            __direct_task = None
+            __direct_tasks.finish(__direct_slot)
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def direct_worker(script: str, serial: multiprocessing.Value, backend: str, objects: str = None,
+                  preload: List[str] = None, tasks: DirectTasks = None, cpus: List[List[int]] = None,
+                  slot: int = None):
+    """
+    Worker of direct mode, take CALL from node load balancer without passing node handler and pool pipe.
+    :param objects: namespace of node object store
+    :param preload: modules imported before script
+    :param tasks: tasks shared with node, the running one is cancelled on SIGUSR1
+    :param cpus: cpus of each worker index
+    :param slot: slot of this worker in tasks
+    """
+    global __direct_tasks
+    global __direct_slot
+
+    __direct_tasks = tasks
+    __direct_slot = slot
+    if tasks is not None:
+        signal.signal(signal.SIGUSR1, raise_cancelled)
+    init_subprocess(script, serial, objects, cpus, preload)
+    with Socket(zmq.REQ) as socket:
+        socket.connect(backend)
+        socket.send(READY)
+        while True:
+            client, empty, req = socket.recv_multipart()
+            socket.send_multipart([client, empty, direct_call(req)])
+
+
+class NodeOptions(object):
+    def __init__(self, start_method: str = None,
+                 shm_threshold: int = DEFAULT_THRESHOLD,
+                 direct: bool = False,
+                 call_port: int = None,
+                 local_ipc: bool = True,
+                 transport: TransportOptions = None,
+                 backlog: int = None,
+                 aging: float = DEFAULT_AGING,
+                 affinity: str = None,
+                 worker_threads: int = None,
+                 memory_watermark: int = None,
+                 admission_wait: float = ADMISSION_WAIT,
+                 max_tasks_per_worker: int = None,
+                 max_worker_memory: int = None,
+                 spare_workers: int = None):
+        """
+        Options of node service.
+        :param start_method: worker start method, spawn|forkserver|fork
+        :param shm_threshold: pass buffers not smaller than this to workers by shared memory, 0 for disable
+        :param direct: workers take CALL on `call_port` from load balancer directly
+        :param call_port: port for CALL in direct mode, default `port + 1`
+        :param local_ipc: also serve on `ipc://` unix sockets, used by monster on the same host instead of tcp
+        :param transport: zmq I/O threads and socket options of node
+        :param backlog: tasks waiting in priority scheduler beyond processes, default processes
+        :param aging: seconds a waiting task gains one priority level, so low priority tasks are not starved
+        :param affinity: none|core|numa, pin each worker to a cpu or to the cpus of a NUMA node by its index
+        :param worker_threads: threads of BLAS and OpenMP pools in each worker, None for library defaults
+        :param memory_watermark: bytes of available memory kept free, tasks wait for memory beyond it,
+                                 None for no admission control
+        :param admission_wait: seconds a task waits for memory before replied BUSY, then monster tries other nodes
+        :param max_tasks_per_worker: tasks of a worker before it is replaced, None for no limit
+        :param max_worker_memory: resident bytes of a worker after a task, beyond which it is replaced,
+                                  None for no limit
+        :param spare_workers: workers started ahead for replacing, default 1 if a limit is set
+        """
+        self.start_method = start_method
+        self.shm_threshold = shm_threshold
+        self.direct = direct
+        self.call_port = call_port
+        self.local_ipc = local_ipc
+        self.transport = transport
+        self.backlog = backlog
+        self.aging = aging
+        self.affinity = affinity
+        self.worker_threads = worker_threads
+        self.memory_watermark = memory_watermark
+        self.admission_wait = admission_wait
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_memory = max_worker_memory
+        self.spare_workers = spare_workers
+
+
 class Node(object):
-    def __init__(self, port: int = 8421, processes: int = None):
+    def __init__(self, port: int = 8421, processes: int = None, options: NodeOptions = None):
+        """
+        :param port: serve port
+        :param processes: worker processes, default cpu count
+        :param options: options of node, default NodeOptions()
+        """
+        if options is None:
+            options = NodeOptions()
+        set_transport(options.transport)
         if processes is None:
             processes = multiprocessing.cpu_count()
+        if options.worker_threads is not None:
+            # inherited by workers and forkserver, before any of them starts
+            os.environ.update(thread_env(options.worker_threads))
 
         self.__port = port
         self.__processes = processes
-        self.__ctx = multiprocessing.get_context('spawn')
+        self.__backlog = options.backlog if options.backlog is not None else processes
+        self.__start_method = options.start_method
+        self.__shm_threshold = options.shm_threshold
+        self.__cpus = worker_cpus(options.affinity, processes)
+        self.__recycle = dict(max_tasks=options.max_tasks_per_worker, max_memory=options.max_worker_memory,
+                              spares=options.spare_workers)
+        self.__ctx = get_context(options.start_method)
 
         # using subprocess to copy file
         self.__executor = ProcessPoolExecutor(mp_context=self.__ctx, max_workers=processes)
@@ -42,6 +324,40 @@ class Node(object):
         self.__script_path: Optional[str] = None
         self.__pool: Optional[ProcessDistribute] = None
 
+        self.__direct = options.direct
+        self.__call_port = options.call_port if options.call_port is not None else port + 1
+        self.__local_ipc = options.local_ipc and zmq.has('ipc')
+        self.__workers: List[multiprocessing.Process] = []
+        self.__serial: Optional[multiprocessing.Value] = None
+        # tasks of workers in direct mode, the one running a cancelled task is signalled
+        self.__direct_tasks = DirectTasks(self.__ctx, self.__processes) if options.direct else None
+
+        # work files cached in local dir, reported to monster for locality
+        self.__files = BloomFilter()
+        self.__files_lock = threading.Lock()
+
+        # results of STREAM waiting for NEXT
+        self.__streams = StreamTable()
+
+        # objects put by monster, referenced by ObjectRef in arguments
+        self.__objects = ObjectStore(f'{port}')
+
+        # tasks wait here by priority, instead of FIFO for pool workers
+        self.__scheduler = PriorityScheduler(processes, options.aging)
+        # then wait for memory, memory of each task is declared at SETUP or learned from workers
+        self.__admission: Optional[AdmissionControl] = None
+        if options.memory_watermark is not None:
+            self.__admission = AdmissionControl(options.memory_watermark, options.admission_wait)
+
+        # cancel tokens of running tasks by task id
+        self.__tasks: Dict[str, CancelToken] = {}
+        self.__cancelled: 'OrderedDict[str, bool]' = OrderedDict()
+        self.__tasks_lock = threading.Lock()
+
+        # files being broadcast to local dir
+        self.__broadcasts: Dict[str, BroadcastReceiver] = {}
+        self.__broadcasts_lock = threading.Lock()
+
         self.__timeout_ms = 1000
 
         self.__functions: Dict[str, Callable[[Message], Message]] = {
@@ -49,12 +365,26 @@ class Node(object):
             'INFO': self.info,
             'SETUP': self.setup,
             'CALL': self.call,
+            'BATCH': self.batch,
+            'STREAM': self.stream,
+            'NEXT': self.next,
+            'DROP': self.drop,
             'MOUNT': self.mount,
+            'CANCEL': self.cancel,
+            'PUT': self.put,
+            'FREE': self.free,
+            'BCAST_BEGIN': self.bcast_begin,
+            'BCAST_CHUNK': self.bcast_chunk,
+            'BCAST_END': self.bcast_end,
         }
 
     def run(self) -> NoReturn:
         def target(req: bytes) -> bytes:
-            msg = Message.load(req)
+            try:
+                msg = Message.load(req)
+            except Exception as e:
+                logger.error(f'Failed to load request: {e}')
+                return Message('ERROR', str(e)).bytes()
 
             if msg.cmd.upper() == 'CLOSE':
                 return Message('ERROR', 'Can not close server at current version').bytes()
@@ -67,23 +397,60 @@ class Node(object):
 
             try:
                 ret = handler(msg)
-                logger.debug(f'Response {ret}')
+                # lazy formatting, replies may hold large results
+                logger.debug('Response %s', ret)
                 return ret.bytes()
             except Exception as e:
                 logger.error(e)
                 return Message('ERROR', str(e)).bytes()
 
-        rep = MultiThreadRep(port=self.__port, target=target, threads=self.__processes)
+        endpoints = []
+        if self.__local_ipc:
+            path = local_socket_path(self.__port)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            endpoints.append(f'ipc://{path}')
+        threads = self.__processes + self.__backlog + CONTROL_THREADS
+        max_pending = self.__processes * MAX_PENDING_PER_PROCESS
+        # monster sends the task to other nodes, like under memory pressure
+        overflow = Message('BUSY', 'queue', pending=max_pending).bytes()
+        rep = MultiThreadRep(port=self.__port, target=target, threads=threads,
+                             endpoints=endpoints, max_pending=max_pending, overflow=overflow)
+
+        if self.__direct:
+            backend = direct_socket_path(self.__port)
+            os.makedirs(os.path.dirname(backend), exist_ok=True)
+            frontends = [f'tcp://*:{self.__call_port}']
+            if self.__local_ipc:
+                frontends.append(f'ipc://{local_socket_path(self.__call_port)}')
+            broker = LoadBalancer(frontends, f'ipc://{backend}', rep.context, max_pending, overflow)
+            threading.Thread(target=broker.run, daemon=True).start()
+            logger.info(f"Serve direct call :{self.__call_port}")
 
         logger.info(f"Serve node :{self.__port}")
 
         rep.run()
 
     def info(self, msg: Message) -> Message:
-        return Message('OK', processes=self.__processes)
+        with self.__files_lock:
+            files = self.__files.bytes()
+        info = dict(processes=self.__processes, files=files, nodeid=get_nodeid(), objects=len(self.__objects))
+        if self.__direct:
+            info['call_port'] = self.__call_port
+        else:
+            info['queued'] = self.__scheduler.queued()
+        if self.__admission is not None:
+            info['memory'] = self.__admission.pressure()
+        if self.__local_ipc:
+            info['ipc'] = f'ipc://{local_socket_path(self.__port)}'
+            if self.__direct:
+                info['call_ipc'] = f'ipc://{local_socket_path(self.__call_port)}'
+        return Message('OK', **info)
 
     def setup(self, msg: Message) -> Message:
         script_content = msg.args[0]
+        preload = [*(msg.kwargs.get('preload', None) or []), *script_preload(script_content)]
+        if self.__admission is not None:
+            self.__admission.reset(msg.kwargs.get('memory', None))
 
         # script_dir = script_cache_dir()
         # os.makedirs(script_dir, exist_ok=True)
@@ -101,40 +468,273 @@ class Node(object):
         #
         # logger.debug(f'Setup {script_path}')
 
+        if self.__direct:
+            self.__setup_direct(script_content, preload)
+            return Message('OK')
+
+        # streams hold workers
+        self.__streams.clear()
         if self.__pool is not None:
             self.__pool.shutdown()
 
         # self.__pool = ProcessDistribute(pathlib.Path(script_path), self.__processes)
-        self.__pool = ProcessDistribute(script_content, self.__processes)
+        self.__pool = ProcessDistribute(script_content, self.__processes,
+                                        start_method=self.__start_method,
+                                        preload=preload,
+                                        shm_threshold=self.__shm_threshold,
+                                        objects=self.__objects.namespace,
+                                        cpus=self.__cpus,
+                                        on_memory=self.__admission.learn if self.__admission is not None else None,
+                                        **self.__recycle)
 
         return Message('OK')
 
-    def call(self, msg: Message) -> Message:
-        # copy work files to local
+    def __setup_direct(self, script_content: str, preload: List[str]):
+        for worker in self.__workers:
+            worker.terminate()
+        for worker in self.__workers:
+            worker.join()
+
+        # keep serial alive until workers started
+        self.__serial = self.__ctx.Value('i', 0, lock=True)
+        backend = f'ipc://{direct_socket_path(self.__port)}'
+        args = (script_content, self.__serial, backend, self.__objects.namespace, preload, self.__direct_tasks,
+                self.__cpus)
+        # preloaded by forkserver if it is not started yet
+        ctx = get_context(self.__start_method, preload)
+        self.__workers = [
+            ctx.Process(target=direct_worker, args=args, kwargs=dict(slot=slot), daemon=True)
+            for slot in range(self.__processes)
+        ]
+        for worker in self.__workers:
+            worker.start()
+
+    def __copy_files(self, values: Any, direction: str):
         results: List[Future] = []
-        for arg in each_file(msg.args):
+        for arg in each_file(values):
             if arg.copied:
-                logger.debug(f'COPY(WORK->LOCAL): {arg.path}')
+                logger.debug(f'COPY({direction}): {arg.path}')
                 results.append(self.__executor.submit(copy_file, arg))
         for result in results:
             result.result()
+        if direction == 'WORK->LOCAL':
+            keys = [arg.locality_key for arg in each_file(values) if arg.locality_key is not None]
+            if keys:
+                with self.__files_lock:
+                    for key in keys:
+                        self.__files.add(key)
+
+    def __run_task(self, msg: Message, run: Callable[[Optional[CancelToken]], Message]) -> Message:
+        """
+        Run in a slot of scheduler by `priority` header,
+        with a cancel token if the message has `task` or `timeout` header.
+        """
+        priority = msg.headers.get('priority', 0)
+        task_id = msg.headers.get('task', None)
+        timeout = msg.headers.get('timeout', None)
+        if task_id is None and timeout is None:
+            with self.__scheduler.slot(priority):
+                return self.__admit(run, None)
+        token = CancelToken(timeout)
+        if task_id is not None:
+            with self.__tasks_lock:
+                if self.__cancelled.pop(task_id, False):
+                    return Message('CANCELLED', task_id)
+                self.__tasks[task_id] = token
+        try:
+            with self.__scheduler.slot(priority, token):
+                return self.__admit(run, token)
+        except TaskCancelled as _:
+            logger.info(f'Cancelled task {task_id}')
+            return Message('CANCELLED', task_id)
+        except TaskTimeout as _:
+            logger.info(f'Task {task_id} timed out after {timeout}s')
+            return Message('TIMEOUT', task_id, timeout)
+        finally:
+            if task_id is not None:
+                with self.__tasks_lock:
+                    self.__tasks.pop(task_id, None)
+
+    def __admit(self, run: Callable[[Optional[CancelToken]], Message], token: Optional[CancelToken]) -> Message:
+        """
+        Run when memory of the task is available, reply BUSY if it is not in admission wait.
+        """
+        if self.__admission is None:
+            return run(token)
+        ticket = self.__admission.admit(token.check if token is not None else None)
+        if ticket is None:
+            pressure = self.__admission.pressure()
+            logger.warning(f'Refused task under memory pressure: {pressure}')
+            return Message('BUSY', 'memory', **pressure)
+        try:
+            return run(token)
+        finally:
+            self.__admission.release(ticket)
+
+    def cancel(self, msg: Message) -> Message:
+        """
+        Cancel task by id, its worker is killed and replaced. A task not arrived yet is cancelled on arrival.
+        :return: OK(True) if the task was running or waiting for a worker
+        """
+        task_id = msg.args[0]
+        if self.__direct:
+            return Message('OK', self.__cancel_direct(task_id))
+        with self.__tasks_lock:
+            token = self.__tasks.get(task_id, None)
+            if token is None:
+                self.__cancelled[task_id] = True
+                while len(self.__cancelled) > MAX_CANCELLED:
+                    self.__cancelled.popitem(last=False)
+        if token is None:
+            return Message('OK', False)
+        token.cancel()
+        return Message('OK', True)
+
+    def __cancel_direct(self, task_id: str) -> bool:
+        """
+        Calls bypass node in direct mode, signal the worker running the task, a task not started is refused.
+        :return: the task was running
+        """
+        slot = self.__direct_tasks.cancel(task_id)
+        if slot is None:
+            return False
+        worker = self.__workers[slot]
+        if worker.is_alive():
+            os.kill(worker.pid, signal.SIGUSR1)
+        return True
 
-        ret = self.__pool.call(*msg.args, **msg.kwargs)
-        if isinstance(ret, tuple):
-            args = ret
-        else:
-            args = (ret, )
+    def call(self, msg: Message) -> Message:
+        def run(token: Optional[CancelToken]) -> Message:
+            # copy work files to local
+            self.__copy_files(msg.args, 'WORK->LOCAL')
+
+            ret = self.__pool.call_with(token, *msg.args, **msg.kwargs)
+            if isinstance(ret, tuple):
+                args = ret
+            else:
+                args = (ret, )
+
+            # copy local files to temp
+            self.__copy_files(args, 'LOCAL->TEMP')
+
+            return Message('OK', *args)
+
+        return self.__run_task(msg, run)
+
+    def batch(self, msg: Message) -> Message:
+        """
+        Run a batch of positional arguments in one worker, reply results in order.
+        """
+        def run(token: Optional[CancelToken]) -> Message:
+            batch = msg.args[0]
+            self.__copy_files(batch, 'WORK->LOCAL')
+            start = time.perf_counter()
+            results = self.__pool.call_batch(batch, token=token)
+            # seconds in worker, monster sizes adaptive chunks by it
+            elapsed = time.perf_counter() - start
+            self.__copy_files(results, 'LOCAL->TEMP')
+            return Message('OK', results).header(elapsed=elapsed)
+
+        return self.__run_task(msg, run)
+
+    def __stream_values(self, values: Iterator[Any]) -> Iterator[Any]:
+        try:
+            for value in values:
+                self.__copy_files(value, 'LOCAL->TEMP')
+                yield value
+        finally:
+            values.close()
+
+    def stream(self, msg: Message) -> Message:
+        """
+        Start call in a worker, values are pulled by NEXT in chunks as generator `main` yields them.
+        The stream holds a slot of scheduler and its admitted memory until it ends, is dropped or expires.
+        """
+        self.__scheduler.acquire(msg.headers.get('priority', 0))
+        ticket = None
+        if self.__admission is not None:
+            ticket = self.__admission.admit()
+            if ticket is None:
+                self.__scheduler.release()
+                pressure = self.__admission.pressure()
+                logger.warning(f'Refused stream under memory pressure: {pressure}')
+                return Message('BUSY', 'memory', **pressure)
+
+        def release():
+            if ticket is not None:
+                self.__admission.release(ticket)
+            self.__scheduler.release()
+
+        try:
+            self.__copy_files(msg.args, 'WORK->LOCAL')
+            values = self.__pool.call_iter(*msg.args, **msg.kwargs)
+        except BaseException:
+            release()
+            raise
+        return Message('OK', stream=self.__streams.open(self.__stream_values(values), release))
+
+    def next(self, msg: Message) -> Message:
+        stream_id = msg.args[0]
+        try:
+            return Message('OK', self.__streams.next(stream_id))
+        except KeyError:
+            return Message('ERROR', f'Unknown or expired stream {stream_id}')
+
+    def drop(self, msg: Message) -> Message:
+        self.__streams.drop(msg.args[0])
+        return Message('OK')
 
-        # copy local files to temp
-        results: List[Future] = []
-        for arg in each_file(args):
-            if arg.copied:
-                logger.debug(f'COPY(LOCAL->TEMP): {arg.path}')
-                results.append(self.__executor.submit(copy_file, arg))
-        for result in results:
-            result.result()
+    def put(self, msg: Message) -> Message:
+        """
+        Keep pickled object in shared memory, workers load it once when its ObjectRef is in arguments.
+        """
+        ref, data = msg.args
+        self.__objects.put(ref, data)
+        return Message('OK')
+
+    def free(self, msg: Message) -> Message:
+        self.__objects.free(msg.args[0])
+        return Message('OK')
 
-        return Message('OK', *args)
+    def bcast_begin(self, msg: Message) -> Message:
+        """
+        Start receiving a file into local dir, forwarded to the nodes listed while receiving.
+        """
+        bcast_id, header, nodes, fanout = msg.args
+        receiver = BroadcastReceiver(bcast_id, header, nodes, fanout, msg.kwargs.get('timeout', None))
+        with self.__broadcasts_lock:
+            self.__broadcasts[bcast_id] = receiver
+        logger.debug(f'BCAST {header["path"]} to {len(nodes)} nodes after this')
+        return Message('OK')
+
+    def bcast_chunk(self, msg: Message) -> Message:
+        bcast_id, offset, data = msg.args
+        with self.__broadcasts_lock:
+            receiver = self.__broadcasts.get(bcast_id, None)
+        if receiver is None:
+            return Message('ERROR', f'Unknown broadcast {bcast_id}')
+        try:
+            receiver.write(offset, data)
+        except Exception as _:
+            with self.__broadcasts_lock:
+                self.__broadcasts.pop(bcast_id, None)
+            receiver.abort()
+            raise
+        return Message('OK')
+
+    def bcast_end(self, msg: Message) -> Message:
+        bcast_id = msg.args[0]
+        with self.__broadcasts_lock:
+            receiver = self.__broadcasts.pop(bcast_id, None)
+        if receiver is None:
+            return Message('ERROR', f'Unknown broadcast {bcast_id}')
+        errors = receiver.finish()
+        key = receiver.file.locality_key
+        with self.__files_lock:
+            self.__files.add(key)
+        if errors:
+            return Message('ERROR', '; '.join(f'{k}: {v}' for k, v in errors.items()))
+        return Message('OK')
 
     def mount(self, msg: Message) -> Message:
         m = msg.args[0]
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Optional, Tuple
+
+from .tunnel import Message
+
+__all__ = [
+    'ObjectRef',
+    'ObjectStore',
+    'put_request',
+    'resolve_arguments',
+]
+
+# unpickled objects kept in each worker, least recently used are dropped
+WORKER_CACHE = 16
+
+__namespace: Optional[str] = None
+__cache: 'OrderedDict[str, Any]' = OrderedDict()
+
+
+class ObjectRef(object):
+    def __init__(self, object_id: str, size: int):
+        """
+        Handle of an object put on nodes, only this crosses the network in arguments.
+        :param object_id: digest of pickled object
+        :param size: bytes of pickled object
+        """
+        self.object_id = object_id
+        self.size = size
+
+    def __eq__(self, other):
+        return isinstance(other, ObjectRef) and other.object_id == self.object_id
+
+    def __hash__(self):
+        return hash(self.object_id)
+
+    def __repr__(self):
+        return f'ObjectRef({self.object_id}, {self.size})'
+
+
+def put_request(obj: Any) -> Tuple[ObjectRef, bytes]:
+    """
+    Serialize PUT request once, then send same bytes to every node.
+    :return: reference of object and request
+    """
+    data = pickle.dumps(obj, protocol=5)
+    ref = ObjectRef(hashlib.blake2b(data, digest_size=16).hexdigest(), len(data))
+    return ref, Message('PUT', ref, data).bytes()
+
+
+def block_name(namespace: str, object_id: str) -> str:
+    # short enough for 31 chars limit of macOS
+    return f'qdo{namespace}_{object_id[:20]}'
+
+
+class ObjectStore(object):
+    def __init__(self, namespace: str):
+        """
+        Pickled objects of node in shared memory, loaded by workers on first use.
+        :param namespace: unique among nodes on the same host, e.g. serve port
+        """
+        self.__namespace = namespace
+        self.__lock = threading.Lock()
+        self.__blocks: Dict[str, SharedMemory] = {}
+
+    @property
+    def namespace(self) -> str:
+        return self.__namespace
+
+    def put(self, ref: ObjectRef, data: bytes):
+        with self.__lock:
+            if ref.object_id in self.__blocks:
+                return
+            name = block_name(self.__namespace, ref.object_id)
+            try:
+                block = SharedMemory(name=name, create=True, size=max(len(data), 1))
+            except FileExistsError:
+                # left by a node killed before freeing
+                stale = SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                block = SharedMemory(name=name, create=True, size=max(len(data), 1))
+            block.buf[:len(data)] = data
+            self.__blocks[ref.object_id] = block
+
+    def free(self, ref: ObjectRef) -> bool:
+        with self.__lock:
+            block = self.__blocks.pop(ref.object_id, None)
+        if block is None:
+            return False
+        block.close()
+        block.unlink()
+        return True
+
+    def __contains__(self, ref: ObjectRef) -> bool:
+        return ref.object_id in self.__blocks
+
+    def __len__(self):
+        return len(self.__blocks)
+
+    def clear(self):
+        with self.__lock:
+            blocks = list(self.__blocks.values())
+            self.__blocks.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def set_namespace(namespace: Optional[str]):
+    """
+    Called in worker, objects are loaded from store of node with this namespace.
+    """
+    global __namespace
+    __namespace = namespace
+    __cache.clear()
+
+
+def load_object(ref: ObjectRef) -> Any:
+    obj = __cache.get(ref.object_id, ref)
+    if obj is not ref:
+        __cache.move_to_end(ref.object_id)
+        return obj
+    if __namespace is None:
+        raise RuntimeError(f'{ref} can not be resolved out of node')
+    try:
+        block = SharedMemory(name=block_name(__namespace, ref.object_id))
+    except FileNotFoundError:
+        raise KeyError(f'{ref} not put or freed on node') from None
+    try:
+        obj = pickle.loads(block.buf[:ref.size])
+    finally:
+        block.close()
+    __cache[ref.object_id] = obj
+    while len(__cache) > WORKER_CACHE:
+        __cache.popitem(last=False)
+    return obj
+
+
+def resolve(value: Any) -> Any:
+    if isinstance(value, ObjectRef):
+        return load_object(value)
+    return value
+
+
+def resolve_arguments(args: Tuple, kwargs: Dict) -> Tuple[Tuple, Dict]:
+    """
+    Replace ObjectRef in arguments, or directly in list, tuple and dict arguments, with objects.
+    """
+    def resolve_value(value):
+        if isinstance(value, (list, tuple)) and any(isinstance(v, ObjectRef) for v in value):
+            return [resolve(v) for v in value] if isinstance(value, list) else tuple(resolve(v) for v in value)
+        if isinstance(value, dict) and any(isinstance(v, ObjectRef) for v in value.values()):
+            return {k: resolve(v) for k, v in value.items()}
+        return resolve(value)
+
+    if not any(isinstance(v, (ObjectRef, list, tuple, dict)) for v in (*args, *kwargs.values())):
+        return args, kwargs
+    return tuple(resolve_value(v) for v in args), {k: resolve_value(v) for k, v in kwargs.items()}
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,97 @@
 # -*- coding: utf-8 -*-
 
 import os
+import ast
 import sys
+import threading
+import inspect
+import functools
 import importlib.util
 import multiprocessing
 import pathlib
-from multiprocessing.pool import Pool
-from typing import Callable, Union, Optional, Any, Tuple, List, Iterable, Iterator
+from multiprocessing.context import BaseContext
+from typing import Callable, Union, Optional, Any, Tuple, List, Iterable, Iterator, Dict
+
+from .workers import WorkerPool, WorkerIterator, AsyncCall, CancelToken
+from .shm import SharedMemoryPool, share_arguments, load_arguments, share_result, load_result
+from .objects import set_namespace, resolve_arguments
+from .affinity import pin_worker
+from .logger import logger
 
 
 __all__ = [
     'ProcessDistribute',
+    'get_context',
+    'script_preload',
 ]
 
 ModuleType = type(sys)
 
+START_METHODS = ('spawn', 'forkserver', 'fork')
+DEFAULT_START_METHOD = 'spawn'
+
+__forkserver_lock = threading.Lock()
+__forkserver_preload: Optional[Tuple[str, ...]] = None
+
+
+def get_context(start_method: str = None, preload: Iterable[str] = None) -> BaseContext:
+    """
+    Get multiprocessing context.
+    :param start_method: spawn|forkserver|fork, default spawn
+    :param preload: modules imported once in forkserver, then shared copy-on-write by forked workers,
+                    the forkserver is started once in a process, only the first preload takes effect in it
+    :return: BaseContext
+    """
+    global __forkserver_preload
+
+    if start_method is None:
+        start_method = DEFAULT_START_METHOD
+    if start_method not in START_METHODS:
+        raise ValueError(f'The start method should be {"|".join(START_METHODS)}, got {start_method}')
+    ctx = multiprocessing.get_context(start_method)
+    if start_method != 'forkserver':
+        return ctx
+
+    modules = tuple(sorted(set(preload or ())))
+    if not modules:
+        return ctx
+    with __forkserver_lock:
+        if __forkserver_preload is None:
+            # preload only takes effect when forkserver starts
+            ctx.set_forkserver_preload(list(modules))
+            __forkserver_preload = modules
+        elif not set(modules) <= set(__forkserver_preload):
+            missing = sorted(set(modules) - set(__forkserver_preload))
+            logger.info(f'Forkserver is started with preload {list(__forkserver_preload)}, '
+                        f'workers import {missing} themselves')
+    return ctx
+
+
+def script_preload(script: str) -> List[str]:
+    """
+    Read module names declared by `PRELOAD = [...]` in script, without executing it.
+    :param script: script content
+    :return: module names
+    """
+    try:
+        tree = ast.parse(script)
+    except SyntaxError:
+        return []
+    for node in tree.body:
+        if not isinstance(node, ast.Assign):
+            continue
+        if not any(isinstance(t, ast.Name) and t.id == 'PRELOAD' for t in node.targets):
+            continue
+        try:
+            value = ast.literal_eval(node.value)
+        except ValueError:
+            raise ValueError('The PRELOAD in script should be a literal list of module names')
+        if isinstance(value, str):
+            return [value]
+        return [str(v) for v in value]
+    return []
+
+
 def load_script_module(script: [str, pathlib.Path], module_name: str = None) -> Tuple[ModuleType, Callable, Callable]:
     if isinstance(script, pathlib.Path) or os.path.isfile(script):
         script_path = str(script)
@@ -47,26 +124,63 @@ def load_script_module(script: [str, pathlib.Path], module_name: str = None) ->
 __subprocess_module: Optional[ModuleType] = None
 __subprocess_init: Optional[Callable] = None
 __subprocess_main: Optional[Callable] = None
+__subprocess_batch: Optional[Callable] = None
 __subprocess_id: Optional[int] = None
 
 
-def init_subprocess(script: Union[str, pathlib.Path, Callable], serial: multiprocessing.Value):
+def import_preload(preload: Iterable[str]):
+    """
+    Import preload modules in worker, already imported if preloaded by forkserver.
+    """
+    for name in preload or ():
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning(f'Failed to preload {name}: {e}')
+
+
+def set_subprocess_id(index: int, cpus: List[List[int]] = None):
+    """
+    Called in worker, set `PID` and `PROCESS_ID` to its index and pin it to the cpus of the index.
+    A worker replacing another takes its index, so ids stay in `[0, processes)`.
+    :param cpus: cpus of each worker index
+    """
+    global __subprocess_id
+
+    __subprocess_id = index
+    os.environ['PROCESS_ID'] = f'{index}'
+    os.environ['PID'] = f'{index}'
+    pin_worker(index, cpus)
+
+
+def init_subprocess(script: Union[str, pathlib.Path, Callable], serial: multiprocessing.Value = None,
+                    objects: str = None, cpus: List[List[int]] = None, preload: Iterable[str] = None):
+    """
+    :param serial: counter giving worker ids, None if ids are set by `set_subprocess_id`
+    :param objects: namespace of node object store, ObjectRef in arguments are resolved from it
+    :param cpus: cpus of each worker index, worker is pinned before loading script
+    :param preload: modules imported before loading script
+    """
     global __subprocess_module
     global __subprocess_init
     global __subprocess_main
-    global __subprocess_id
-
-    with serial.get_lock():
-        __subprocess_id = serial.value
-        serial.value += 1
+    global __subprocess_batch
 
-    os.environ['PROCESS_ID'] = f'{__subprocess_id}'
-    os.environ['PID'] = f'{__subprocess_id}'
+    if serial is not None:
+        with serial.get_lock():
+            index = serial.value
+            serial.value += 1
+        set_subprocess_id(index, cpus)
+    set_namespace(objects)
+    import_preload(preload)
 
     if callable(script):
         __subprocess_main = script
     elif isinstance(script, (str, pathlib.Path)):
         __subprocess_module, __subprocess_main, __subprocess_init = load_script_module(script)
+        __subprocess_batch = getattr(__subprocess_module, 'main_batch', None)
+        if __subprocess_batch is not None and not callable(__subprocess_batch):
+            raise ValueError("The specified script does not have a callable 'main_batch' function.")
     else:
         raise ValueError("The specified script does not have a callable 'main' function.")
     if __subprocess_init is not None:
@@ -77,20 +191,90 @@ def run_subprocess(*args, **kwargs):
     global __subprocess_main
     if __subprocess_main is None:
         raise RuntimeError("Main function has not been initialized.")
-    return __subprocess_main(*args, **kwargs)
+    args, kwargs = resolve_arguments(args, kwargs)
+    ret = __subprocess_main(*args, **kwargs)
+    if inspect.isgenerator(ret):
+        # generator can not be sent back, collect yielded values
+        return list(ret)
+    return ret
+
+
+def run_subprocess_iter(*args, **kwargs) -> Iterator[Any]:
+    """
+    :return: generator `main` itself, or a generator of the only value returned by `main`
+    """
+    global __subprocess_main
+    if __subprocess_main is None:
+        raise RuntimeError("Main function has not been initialized.")
+    args, kwargs = resolve_arguments(args, kwargs)
+    ret = __subprocess_main(*args, **kwargs)
+    if inspect.isgenerator(ret):
+        return ret
+    return iter_value(ret)
+
+
+def iter_value(value: Any) -> Iterator[Any]:
+    yield value
+
+
+def run_subprocess_batch(batch: List[Tuple]) -> List[Any]:
+    """
+    Run a batch of positional arguments by optional `main_batch(batch)` in script, which returns results in order.
+    Fallback to calling `main` on each arguments.
+    """
+    global __subprocess_batch
+    if __subprocess_batch is None:
+        return [run_subprocess(*args) for args in batch]
+    results = list(__subprocess_batch([resolve_arguments(args, {})[0] for args in batch]))
+    if len(results) != len(batch):
+        raise ValueError(f"The 'main_batch' returned {len(results)} results for {len(batch)} arguments.")
+    return results
+
+
+def run_subprocess_shared(args: Tuple, kwargs: Dict, threshold: int):
+    args, kwargs = load_arguments(args, kwargs)
+    return share_result(run_subprocess(*args, **kwargs), threshold)
 
 
 class ProcessDistribute(object):
-    def __init__(self, script: Union[str, pathlib.Path, Callable], size: int = None):
+    def __init__(self, script: Union[str, pathlib.Path, Callable], size: int = None,
+                 start_method: str = None,
+                 preload: Iterable[str] = None,
+                 shm_threshold: int = 0,
+                 objects: str = None,
+                 cpus: List[List[int]] = None,
+                 on_memory: Callable[[int], None] = None,
+                 max_tasks: int = None,
+                 max_memory: int = None,
+                 spares: int = None):
+        """
+        :param script: script path, content or main function
+        :param size: processes
+        :param start_method: spawn|forkserver|fork
+        :param preload: modules preloaded by forkserver
+        :param shm_threshold: `call` pass buffers not smaller than this by shared memory, 0 for disable
+        :param objects: namespace of node object store resolving ObjectRef in arguments
+        :param cpus: cpus of each worker index, e.g. from `quickdist.affinity.worker_cpus`,
+                     a spare is pinned with its threads when it takes the index of a replaced worker
+        :param on_memory: called after each call with bytes its worker peaked above resident memory before it
+        :param max_tasks: tasks of a worker before it is replaced by a spare, None for no limit
+        :param max_memory: resident bytes of a worker after a task, beyond which it is replaced, None for no limit
+        :param spares: workers started ahead for replacing, default 1 if a limit is set
+        """
         self.__size = size
-        self.__ctx = multiprocessing.get_context('spawn')
+        self.__ctx = get_context(start_method, preload)
+        self.__shm_threshold = shm_threshold
+        self.__shm_pool: Optional[SharedMemoryPool] = SharedMemoryPool() if shm_threshold > 0 else None
 
-        serial = self.__ctx.Value('i', 0, lock=True)
-
-        self.__pool: Pool = self.__ctx.Pool(
-            processes=size,
+        self.__pool = WorkerPool(
+            self.__ctx, size or os.cpu_count(),
             initializer=init_subprocess,
-            initargs=(script, serial),
+            initargs=(script, None, objects, None, preload),
+            on_index=functools.partial(set_subprocess_id, cpus=cpus),
+            on_memory=on_memory,
+            max_tasks=max_tasks,
+            max_memory=max_memory,
+            spares=spares,
         )
 
     def __enter__(self):
@@ -102,21 +286,50 @@ class ProcessDistribute(object):
     def shutdown(self):
         self.__pool.close()
         self.__pool.join()
+        if self.__shm_pool is not None:
+            self.__shm_pool.close()
 
-    def call_async(self, *args, **kwargs):
+    def call_async(self, *args, **kwargs) -> AsyncCall:
         return self.__pool.apply_async(run_subprocess, args, kwargs)
 
     def call(self, *args, **kwargs) -> Any:
-        return self.__pool.apply(run_subprocess, args, kwargs)
+        return self.call_with(None, *args, **kwargs)
+
+    def call_with(self, token: Optional[CancelToken], *args, **kwargs) -> Any:
+        """
+        Call that raises TaskCancelled or TaskTimeout when token fires, the worker running it is replaced.
+        """
+        if self.__shm_pool is None:
+            return self.__pool.apply(run_subprocess, args, kwargs, token=token)
+        args, kwargs, blocks = share_arguments(args, kwargs, self.__shm_pool, self.__shm_threshold)
+        try:
+            ret = self.__pool.apply(run_subprocess_shared, (args, kwargs, self.__shm_threshold), token=token)
+        finally:
+            for block in blocks:
+                self.__shm_pool.release(block)
+        return load_result(ret)
+
+    def call_iter(self, *args, **kwargs) -> WorkerIterator:
+        """
+        Run `main` in one worker, iterate values as generator `main` yields them.
+        The worker is held until the iterator is exhausted or closed.
+        """
+        return self.__pool.iterate(run_subprocess_iter, args, kwargs)
+
+    def call_batch(self, batch: List[Tuple], token: CancelToken = None) -> List[Any]:
+        """
+        Run batch of positional arguments in one worker, by `main_batch` if script has it.
+        """
+        return self.__pool.apply(run_subprocess_batch, (batch, ), token=token)
 
     def map(self, iterable, chunk_size=None) -> List[Any]:
-        return self.__pool.map(run_subprocess, iterable, chunksize=chunk_size)
+        return self.__pool.map(run_subprocess, iterable, chunk_size=chunk_size)
 
     def imap(self, iterable, chunk_size=1) -> Iterator[Any]:
-        return self.__pool.imap(run_subprocess, iterable, chunksize=chunk_size)
+        return self.__pool.imap(run_subprocess, iterable, chunk_size=chunk_size)
 
     def imap_unordered(self, iterable, chunk_size=1) -> Iterator[Any]:
-        return self.__pool.imap_unordered(run_subprocess, iterable, chunksize=chunk_size)
+        return self.__pool.imap(run_subprocess, iterable, chunk_size=chunk_size, ordered=False)
 
     def __call__(self, *args, **kwargs) -> Any:
         return self.__pool.apply(run_subprocess, args, kwargs)
@@ -4,17 +4,64 @@
 This file only run in subprocess
 """
 
-from typing import Dict
+import time
+from typing import Dict, List, Optional, Union
 
-from .pyzmq.binding import Req
+import zmq
+
+from .pyzmq.binding import Req, TransportOptions, endpoint
 from .tunnel import Message
 from .logger import logger
 from .mount import Mount
+from .objects import ObjectRef
+
+
+def setup_request(script_content: str, preload: List[str] = None, memory: int = None) -> bytes:
+    """
+    Serialize SETUP request once, then send same bytes to every node.
+    :param memory: bytes of memory of each task, for admission control on nodes
+    """
+    return Message('SETUP', script_content, preload=preload, memory=memory).bytes()
+
+
+class NodeLostError(ConnectionError):
+    pass
+
+
+class ClusterError(RuntimeError):
+    def __init__(self, action: str, errors: Dict[str, BaseException]):
+        """
+        :param action: failed action
+        :param errors: node address to raised exception
+        """
+        self.action = action
+        self.errors = errors
+        details = '; '.join(f'{k}: {v!r}' for k, v in errors.items())
+        super().__init__(f'{action} failed on {len(errors)} node(s): {details}')
+
+    def __reduce__(self):
+        # raised in proxy processes, sent back to main process
+        return type(self), (self.action, self.errors)
 
 
 class Proxy(object):
-    def __init__(self, host: str, port: int):
-        self.__client = Req(host, port)
+    def __init__(self, host: str, port: int = None, heartbeat_port: Union[int, str] = None,
+                 transport: TransportOptions = None):
+        """
+        :param host: node host, or endpoint URL like `ipc:///tmp/node.ipc`
+        :param port: node port
+        :param heartbeat_port: port or endpoint URL to ping node while waiting replies, default `port`
+        :param transport: socket options, default set by `set_transport`
+        """
+        self.__transport = transport
+        self.__client = Req(host, port, options=transport)
+        if heartbeat_port is None:
+            heartbeat_port = port
+        if isinstance(heartbeat_port, str):
+            self.__heartbeat_endpoint = heartbeat_port
+        else:
+            self.__heartbeat_endpoint = endpoint(host, heartbeat_port)
+        self.__heartbeat: Optional[Req] = None
 
     @property
     def host(self):
@@ -24,38 +71,126 @@ class Proxy(object):
     def port(self):
         return self.__client.port
 
+    @property
+    def transport(self) -> Optional[TransportOptions]:
+        return self.__transport
+
     def close(self):
         self.__client.close()
-
-    def __send(self, cmd: str, *args, **kwargs) -> Message:
-        self.__client.socket.send(Message(cmd, *args, **kwargs).bytes())
-        body = self.__client.socket.recv()
+        if self.__heartbeat is not None:
+            self.__heartbeat.close()
+
+    @staticmethod
+    def __discard(client: Req):
+        # REQ socket is stuck after a lost reply, drop pending messages
+        client.socket.setsockopt(zmq.LINGER, 0)
+        client.close()
+
+    def __reset(self):
+        self.__discard(self.__client)
+        self.__client = Req(self.host, self.port, options=self.__transport)
+
+    def ping(self, timeout: float) -> bool:
+        """
+        :param timeout: seconds
+        :return: node replied in timeout
+        """
+        if self.__heartbeat is None:
+            self.__heartbeat = Req(self.__heartbeat_endpoint, options=self.__transport)
+        self.__heartbeat.socket.send(Message('PING').bytes())
+        if not self.__heartbeat.socket.poll(int(timeout * 1000)):
+            self.__discard(self.__heartbeat)
+            self.__heartbeat = None
+            return False
+        self.__heartbeat.socket.recv()
+        return True
+
+    def request(self, body: bytes, timeout: float = None,
+                heartbeat: float = None, liveness: int = 3) -> Message:
+        """
+        Send serialized message and wait reply.
+        :param body: serialized message
+        :param timeout: seconds, None for waiting forever
+        :param heartbeat: seconds between pings while waiting, None for no ping
+        :param liveness: missed pings before raising NodeLostError
+        :return: Message
+        """
+        socket = self.__client.socket
+        socket.send(body)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        missed = 0
+        while True:
+            wait = heartbeat
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+                wait = remaining if wait is None else min(wait, remaining)
+            if socket.poll(None if wait is None else int(wait * 1000)):
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                self.__reset()
+                raise TimeoutError(f'No reply in {timeout}s from {self.host}:{self.port}')
+            if heartbeat is None:
+                continue
+            if self.ping(heartbeat):
+                missed = 0
+                continue
+            missed += 1
+            if missed >= liveness:
+                self.__reset()
+                raise NodeLostError(f'Lost node {self.host}:{self.port} after {missed} missed heartbeats')
+
+        body = socket.recv()
         ret = Message.load(body)
         return ret
 
-    def setup(self, script_file: str):
-        with open(script_file, 'r', encoding='utf-8') as f:
-            script_content = f.read()
-        ret = self.__send('SETUP', script_content)
-        if ret.cmd != 'OK':
-            logger.error(ret)
-            raise RuntimeError(ret)
+    def __send(self, cmd: str, *args, **kwargs) -> Message:
+        return self.request(Message(cmd, *args, **kwargs).bytes())
 
-    def info(self) -> Dict:
-        ret = self.__send('INFO')
+    def __check(self, ret: Message):
         if ret.cmd != 'OK':
             logger.error(ret)
-            raise RuntimeError(ret)
+            raise RuntimeError(f'{ret} on {self.host}:{self.port}')
+
+    def setup(self, script_file: str, preload: List[str] = None, timeout: float = None):
+        with open(script_file, 'r', encoding='utf-8') as f:
+            script_content = f.read()
+        self.setup_bytes(setup_request(script_content, preload), timeout=timeout)
+
+    def setup_bytes(self, body: bytes, timeout: float = None):
+        """
+        Setup with request serialized by `setup_request`.
+        """
+        self.__check(self.request(body, timeout=timeout))
+
+    def info(self, timeout: float = None) -> Dict:
+        ret = self.request(Message('INFO').bytes(), timeout=timeout)
+        self.__check(ret)
         return ret.kwargs
 
     def call(self, *args, **kwargs) -> Message:
         return self.__send('CALL', *args, **kwargs)
 
-    def mount(self, mount: Mount):
-        ret = self.__send('MOUNT', mount)
-        if ret.cmd != 'OK':
-            logger.error(ret)
-            raise RuntimeError(ret)
+    def mount(self, mount: Mount, timeout: float = None):
+        ret = self.request(Message('MOUNT', mount).bytes(), timeout=timeout)
+        self.__check(ret)
+
+    def cancel(self, task_id: str, timeout: float = None) -> bool:
+        """
+        :return: task was running on node
+        """
+        ret = self.request(Message('CANCEL', task_id).bytes(), timeout=timeout)
+        self.__check(ret)
+        return ret.args[0]
+
+    def put_bytes(self, body: bytes, timeout: float = None):
+        """
+        Put object with request serialized by `put_request`.
+        """
+        self.__check(self.request(body, timeout=timeout))
+
+    def free(self, ref: ObjectRef, timeout: float = None):
+        self.__check(self.request(Message('FREE', ref).bytes(), timeout=timeout))
 
 
 def main():
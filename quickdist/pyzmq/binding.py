@@ -1,17 +1,144 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import uuid
 import threading
 import multiprocessing
-from typing import Optional, Union, NoReturn, Callable
+from collections import deque
+from typing import Optional, Union, NoReturn, Callable, Deque, List, Dict, Any
 
 import zmq
 
+from ..logger import logger
+
+__all__ = [
+    'endpoint',
+    'TransportOptions',
+    'set_transport',
+    'get_transport',
+    'shared_context',
+    'Context',
+    'Socket',
+    'Router',
+    'Dealer',
+    'READY',
+    'LoadBalancer',
+    'MultiThreadRep',
+    'Req',
+]
+
+
+def endpoint(host: str, port: Optional[int] = None) -> str:
+    """
+    :param host: host name, or an endpoint URL like `ipc:///tmp/node.ipc` with port ignored
+    :param port: tcp port
+    """
+    if '://' in host:
+        return host
+    return f'tcp://{host}:{port}'
+
+
+class TransportOptions(object):
+    def __init__(self, io_threads: int = 1,
+                 sndhwm: int = None,
+                 rcvhwm: int = None,
+                 sndbuf: int = None,
+                 rcvbuf: int = None,
+                 keepalive: bool = False,
+                 keepalive_idle: int = None,
+                 keepalive_interval: int = None,
+                 linger: int = None,
+                 immediate: bool = False):
+        """
+        zmq context and socket options, None for zmq default.
+        :param io_threads: I/O threads of the context shared in process, more for high bandwidth links
+        :param sndhwm: max queued outgoing messages of a socket
+        :param rcvhwm: max queued incoming messages of a socket
+        :param sndbuf: kernel send buffer bytes of tcp
+        :param rcvbuf: kernel receive buffer bytes of tcp
+        :param keepalive: tcp keepalive, detect dead peers behind firewalls and NAT
+        :param keepalive_idle: seconds idle before keepalive probes
+        :param keepalive_interval: seconds between keepalive probes
+        :param linger: milliseconds to keep pending messages after close, 0 for dropping
+        :param immediate: queue messages only on completed connections
+        """
+        self.io_threads = io_threads
+        self.sndhwm = sndhwm
+        self.rcvhwm = rcvhwm
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.linger = linger
+        self.immediate = immediate
+
+    def changed(self) -> Dict[str, Any]:
+        """
+        Options not default, compact to pass to other processes.
+        """
+        default = TransportOptions()
+        return {k: v for k, v in vars(self).items() if getattr(default, k) != v}
+
+    def apply(self, socket: zmq.Socket):
+        options = [
+            (zmq.SNDHWM, self.sndhwm),
+            (zmq.RCVHWM, self.rcvhwm),
+            (zmq.SNDBUF, self.sndbuf),
+            (zmq.RCVBUF, self.rcvbuf),
+            (zmq.LINGER, self.linger),
+        ]
+        if self.keepalive:
+            options += [
+                (zmq.TCP_KEEPALIVE, 1),
+                (zmq.TCP_KEEPALIVE_IDLE, self.keepalive_idle),
+                (zmq.TCP_KEEPALIVE_INTVL, self.keepalive_interval),
+            ]
+        if self.immediate:
+            options.append((zmq.IMMEDIATE, 1))
+        for option, value in options:
+            if value is not None:
+                socket.setsockopt(option, value)
+
+
+# options of sockets without their own, and the context shared in process
+__transport = TransportOptions()
+__shared_context: Optional[zmq.Context] = None
+__shared_pid: Optional[int] = None
+__shared_lock = threading.Lock()
+
+
+def set_transport(options: TransportOptions):
+    """
+    Default options of sockets in process, call before creating sockets for `io_threads`.
+    """
+    global __transport
+    __transport = options if options is not None else TransportOptions()
+    if __shared_context is not None and __shared_pid == os.getpid():
+        logger.warning('Shared zmq context already created, io_threads not changed')
+
+
+def get_transport() -> TransportOptions:
+    return __transport
+
+
+def shared_context() -> zmq.Context:
+    """
+    One zmq context for all sockets in process, created again in forked process.
+    """
+    global __shared_context
+    global __shared_pid
+    with __shared_lock:
+        if __shared_context is None or __shared_pid != os.getpid():
+            __shared_context = zmq.Context(io_threads=__transport.io_threads)
+            __shared_pid = os.getpid()
+        return __shared_context
+
 
 class Context(object):
-    def __init__(self):
-        self.__ctx = zmq.Context()
+    def __init__(self, io_threads: int = 1):
+        self.__ctx = zmq.Context(io_threads=io_threads)
 
     def destroy(self):
         self.__ctx.destroy()
@@ -28,17 +155,21 @@ class Context(object):
 
 
 class Socket(object):
-    def __init__(self, socket_type: int, ctx: Union[Context, zmq.Context] = None):
-        self.__ctx: Optional[Context] = None
+    def __init__(self, socket_type: int, ctx: Union[Context, zmq.Context] = None,
+                 options: TransportOptions = None):
+        """
+        :param ctx: default the context shared in process
+        :param options: default options set by `set_transport`
+        """
         if ctx is None:
-            self.__ctx = Context()
-            ctx = self.__ctx
+            ctx = shared_context()
 
         if isinstance(ctx, Context):
             ctx = ctx.ctx
         ctx: zmq.Context
         self.__raw_context = ctx
         self.__socket: zmq.Socket = ctx.socket(socket_type)
+        (options or get_transport()).apply(self.__socket)
 
     @property
     def context(self) -> zmq.Context:
@@ -50,16 +181,12 @@ class Socket(object):
 
     def close(self):
         self.__socket.close()
-        if self.__ctx:
-            self.__ctx.destroy()
 
     def __enter__(self) -> zmq.Socket:
         return self.__socket
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.__socket.close()
-        if self.__ctx is not None:
-            self.__ctx.__exit__(exc_type, exc_val, exc_tb)
 
 
 class Router(Socket):
@@ -78,15 +205,16 @@ class Router(Socket):
 
 
 class Dealer(Socket):
-    def __init__(self, host: str, port: int, ctx: Union[Context, zmq.Context] = None):
-        super().__init__(zmq.DEALER, ctx)
+    def __init__(self, host: str, port: int = None, ctx: Union[Context, zmq.Context] = None,
+                 options: TransportOptions = None):
+        super().__init__(zmq.DEALER, ctx, options)
         self.__port = port
         self.__host = host
         try:
             self.__identity = str(uuid.uuid4())
             identity = self.__identity.encode('utf-8')
             self.socket.setsockopt(zmq.IDENTITY, identity)
-            self.socket.connect(f'tcp://{host}:{port}')
+            self.socket.connect(endpoint(host, port))
         except Exception as _:
             self.__exit__(*sys.exc_info())
             raise
@@ -104,28 +232,117 @@ class Dealer(Socket):
         return self.__host
 
 
-class MultiThreadRep(Socket):
-    def __init__(self, port: int,
-                 target: Callable[[bytes], Optional[bytes]],
-                 threads=None,
-                 ctx: Union[Context, zmq.Context] = None):
-        super().__init__(zmq.ROUTER, ctx)
-        self.__port = port
+READY = b'\x01'
+
+
+class LoadBalancer(object):
+    def __init__(self, frontend: Union[str, List[str]], backend: str, ctx: Union[Context, zmq.Context] = None,
+                 max_pending: int = None,
+                 overflow: bytes = b''):
+        """
+        Least recently used broker, route requests of REQ clients on frontend to REQ workers on backend.
+        Workers send READY once, then receive [client, b'', request] and reply [client, b'', reply].
+        :param frontend: endpoint or endpoints to bind for clients
+        :param backend: endpoint to bind for workers
+        :param max_pending: max requests waiting for a worker, None for no limit
+        :param overflow: reply to requests beyond `max_pending`
+        """
+        frontends = [frontend] if isinstance(frontend, str) else list(frontend)
+        self.__frontend = Socket(zmq.ROUTER, ctx)
+        self.__backend = Socket(zmq.ROUTER, self.__frontend.context)
         try:
-            self.socket.bind(f'tcp://*:{port}')
+            # fail on sending to exited workers, instead of dropping requests
+            self.__backend.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+            for address in frontends:
+                self.__frontend.socket.bind(address)
+            self.__backend.socket.bind(backend)
         except Exception as _:
-            self.__exit__(*sys.exc_info())
+            self.close()
             raise
+        self.__frontend_addr = frontends[0]
+        self.__backend_addr = backend
+        self.__max_pending = max_pending
+        self.__overflow = overflow
 
-        self.__frontend = self
-        self.__backend = Socket(zmq.DEALER, self.context)
+    @property
+    def frontend(self) -> str:
+        return self.__frontend_addr
+
+    @property
+    def backend(self) -> str:
+        return self.__backend_addr
+
+    def run(self) -> NoReturn:
+        frontend = self.__frontend.socket
+        backend = self.__backend.socket
+        workers: Deque[bytes] = deque()
+        pending: Deque[list] = deque()
+
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        poller.register(backend, zmq.POLLIN)
+
+        def dispatch():
+            while workers and pending:
+                worker = workers.popleft()
+                client, request = pending[0]
+                try:
+                    backend.send_multipart([worker, b'', client, b'', request], copy=False)
+                except zmq.error.ZMQError as e:
+                    if e.errno == zmq.EHOSTUNREACH:
+                        continue
+                    raise
+                pending.popleft()
+
+        while True:
+            events = dict(poller.poll())
+            if backend in events:
+                worker, _, client, *reply = backend.recv_multipart(copy=False)
+                workers.append(worker.bytes)
+                if client.bytes != READY:
+                    frontend.send_multipart([client, b'', reply[-1]], copy=False)
+            if frontend in events:
+                client, _, request = frontend.recv_multipart(copy=False)
+                if self.__max_pending is not None and len(pending) >= self.__max_pending:
+                    frontend.send_multipart([client, b'', self.__overflow], copy=False)
+                else:
+                    pending.append([client, request])
+            dispatch()
+
+    def close(self):
+        self.__backend.close()
+        self.__frontend.close()
+
+
+class MultiThreadRep(object):
+    def __init__(self, port: int,
+                 target: Callable[[bytes], Optional[bytes]],
+                 threads=None,
+                 ctx: Union[Context, zmq.Context] = None,
+                 endpoints: List[str] = None,
+                 max_pending: int = None,
+                 overflow: bytes = b''):
+        """
+        Serve requests on port by threads, each request is routed to an idle thread.
+        :param endpoints: more endpoints to bind beside tcp port, e.g. `ipc://` for local clients
+        :param max_pending: max requests waiting for a thread, None for no limit
+        :param overflow: reply to requests beyond `max_pending`
+        """
+        if ctx is None:
+            ctx = shared_context()
+        if isinstance(ctx, Context):
+            ctx = ctx.ctx
+        ctx: zmq.Context
+        self.__raw_context = ctx
+
+        self.__port = port
         self.__backend_addr = f'inproc://workers/{id(self)}'
-        self.__backend.socket.bind(self.__backend_addr)
+        self.__broker = LoadBalancer([f'tcp://*:{port}', *(endpoints or [])], self.__backend_addr, ctx,
+                                     max_pending, overflow)
 
         if threads is None:
             threads = multiprocessing.cpu_count()
 
-        self.__threads = threads
         self.__target = target
         self.__threads = [
             threading.Thread(target=self._work, args=(i, ))
@@ -138,35 +355,45 @@ class MultiThreadRep(Socket):
     def port(self):
         return self.__port
 
+    @property
+    def context(self) -> zmq.Context:
+        return self.__raw_context
+
     def _work(self, thread_id: int = 0):
-        with Socket(zmq.REP, self.__backend.context) as socket:
+        with Socket(zmq.REQ, self.__raw_context) as socket:
             socket.connect(self.__backend_addr)
+            socket.send(READY)
             while True:
-                req = socket.recv()
+                client, empty, req = socket.recv_multipart()
                 try:
                     rep = self.__target(req)
-                    socket.send(rep)
                 except Exception as _:
-                    continue
+                    rep = b''
+                socket.send_multipart([client, empty, rep])
 
     def run(self) -> NoReturn:
-        zmq.proxy(self.__frontend.socket, self.__backend.socket)
+        self.__broker.run()
 
     def close(self):
-        self.__backend.close()
-        super().close()
+        self.__broker.close()
 
         for t in self.__threads:
             t.join()
 
 
 class Req(Socket):
-    def __init__(self, host: str, port: int, ctx: Union[Context, zmq.Context] = None):
-        super().__init__(zmq.REQ, ctx)
+    def __init__(self, host: str, port: int = None, ctx: Union[Context, zmq.Context] = None,
+                 options: TransportOptions = None):
+        """
+        :param host: host name, or an endpoint URL like `ipc:///tmp/node.ipc`
+        :param port: tcp port
+        :param options: socket options, default set by `set_transport`
+        """
+        super().__init__(zmq.REQ, ctx, options)
         self.__port = port
         self.__host = host
         try:
-            self.socket.connect(f'tcp://{host}:{port}')
+            self.socket.connect(endpoint(host, port))
         except Exception as _:
             self.__exit__(*sys.exc_info())
             raise
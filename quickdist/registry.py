@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+import time
+import pickle
+from multiprocessing.context import BaseContext
+from typing import Any, Dict, Optional, List
+
+from .bloom import positions, DEFAULT_BITS
+from .scheduler import DEFAULT_AGING
+
+__all__ = [
+    'NodeRegistry',
+]
+
+# node states
+EMPTY = 0
+ACTIVE = 1
+DRAINING = 2
+LEFT = 3
+DEAD = 4
+
+RECORD_SIZE = 512
+FILTER_SIZE = DEFAULT_BITS // 8
+
+# priorities of waiting tasks are counted in levels of this range, wider priorities are clamped
+MIN_PRIORITY = -8
+MAX_PRIORITY = 8
+
+
+class NodeRegistry(object):
+    def __init__(self, ctx: BaseContext, max_nodes: int = 256, aging: float = DEFAULT_AGING):
+        """
+        Nodes and their free slots shared by proxy processes, nodes can join and leave at any time.
+        Must be passed to proxy processes at creation.
+        :param ctx: multiprocessing context
+        :param max_nodes: max nodes joined in the life of registry
+        :param aging: seconds of waiting that raise a task by one priority level, 0 for no aging
+        """
+        self.__cond = ctx.Condition()
+        self.__records = ctx.Array('c', max_nodes * RECORD_SIZE, lock=False)
+        self.__free = ctx.Array('i', max_nodes, lock=False)
+        self.__busy = ctx.Array('i', max_nodes, lock=False)
+        self.__state = ctx.Array('i', max_nodes, lock=False)
+        # wall time until which nodes under memory pressure take no tasks
+        self.__paused = ctx.Array('d', max_nodes, lock=False)
+        self.__size = ctx.Value('i', 0, lock=False)
+        # bloom filters of files cached on nodes
+        self.__files = ctx.Array('B', max_nodes * FILTER_SIZE, lock=False)
+        # tasks waiting for a slot at each priority level, a task takes a slot only if none waits above it
+        self.__waiting = ctx.Array('i', MAX_PRIORITY - MIN_PRIORITY + 1, lock=False)
+        self.__max_nodes = max_nodes
+        self.__aging = aging
+        # unpickled records in current process
+        self.__cache: Dict[int, Any] = {}
+
+    def add(self, record: Any, slots: int) -> int:
+        """
+        A node rejoining after it left or died takes its old index.
+        :param record: picklable node address, returned by `record`
+        :param slots: concurrent tasks on node
+        :return: node index
+        """
+        body = pickle.dumps(record)
+        if len(body) > RECORD_SIZE:
+            raise ValueError(f'Node record too large: {record}')
+        with self.__cond:
+            index = self.__find(record)
+            if index is None:
+                index = self.__size.value
+                if index >= self.__max_nodes:
+                    raise RuntimeError(f'Registry is full of {self.__max_nodes} nodes joined, '
+                                       f'only nodes rejoining by the same address can be added, raise max_nodes')
+                offset = index * RECORD_SIZE
+                self.__records[offset:offset + len(body)] = body
+                self.__busy[index] = 0
+                self.__size.value = index + 1
+            # tasks of a dead node may not be released yet
+            self.__free[index] = max(slots - self.__busy[index], 0)
+            self.__state[index] = ACTIVE
+            self.__paused[index] = 0.0
+            # files reported again by the node
+            offset = index * FILTER_SIZE
+            self.__files[offset:offset + FILTER_SIZE] = bytes(FILTER_SIZE)
+            self.__cond.notify_all()
+        return index
+
+    def __find(self, record: Any) -> Optional[int]:
+        """
+        :return: index of a left or dead node of record
+        """
+        for i in range(self.__size.value):
+            if self.__state[i] in (LEFT, DEAD) and self.record(i) == record:
+                return i
+        return None
+
+    def record(self, index: int) -> Any:
+        if index not in self.__cache:
+            offset = index * RECORD_SIZE
+            self.__cache[index] = pickle.loads(self.__records[offset:offset + RECORD_SIZE])
+        return self.__cache[index]
+
+    def resize(self, index: int, slots: int):
+        """
+        Follow processes changed on node.
+        """
+        with self.__cond:
+            # negative while more tasks than slots run, e.g. urgent tasks
+            self.__free[index] = slots - self.__busy[index]
+            self.__cond.notify_all()
+
+    def drain(self, index: int):
+        """
+        Stop giving slots of node, running tasks go on.
+        """
+        with self.__cond:
+            if self.__state[index] == ACTIVE:
+                self.__state[index] = DRAINING
+
+    def leave(self, index: int, timeout: float = None) -> bool:
+        """
+        Drain node and wait its running tasks.
+        :return: node is idle and left
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__cond:
+            if self.__state[index] == ACTIVE:
+                self.__state[index] = DRAINING
+            while self.__busy[index] > 0 and self.__state[index] == DRAINING:
+                wait = None if deadline is None else deadline - time.monotonic()
+                if wait is not None and wait <= 0:
+                    return False
+                self.__cond.wait(wait)
+            self.__state[index] = LEFT
+            return True
+
+    def fail(self, index: int):
+        """
+        Node lost, tasks on it should be resubmitted.
+        """
+        with self.__cond:
+            self.__state[index] = DEAD
+            self.__cond.notify_all()
+
+    def state(self, index: int) -> int:
+        return self.__state[index]
+
+    def active(self) -> List[int]:
+        with self.__cond:
+            return [i for i in range(self.__size.value) if self.__state[i] == ACTIVE]
+
+    def capacity(self) -> int:
+        with self.__cond:
+            return sum(self.__free[i] + self.__busy[i]
+                       for i in range(self.__size.value) if self.__state[i] == ACTIVE)
+
+    def merge_files(self, index: int, data: bytes):
+        """
+        Merge bloom filter of files reported by node.
+        """
+        if len(data) != FILTER_SIZE:
+            return
+        offset = index * FILTER_SIZE
+        with self.__cond:
+            current = self.__files[offset:offset + FILTER_SIZE]
+            self.__files[offset:offset + FILTER_SIZE] = bytes(a | b for a, b in zip(current, data))
+
+    def add_files(self, index: int, keys: List[str]):
+        """
+        Files known to be cached on node, e.g. copied by a finished task.
+        """
+        offset = index * FILTER_SIZE
+        with self.__cond:
+            for key in keys:
+                for p in positions(key):
+                    self.__files[offset + (p >> 3)] |= 1 << (p & 7)
+
+    def __hits(self, index: int, keys: List[List[int]]) -> int:
+        offset = index * FILTER_SIZE
+        return sum(all(self.__files[offset + (p >> 3)] & (1 << (p & 7)) for p in key) for key in keys)
+
+    def __level(self, priority: int, waited: float) -> int:
+        """
+        :return: index of waiting counts, priority raised by waited seconds
+        """
+        if self.__aging > 0:
+            priority += int(waited / self.__aging)
+        return min(max(priority, MIN_PRIORITY), MAX_PRIORITY) - MIN_PRIORITY
+
+    def acquire(self, timeout: float = None, files: List[str] = None, locality_delay: float = 0.0,
+                priority: int = 0) -> Optional[int]:
+        """
+        Take a slot on the active node holding most of files, then with most free slots.
+        Waiting tasks take slots by priority, higher first, a waiting task gains one level every `aging` seconds.
+        :param timeout: seconds, None for waiting forever
+        :param files: locality keys of task files
+        :param locality_delay: seconds waiting for a slot on nodes holding files before taking any other
+        :param priority: higher takes slots first, tasks above 0 may also take up to twice the slots of a node,
+                         they wait in node scheduler for the next free worker instead of behind all tasks waiting here
+        :return: node index, None on timeout
+        """
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        keys = [positions(key) for key in files or []]
+        locality_deadline = start + locality_delay if keys else start
+        level = None
+        waited = False
+        with self.__cond:
+            try:
+                while True:
+                    index = -1
+                    best = 0
+                    held = 0
+                    resume = None
+                    wall = time.time()
+                    for i in range(self.__size.value):
+                        if self.__state[i] != ACTIVE:
+                            continue
+                        if self.__paused[i] > wall:
+                            resume = self.__paused[i] - wall if resume is None else min(resume, self.__paused[i] - wall)
+                            continue
+                        hits = self.__hits(i, keys) if keys else 0
+                        held = max(held, hits)
+                        limit = -(self.__free[i] + self.__busy[i]) if priority > 0 else 0
+                        if self.__free[i] > limit:
+                            if index < 0 or (hits, self.__free[i]) > (best, self.__free[index]):
+                                index = i
+                                best = hits
+                    now = time.monotonic()
+                    if level is not None:
+                        self.__waiting[level] -= 1
+                    level = self.__level(priority, now - start)
+                    # tasks waiting at higher levels take free slots first
+                    ahead = any(self.__waiting[level + 1:])
+                    if index >= 0 and not ahead and (best >= held or now >= locality_deadline):
+                        level = None
+                        self.__free[index] -= 1
+                        self.__busy[index] += 1
+                        return index
+                    self.__waiting[level] += 1
+                    waited = True
+                    wait = None if deadline is None else deadline - now
+                    if wait is not None and wait <= 0:
+                        return None
+                    if index >= 0 and not ahead:
+                        # a free node without files, wait for nodes holding them until locality deadline
+                        wait = locality_deadline - now if wait is None else min(wait, locality_deadline - now)
+                    if resume is not None:
+                        wait = resume if wait is None else min(wait, resume)
+                    if self.__aging > 0:
+                        # wake to rise a level
+                        rise = self.__aging - (now - start) % self.__aging
+                        wait = rise if wait is None else min(wait, rise)
+                    self.__cond.wait(wait)
+            finally:
+                if level is not None:
+                    self.__waiting[level] -= 1
+                if waited:
+                    # tasks at lower levels may take slots now
+                    self.__cond.notify_all()
+
+    def pause(self, index: int, seconds: float):
+        """
+        Send tasks to other nodes for a while, e.g. node replied BUSY under memory pressure.
+        """
+        with self.__cond:
+            self.__paused[index] = max(self.__paused[index], time.time() + seconds)
+
+    def release(self, index: int):
+        with self.__cond:
+            self.__busy[index] -= 1
+            if self.__state[index] == ACTIVE:
+                self.__free[index] += 1
+            self.__cond.notify_all()
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
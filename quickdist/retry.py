@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+__all__ = [
+    'RetryPolicy',
+]
+
+
+class RetryPolicy(object):
+    def __init__(self, retries: int = 3,
+                 backoff: float = 1.0,
+                 factor: float = 2.0,
+                 max_backoff: float = 60.0,
+                 timeout: float = None,
+                 heartbeat: float = 5.0,
+                 liveness: int = 3,
+                 retry_errors: bool = False,
+                 retry_timeouts: bool = False):
+        """
+        How proxies resubmit failed tasks.
+        :param retries: max resubmissions of a task
+        :param backoff: seconds before the first resubmission
+        :param factor: backoff multiplier of each resubmission
+        :param max_backoff: max seconds between resubmissions
+        :param timeout: deadline seconds of each submission, None for no deadline
+        :param heartbeat: seconds between pings while waiting a reply, None for no heartbeat
+        :param liveness: missed pings before the node is considered dead
+        :param retry_errors: also resubmit tasks that raised on node, otherwise only lost tasks
+        :param retry_timeouts: also resubmit tasks without reply in `timeout`, they are cancelled on node first
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self.liveness = liveness
+        self.retry_errors = retry_errors
+        self.retry_timeouts = retry_timeouts
+
+    def delay(self, attempt: int) -> float:
+        """
+        :param attempt: 1 for the first resubmission
+        :return: seconds to wait before resubmission
+        """
+        return min(self.backoff * self.factor ** max(attempt - 1, 0), self.max_backoff)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
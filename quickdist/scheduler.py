@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import time
+import itertools
+import threading
+from typing import Dict, List, Optional
+
+from .workers import CancelToken
+
+__all__ = [
+    'PriorityScheduler',
+]
+
+# seconds of waiting that raise a task by one priority level
+DEFAULT_AGING = 10.0
+
+
+class Waiter(object):
+    def __init__(self, priority: int, order: int):
+        self.priority = priority
+        self.order = order
+        self.since = time.monotonic()
+        self.granted = threading.Event()
+
+    def rank(self, now: float, aging: float) -> float:
+        if aging <= 0:
+            return self.priority
+        return self.priority + (now - self.since) / aging
+
+
+class PriorityScheduler(object):
+    def __init__(self, slots: int, aging: float = DEFAULT_AGING):
+        """
+        Slots of workers given to waiting tasks by priority, higher first, FIFO in same priority.
+        A waiting task gains one priority level every `aging` seconds, so low priority tasks are not starved.
+        :param slots: tasks running at once
+        :param aging: seconds per priority level gained by waiting, 0 for no aging
+        """
+        self.__slots = slots
+        self.__aging = aging
+        self.__running = 0
+        self.__waiters: List[Waiter] = []
+        self.__orders = itertools.count()
+        self.__lock = threading.Lock()
+
+    def acquire(self, priority: int = 0, token: CancelToken = None):
+        """
+        Wait for a slot.
+        :param priority: higher runs first
+        :param token: stop waiting when cancelled or timed out
+        """
+        with self.__lock:
+            if self.__running < self.__slots and not self.__waiters:
+                self.__running += 1
+                return
+            waiter = Waiter(priority, next(self.__orders))
+            self.__waiters.append(waiter)
+        if token is None:
+            waiter.granted.wait()
+            return
+        try:
+            while not waiter.granted.wait(token.interval()):
+                token.check()
+        except BaseException:
+            with self.__lock:
+                # may be granted while giving up
+                granted = waiter not in self.__waiters
+                if not granted:
+                    self.__waiters.remove(waiter)
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        with self.__lock:
+            if self.__waiters:
+                now = time.monotonic()
+                waiter = max(self.__waiters, key=lambda w: (w.rank(now, self.__aging), -w.order))
+                self.__waiters.remove(waiter)
+                # slot passed to waiter, running count unchanged
+                waiter.granted.set()
+            else:
+                self.__running -= 1
+
+    def slot(self, priority: int = 0, token: CancelToken = None) -> 'SchedulerSlot':
+        """
+        :return: context manager holding a slot
+        """
+        return SchedulerSlot(self, priority, token)
+
+    def queued(self) -> Dict[int, int]:
+        """
+        :return: priority to count of waiting tasks
+        """
+        with self.__lock:
+            counts: Dict[int, int] = {}
+            for waiter in self.__waiters:
+                counts[waiter.priority] = counts.get(waiter.priority, 0) + 1
+            return counts
+
+    @property
+    def running(self) -> int:
+        return self.__running
+
+
+class SchedulerSlot(object):
+    def __init__(self, scheduler: PriorityScheduler, priority: int, token: Optional[CancelToken]):
+        self.__scheduler = scheduler
+        self.__priority = priority
+        self.__token = token
+
+    def __enter__(self):
+        self.__scheduler.acquire(self.__priority, self.__token)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__scheduler.release()
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
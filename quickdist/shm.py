@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Tuple
+
+__all__ = [
+    'SharedBuffer',
+    'SharedMemoryPool',
+    'share_arguments',
+    'load_arguments',
+    'share_result',
+    'load_result',
+]
+
+# sharing is opt-in, blocks in flight when a worker is killed are left in /dev/shm until reboot
+DEFAULT_THRESHOLD = 0
+MIN_BLOCK_SIZE = 1 << 12
+
+
+def _numpy():
+    # never import numpy here, it is only there if args contain arrays
+    return sys.modules.get('numpy', None)
+
+
+def buffer_size(value: Any) -> int:
+    """
+    :return: bytes of a shareable buffer, -1 if value is not shareable
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, memoryview):
+        return value.nbytes if value.contiguous else -1
+    np = _numpy()
+    if np is not None and isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        return value.nbytes
+    return -1
+
+
+class SharedBuffer(object):
+    def __init__(self, name: str, size: int, kind: str,
+                 dtype: str = None, shape: Tuple[int, ...] = None,
+                 owned: bool = False):
+        """
+        Handle of a buffer in shared memory, only this crosses the pipe.
+        :param name: shared memory name
+        :param size: bytes of buffer
+        :param kind: bytes|bytearray|memoryview|ndarray
+        :param owned: the loader unlink the block after loading
+        """
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self.dtype = dtype
+        self.shape = shape
+        self.owned = owned
+
+    @staticmethod
+    def dump(value: Any, block: SharedMemory, owned: bool = False):
+        size = buffer_size(value)
+        np = _numpy()
+        if np is not None and isinstance(value, np.ndarray):
+            view = np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)
+            view[...] = value
+            del view
+            return SharedBuffer(block.name, size, 'ndarray', value.dtype.str, value.shape, owned)
+        if isinstance(value, memoryview):
+            block.buf[:size] = value.cast('B')
+        else:
+            block.buf[:size] = value
+        return SharedBuffer(block.name, size, type(value).__name__, owned=owned)
+
+    def load(self) -> Any:
+        block = SharedMemory(name=self.name)
+        try:
+            if self.kind == 'ndarray':
+                np = _numpy()
+                if np is None:
+                    import numpy as np
+                view = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=block.buf)
+                value = view.copy()
+                del view
+            elif self.kind == 'bytearray':
+                value = bytearray(block.buf[:self.size])
+            elif self.kind == 'memoryview':
+                value = memoryview(bytearray(block.buf[:self.size]))
+            else:
+                value = bytes(block.buf[:self.size])
+        finally:
+            block.close()
+            if self.owned:
+                block.unlink()
+        return value
+
+    def __repr__(self):
+        return f'SharedBuffer({self.name}, {self.kind}, {self.size})'
+
+
+class SharedMemoryPool(object):
+    def __init__(self, max_cached: int = 256 << 20):
+        """
+        Reusable shared memory blocks, sized in power of two.
+        :param max_cached: max bytes of free blocks kept for reusing
+        """
+        self.__lock = threading.Lock()
+        self.__free: Dict[int, List[SharedMemory]] = {}
+        self.__cached = 0
+        self.__max_cached = max_cached
+
+    def acquire(self, size: int) -> SharedMemory:
+        capacity = MIN_BLOCK_SIZE
+        while capacity < size:
+            capacity <<= 1
+        with self.__lock:
+            blocks = self.__free.get(capacity, None)
+            if blocks:
+                self.__cached -= capacity
+                return blocks.pop()
+        return SharedMemory(create=True, size=capacity)
+
+    def release(self, block: SharedMemory):
+        capacity = block.size
+        with self.__lock:
+            if self.__cached + capacity <= self.__max_cached:
+                self.__free.setdefault(capacity, []).append(block)
+                self.__cached += capacity
+                return
+        block.close()
+        block.unlink()
+
+    def close(self):
+        with self.__lock:
+            blocks = [block for blocks in self.__free.values() for block in blocks]
+            self.__free.clear()
+            self.__cached = 0
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def share_arguments(args: Tuple, kwargs: Dict, pool: SharedMemoryPool, threshold: int) \
+        -> Tuple[Tuple, Dict, List[SharedMemory]]:
+    """
+    Replace top level large buffers in arguments with SharedBuffer.
+    :return: args, kwargs and blocks to release after the call
+    """
+    blocks: List[SharedMemory] = []
+
+    def share(value):
+        size = buffer_size(value)
+        if size < threshold:
+            return value
+        block = pool.acquire(size)
+        blocks.append(block)
+        return SharedBuffer.dump(value, block)
+
+    try:
+        args = tuple(share(v) for v in args)
+        kwargs = {k: share(v) for k, v in kwargs.items()}
+    except Exception as _:
+        for block in blocks:
+            pool.release(block)
+        raise
+    return args, kwargs, blocks
+
+
+def load_arguments(args: Tuple, kwargs: Dict) -> Tuple[Tuple, Dict]:
+    def load(value):
+        return value.load() if isinstance(value, SharedBuffer) else value
+
+    return tuple(load(v) for v in args), {k: load(v) for k, v in kwargs.items()}
+
+
+def share_result(ret: Any, threshold: int) -> Any:
+    """
+    Place large result buffers in new blocks, owned by the loader.
+    """
+    def share(value):
+        size = buffer_size(value)
+        if size < threshold:
+            return value
+        block = SharedMemory(create=True, size=max(size, 1))
+        try:
+            return SharedBuffer.dump(value, block, owned=True)
+        finally:
+            block.close()
+
+    if isinstance(ret, tuple):
+        return tuple(share(v) for v in ret)
+    return share(ret)
+
+
+def load_result(ret: Any) -> Any:
+    if isinstance(ret, SharedBuffer):
+        return ret.load()
+    if isinstance(ret, tuple):
+        return tuple(v.load() if isinstance(v, SharedBuffer) else v for v in ret)
+    return ret
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import os
+import os.path as osp
+import mmap
+import pickle
+import struct
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+__all__ = [
+    'ResultSink',
+    'ListSink',
+    'SpillSink',
+    'CallbackSink',
+]
+
+# index, length of body, negative length for body stored elsewhere
+HEADER = struct.Struct('<qq')
+
+
+class ResultSink(ABC):
+    """
+    Where `Monster.map` puts results as they arrive.
+    """
+
+    @abstractmethod
+    def put(self, index: int, result: Any):
+        pass
+
+    @abstractmethod
+    def result(self, count: int) -> Any:
+        """
+        :param count: items of the map
+        :return: value returned by `Monster.map`
+        """
+        pass
+
+    def __contains__(self, index: int) -> bool:
+        """
+        :return: result of index is already there and need not be computed
+        """
+        return False
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ListSink(ResultSink):
+    def __init__(self):
+        self.__results: Dict[int, Any] = {}
+
+    def put(self, index: int, result: Any):
+        self.__results[index] = result
+
+    def result(self, count: int) -> List[Any]:
+        return [self.__results[i] for i in range(count)]
+
+
+class CallbackSink(ResultSink):
+    def __init__(self, callback: Callable[[int, Any], None]):
+        """
+        :param callback: called with (index, result) in completion order
+        """
+        self.__callback = callback
+
+    def put(self, index: int, result: Any):
+        self.__callback(index, result)
+
+    def result(self, count: int) -> None:
+        return None
+
+
+class SpillSink(ResultSink):
+    def __init__(self, path: str = None):
+        """
+        Append results to a file as they arrive, read them back lazily by mmap.
+        :param path: spill file, default a temp file removed on close
+        """
+        self.__temporary = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='quickdist-', suffix='.spill')
+            os.close(fd)
+        else:
+            root = osp.dirname(path)
+            if root:
+                os.makedirs(root, exist_ok=True)
+        self.__path = path
+        self.__lock = threading.Lock()
+        # index to offset and length of body
+        self._records: Dict[int, Tuple[int, int]] = {}
+        self.__map: Optional[mmap.mmap] = None
+
+        self._open()
+        self.__writer = open(path, 'ab')
+        self.__reader = open(path, 'rb')
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def _open(self):
+        """
+        Load existing records before opening for append.
+        """
+        pass
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _append(self, index: int, body: bytes, length: int, fsync: bool = False):
+        with self.__lock:
+            offset = self.__writer.tell()
+            self.__writer.write(HEADER.pack(index, length))
+            self.__writer.write(body)
+            self.__writer.flush()
+            if fsync:
+                os.fsync(self.__writer.fileno())
+            self._records[index] = (offset + HEADER.size, length)
+
+    def _body(self, offset: int, length: int) -> bytes:
+        with self.__lock:
+            end = offset + length
+            if self.__map is None or len(self.__map) < end:
+                # file grows, map it again
+                if self.__map is not None:
+                    self.__map.close()
+                self.__map = mmap.mmap(self.__reader.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.__map[offset:end]
+
+    def put(self, index: int, result: Any):
+        body = pickle.dumps(result)
+        self._append(index, body, len(body))
+
+    def read(self, index: int) -> Any:
+        offset, length = self._records[index]
+        return pickle.loads(self._body(offset, length))
+
+    def result(self, count: int) -> 'SpillResults':
+        return SpillResults(self, count)
+
+    def close(self):
+        with self.__lock:
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+        self.__writer.close()
+        self.__reader.close()
+        if self.__temporary and osp.exists(self.__path):
+            os.unlink(self.__path)
+
+
+class SpillResults(Sequence):
+    def __init__(self, sink: SpillSink, count: int):
+        """
+        Results in order, read from disk on access.
+        """
+        self.__sink = sink
+        self.__count = count
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.__count))]
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError(index)
+        return self.__sink.read(index)
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(self.__count):
+            yield self.__sink.read(i)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+import time
+import pickle
+import itertools
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .proxy import Proxy
+from .tunnel import Message
+from .file import each_file
+from .logger import logger
+
+__all__ = [
+    'StreamTable',
+    'ResultStream',
+]
+
+# bytes of data in one NEXT reply
+CHUNK_SIZE = 1 << 22
+# seconds a stream not pulled is kept on node
+STREAM_TTL = 600.0
+
+# seconds waiting node to drop a stream not pulled to the end
+DROP_TIMEOUT = 5.0
+
+END = object()
+
+
+def encode(value: Any, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple]:
+    """
+    Frames of one value, pickle protocol 5 keeps large buffers (e.g. numpy arrays) out of band,
+    they are sliced into chunks without copying the whole value again.
+    :return: ('PART', sizes of segments), then ('DATA', chunk) of segments in order
+    """
+    buffers: List[memoryview] = []
+
+    def out_of_band(buffer: pickle.PickleBuffer) -> bool:
+        try:
+            buffers.append(buffer.raw())
+        except BufferError:
+            # not contiguous, pickle it in band
+            return True
+        return False
+
+    head = pickle.dumps(value, protocol=5, buffer_callback=out_of_band)
+    segments = [memoryview(head), *buffers]
+    yield 'PART', [s.nbytes for s in segments]
+    for segment in segments:
+        for offset in range(0, segment.nbytes, chunk_size):
+            yield 'DATA', bytes(segment[offset:offset + chunk_size])
+
+
+class StreamTable(object):
+    def __init__(self, chunk_size: int = CHUNK_SIZE, ttl: float = STREAM_TTL):
+        """
+        Results of STREAM held on node until pulled by NEXT.
+        :param chunk_size: bytes of data in one reply
+        :param ttl: seconds a stream not pulled is dropped
+        """
+        self.__chunk_size = chunk_size
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.__ids = itertools.count(1)
+        # stream id to values, frames of current value, last access time and release of stream
+        self.__streams: Dict[int, Tuple[Iterator[Any], Optional[Iterator[Tuple]], float,
+                                        Optional[Callable[[], None]]]] = {}
+
+    @staticmethod
+    def __close(values: Iterator[Any], release: Optional[Callable[[], None]]):
+        try:
+            close = getattr(values, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if release is not None:
+                release()
+
+    def open(self, values: Iterable[Any], release: Callable[[], None] = None) -> int:
+        """
+        :param values: parts of stream, each pulled as one value, may be produced while pulling
+        :param release: called once when the stream ends, fails, is dropped or expires, e.g. free its slot
+        :return: stream id
+        """
+        now = time.monotonic()
+        with self.__lock:
+            expired = [k for k, (_, _, t, _) in self.__streams.items() if now - t > self.__ttl]
+            dropped = [self.__streams.pop(k) for k in expired]
+            stream_id = next(self.__ids)
+            self.__streams[stream_id] = (iter(values), None, now, release)
+        for values, _, _, release in dropped:
+            self.__close(values, release)
+        return stream_id
+
+    def next(self, stream_id: int) -> List[Tuple]:
+        """
+        Wait next value if none is pending.
+        :return: frames up to chunk size of data or end of a value, ('END', ) at last
+        """
+        with self.__lock:
+            values, frames, _, release = self.__streams.pop(stream_id)
+        batch = []
+        size = 0
+        try:
+            while True:
+                if frames is None:
+                    if batch:
+                        # not wait for next value, keep first result fast
+                        break
+                    value = next(values, END)
+                    if value is END:
+                        batch.append(('END', ))
+                        self.__close(values, release)
+                        return batch
+                    frames = encode(value, self.__chunk_size)
+                for frame in frames:
+                    batch.append(frame)
+                    if frame[0] == 'DATA':
+                        size += len(frame[1])
+                        if size >= self.__chunk_size:
+                            break
+                else:
+                    frames = None
+                if size >= self.__chunk_size:
+                    break
+        except BaseException:
+            self.__close(values, release)
+            raise
+        with self.__lock:
+            self.__streams[stream_id] = (values, frames, time.monotonic(), release)
+        return batch
+
+    def drop(self, stream_id: int):
+        with self.__lock:
+            stream = self.__streams.pop(stream_id, None)
+        if stream is not None:
+            self.__close(stream[0], stream[3])
+
+    def clear(self):
+        with self.__lock:
+            streams = list(self.__streams.values())
+            self.__streams.clear()
+        for values, _, _, release in streams:
+            self.__close(values, release)
+
+
+class ResultStream(object):
+    def __init__(self, host: str = None, port: int = None, stream_id: int = None,
+                 values: List[Any] = None, timeout: float = None,
+                 release: Callable[[], None] = None):
+        """
+        Iterator of values streamed from node, pulled chunk by chunk as consumed.
+        :param host: node host
+        :param port: node serve port holding the stream
+        :param stream_id: stream on node
+        :param values: values replied at once, e.g. by node in direct mode
+        :param timeout: seconds for each chunk, None for waiting forever
+        :param release: called once at the end of stream, e.g. free the slot of node
+        """
+        self.__host = host
+        self.__port = port
+        self.__stream_id = stream_id
+        self.__values = values
+        self.__timeout = timeout
+        self.__proxy: Optional[Proxy] = None
+        self.__finished = stream_id is None
+        self.__started = False
+        self.__release = release
+
+    @property
+    def holding(self) -> bool:
+        """
+        Stream is open on node, holding a slot and a worker until pulled to the end or closed.
+        """
+        return not self.__finished
+
+    @property
+    def started(self) -> bool:
+        return self.__started
+
+    def buffer(self):
+        """
+        Pull the rest of a stream not iterated yet into memory, freeing its slot and worker on node.
+        """
+        if self.__started or self.__finished:
+            return
+        values = list(self)
+        self.__values = values
+        self.__started = False
+
+    def __pull(self) -> List[Tuple]:
+        if self.__proxy is None:
+            self.__proxy = Proxy(self.__host, self.__port)
+        ret = self.__proxy.request(Message('NEXT', self.__stream_id).bytes(), timeout=self.__timeout)
+        if ret.cmd != 'OK':
+            raise RuntimeError(f'{ret} on {self.__host}:{self.__port}')
+        return ret.args[0]
+
+    @staticmethod
+    def __receive(value: Any) -> Any:
+        # copy temp files to work dir
+        for file in each_file(value):
+            if file.copied:
+                file.copy()
+        return value
+
+    def __iter__(self) -> Iterator[Any]:
+        self.__started = True
+        if self.__values is not None:
+            try:
+                for value in self.__values:
+                    yield self.__receive(value)
+            finally:
+                self.close()
+            return
+
+        segments: List[bytearray] = []
+        current = 0
+        offset = 0
+        try:
+            while not self.__finished:
+                for frame in self.__pull():
+                    kind = frame[0]
+                    if kind == 'END':
+                        self.__finished = True
+                        break
+                    if kind == 'PART':
+                        segments = [bytearray(size) for size in frame[1]]
+                        current = 0
+                        offset = 0
+                    else:
+                        data = frame[1]
+                        segments[current][offset:offset + len(data)] = data
+                        offset += len(data)
+                    while current < len(segments) and offset >= len(segments[current]):
+                        current += 1
+                        offset = 0
+                    if segments and current == len(segments):
+                        head, *buffers = segments
+                        segments = []
+                        yield self.__receive(pickle.loads(head, buffers=buffers))
+        except GeneratorExit:
+            # iteration stopped early, possibly in garbage collection, the rest is dropped by close()
+            raise
+        except BaseException:
+            self.close()
+            raise
+        self.close()
+
+    def close(self):
+        """
+        Stop pulling, drop the rest of stream on node.
+        """
+        if not self.__finished:
+            self.__finished = True
+            if self.__proxy is None:
+                self.__proxy = Proxy(self.__host, self.__port)
+            try:
+                self.__proxy.request(Message('DROP', self.__stream_id).bytes(), timeout=DROP_TIMEOUT)
+            except Exception as _:
+                pass
+        if self.__proxy is not None:
+            self.__proxy.close()
+            self.__proxy = None
+        if self.__release is not None:
+            release = self.__release
+            self.__release = None
+            release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        # no requests in garbage collection, node drops the stream after its ttl
+        if not self.__finished:
+            logger.warning(f'Stream {self.__stream_id} on {self.__host}:{self.__port} is not closed, '
+                           f'its worker is held until it expires on node')
+            self.__finished = True
+        if self.__proxy is not None:
+            self.__proxy.close()
+            self.__proxy = None
+        if self.__release is not None:
+            release = self.__release
+            self.__release = None
+            release()
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,8 @@ class Message(object):
         self.__cmd: str = cmd
         self.__args: Tuple[Any, ...] = args
         self.__kwargs: Dict[str, Any] = kwargs
+        # task metadata beside arguments of main, e.g. task id and timeout
+        self.__headers: Dict[str, Any] = {}
 
     @property
     def cmd(self) -> str:
@@ -22,6 +24,18 @@ class Message(object):
     def kwargs(self) -> Dict[str, Any]:
         return self.__kwargs
 
+    @property
+    def headers(self) -> Dict[str, Any]:
+        return self.__headers
+
+    def header(self, **headers) -> 'Message':
+        """
+        Set headers, None values are skipped.
+        :return: self
+        """
+        self.__headers.update({k: v for k, v in headers.items() if v is not None})
+        return self
+
     def bytes(self) -> bytes:
         return pickle.dumps(self)
 
@@ -0,0 +1,626 @@
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import random
+import inspect
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from multiprocessing.context import BaseContext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .memory import process_memory, reset_peak
+from .logger import logger
+
+__all__ = [
+    'WorkerPool',
+    'AsyncCall',
+    'WorkerIterator',
+    'CancelToken',
+    'TaskCancelled',
+    'TaskTimeout',
+]
+
+# replies of worker
+OK = 0
+ERROR = 1
+ITEM = 2
+DONE = 3
+# worker initialized, sent once before any reply
+READY = 4
+
+# seconds between checks of cancel token while waiting worker
+CANCEL_POLL = 0.1
+# max tasks of each worker is drawn down to this share below the limit,
+# workers started together are not recycled together
+TASKS_JITTER = 0.25
+
+
+class RemoteError(Exception):
+    def __init__(self, tb: str):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+class TaskCancelled(RuntimeError):
+    pass
+
+
+class TaskTimeout(RuntimeError):
+    pass
+
+
+class CancelToken(object):
+    def __init__(self, timeout: float = None):
+        """
+        Cancel a task from another thread, or by deadline, the worker running it is replaced.
+        :param timeout: seconds from now, None for no deadline
+        """
+        self.__event = threading.Event()
+        self.__timeout = timeout
+        self.__deadline = None if timeout is None else time.monotonic() + timeout
+
+    def cancel(self):
+        self.__event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.__event.is_set()
+
+    def check(self):
+        if self.__event.is_set():
+            raise TaskCancelled('Task cancelled')
+        if self.__deadline is not None and time.monotonic() >= self.__deadline:
+            raise TaskTimeout(f'Task timed out after {self.__timeout}s')
+
+    def interval(self) -> float:
+        """
+        :return: seconds to wait before next check
+        """
+        if self.__deadline is None:
+            return CANCEL_POLL
+        return max(min(self.__deadline - time.monotonic(), CANCEL_POLL), 0)
+
+
+def dump_error(e: BaseException) -> Tuple[BaseException, str]:
+    error = e if isinstance(e, Exception) else RuntimeError(repr(e))
+    return error, ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+
+
+def load_error(value: Tuple[BaseException, str]) -> BaseException:
+    # traceback is lost in pickling, chain it as cause like multiprocessing.pool
+    error, tb = value
+    error.__cause__ = RemoteError(tb)
+    return error
+
+
+def worker_main(conn: Connection, initializer: Callable = None, initargs: Tuple = (),
+                index: int = None, on_index: Callable[[int], None] = None):
+    """
+    Loop of worker process, run (func, args, kwargs) from pipe.
+    A generator returned by func is sent item by item, blocked by pipe until parent reads.
+    :param index: slot of worker in pool, None for a spare, told when it takes a slot
+    :param on_index: called with index before initializer
+    """
+    init_error: Optional[Tuple[BaseException, str]] = None
+    try:
+        if index is not None and on_index is not None:
+            on_index(index)
+        if initializer is not None:
+            initializer(*initargs)
+    except BaseException as e:
+        init_error = dump_error(e)
+    conn.send((READY, None))
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        if init_error is not None:
+            conn.send((ERROR, init_error))
+            continue
+
+        func, args, kwargs = task
+        try:
+            ret = func(*args, **kwargs)
+            if inspect.isgenerator(ret):
+                for item in ret:
+                    conn.send((ITEM, item))
+                conn.send((DONE, None))
+            else:
+                conn.send((OK, ret))
+        except BaseException as e:
+            error, tb = dump_error(e)
+            try:
+                conn.send((ERROR, (error, tb)))
+            except Exception as _:
+                # exception not picklable
+                conn.send((ERROR, (RuntimeError(repr(e)), tb)))
+
+
+class AsyncCall(Future):
+    """
+    Future of a call, also `get` like `multiprocessing.pool.AsyncResult`.
+    """
+
+    def get(self, timeout: float = None) -> Any:
+        return self.result(timeout)
+
+    def wait(self, timeout: float = None):
+        try:
+            self.exception(timeout)
+        except Exception as _:
+            pass
+
+    def successful(self) -> bool:
+        return self.done() and not self.cancelled() and self.exception() is None
+
+
+class Worker(object):
+    def __init__(self, ctx: BaseContext, initializer: Callable, initargs: Tuple,
+                 index: int = None, on_index: Callable[[int], None] = None):
+        """
+        :param index: slot of worker in pool, None for a spare
+        :param on_index: called in worker with its index
+        """
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child, initializer, initargs, index, on_index),
+                                   daemon=True)
+        self.process.start()
+        child.close()
+        self.index = index
+        self.ready = False
+        # tasks finished, and tasks before recycling, None for no limit
+        self.tasks = 0
+        self.max_tasks: Optional[int] = None
+        # replies of calls sent by pool itself, skipped by recv
+        self.__skips = 0
+
+    def send(self, func: Callable, args: Tuple, kwargs: Dict):
+        self.conn.send((func, args, kwargs))
+
+    def assign(self, index: int, on_index: Callable[[int], None] = None):
+        """
+        Give slot to a spare, on_index is called in it before next task, without waiting.
+        """
+        self.index = index
+        if on_index is not None:
+            self.send(on_index, (index, ), {})
+            self.__skips += 1
+
+    def recv(self, token: CancelToken = None) -> Tuple[int, Any]:
+        while True:
+            if token is not None:
+                while not self.__poll(token.interval()):
+                    token.check()
+            try:
+                kind, value = self.conn.recv()
+            except (EOFError, OSError):
+                raise RuntimeError(f'Worker process {self.process.pid} exited with {self.process.exitcode}')
+            if kind == READY:
+                self.ready = True
+            elif self.__skips > 0:
+                self.__skips -= 1
+                if kind == ERROR:
+                    logger.warning(f'Failed to assign worker {self.process.pid}: {load_error(value)}')
+            else:
+                return kind, value
+
+    def poll_ready(self) -> bool:
+        """
+        :return: initializer finished, without blocking
+        """
+        if not self.ready and self.__poll(0):
+            try:
+                kind, _ = self.conn.recv()
+            except (EOFError, OSError):
+                # exited, never ready
+                return False
+            self.ready = kind == READY
+        return self.ready
+
+    def __poll(self, timeout: float) -> bool:
+        try:
+            return self.conn.poll(timeout)
+        except (EOFError, OSError):
+            # exited, raised by recv
+            return True
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def memory(self) -> Optional[Dict[str, int]]:
+        return process_memory(self.process.pid)
+
+    def join(self):
+        self.process.join()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerIterator(object):
+    def __init__(self, pool: 'WorkerPool', worker: Worker):
+        """
+        Items yielded by a generator in worker, the worker is held until exhausted or closed.
+        """
+        self.__pool = pool
+        self.__worker: Optional[Worker] = worker
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Any:
+        if self.__worker is None:
+            raise StopIteration
+        try:
+            kind, value = self.__worker.recv()
+        except BaseException:
+            self.__pool._release(self.__worker, dead=True)
+            self.__worker = None
+            raise
+        if kind == ITEM:
+            return value
+        self.__pool._release(self.__worker)
+        self.__worker = None
+        if kind == ERROR:
+            raise load_error(value)
+        if kind == OK:
+            # not a generator, the only value
+            return value
+        raise StopIteration
+
+    def close(self):
+        """
+        Stop iterating, the worker still running the generator is replaced.
+        """
+        if self.__worker is not None:
+            self.__pool._release(self.__worker, dead=True)
+            self.__worker = None
+
+    def __del__(self):
+        self.close()
+
+
+class WorkerPool(object):
+    def __init__(self, ctx: BaseContext, processes: int,
+                 initializer: Callable = None, initargs: Tuple = (),
+                 on_index: Callable[[int], None] = None,
+                 on_memory: Callable[[int], None] = None,
+                 max_tasks: int = None,
+                 max_memory: int = None,
+                 spares: int = None):
+        """
+        Processes each owned by one caller at a time through its own pipe,
+        so generators can be streamed and a stuck worker can be replaced alone.
+        :param ctx: multiprocessing context
+        :param processes: worker processes
+        :param initializer: called in each worker at start
+        :param on_index: called in each worker with the stable index of its slot in `[0, processes)`,
+                         before initializer, a spare is told the index of the worker it replaces when it takes over
+        :param on_memory: called after each `apply` with bytes the worker peaked above its resident memory before,
+                          not called if peak memory can not be reset before tasks
+        :param max_tasks: tasks of a worker before it is replaced, None for no limit,
+                          each worker takes a limit down to a quarter below, so workers are not replaced together
+        :param max_memory: resident bytes of a worker after a task, beyond which it is replaced, None for no limit
+        :param spares: workers started and initialized ahead for replacing others,
+                       default 1 if a limit is set, else 0
+        """
+        self.__ctx = ctx
+        self.__on_memory = on_memory
+        self.__max_tasks = max_tasks
+        self.__max_memory = max_memory
+        if spares is None:
+            spares = 1 if max_tasks is not None or max_memory is not None else 0
+        self.__spare_count = spares
+        self.__processes = processes
+        self.__initializer = initializer
+        self.__initargs = initargs
+        self.__on_index = on_index
+        self.__lock = threading.Lock()
+        self.__closed = False
+        self.__terminated = False
+        self.__workers: List[Worker] = [self.__spawn(i) for i in range(processes)]
+        self.__spares: List[Worker] = [self.__spawn() for _ in range(spares)]
+        self.__idle: queue.Queue = queue.Queue()
+        for worker in self.__workers:
+            self.__idle.put(worker)
+        self.__executor = ThreadPoolExecutor(max_workers=processes)
+
+    @property
+    def processes(self) -> int:
+        return self.__processes
+
+    def __spawn(self, index: int = None) -> Worker:
+        worker = Worker(self.__ctx, self.__initializer, self.__initargs, index, self.__on_index)
+        if self.__max_tasks is not None:
+            lowest = max(int(self.__max_tasks * (1 - TASKS_JITTER)), 1)
+            worker.max_tasks = random.randint(lowest, self.__max_tasks)
+        return worker
+
+    def _acquire(self, token: CancelToken = None, queued: bool = False) -> Worker:
+        """
+        :param queued: call submitted before close, it still runs unless terminated
+        """
+        if self.__terminated or (self.__closed and not queued):
+            raise ValueError('Pool not running')
+        while True:
+            if token is not None:
+                token.check()
+            try:
+                worker = self.__idle.get(timeout=None if token is None else token.interval())
+            except queue.Empty:
+                continue
+            if worker is None:
+                # terminated, wake next waiter
+                self.__idle.put(None)
+                raise ValueError('Pool not running')
+            return worker
+
+    def _release(self, worker: Worker, dead: bool = False):
+        if not dead:
+            worker.tasks += 1
+            if self.__closed or not self.__worn(worker):
+                self.__idle.put(worker)
+                return
+        with self.__lock:
+            self.__workers.remove(worker)
+            closed = self.__closed
+            replacement = None if closed else self.__take_spare(worker.index)
+            if replacement is not None:
+                self.__workers.append(replacement)
+        if dead:
+            worker.kill()
+        else:
+            # exit in background, caller goes on at once
+            worker.stop()
+            threading.Thread(target=worker.join, daemon=True).start()
+        if closed:
+            return
+        if replacement is None:
+            # no spare, start one out of lock
+            replacement = self.__spawn(worker.index)
+            with self.__lock:
+                closed = self.__closed
+                if not closed:
+                    self.__workers.append(replacement)
+            if closed:
+                replacement.stop()
+                replacement.join()
+                return
+        self.__idle.put(replacement)
+
+    def __worn(self, worker: Worker) -> bool:
+        """
+        :return: worker reached max tasks or max memory
+        """
+        if worker.max_tasks is not None and worker.tasks >= worker.max_tasks:
+            return True
+        if self.__max_memory is not None:
+            memory = worker.memory()
+            if memory is not None and memory['rss'] > self.__max_memory:
+                return True
+        return False
+
+    def __take_spare(self, index: int) -> Optional[Worker]:
+        """
+        Take an initialized spare, or the oldest one still starting, and start another in background.
+        Called with lock, does not start processes.
+        :param index: slot of replaced worker, taken by the spare
+        :return: spare, None if there is none
+        """
+        if self.__spare_count <= 0:
+            return None
+        spares = [spare for spare in self.__spares if spare.process.exitcode is None]
+        for spare in self.__spares:
+            if spare not in spares:
+                # exited, reaped at once
+                spare.kill()
+        self.__spares = spares
+        threading.Thread(target=self.__refill, daemon=True).start()
+        spare = next((s for s in spares if s.poll_ready()), spares[0] if spares else None)
+        if spare is not None:
+            self.__spares.remove(spare)
+            spare.assign(index, self.__on_index)
+        return spare
+
+    def __refill(self):
+        with self.__lock:
+            if self.__closed or len(self.__spares) >= self.__spare_count:
+                return
+        worker = self.__spawn()
+        with self.__lock:
+            if not self.__closed and len(self.__spares) < self.__spare_count:
+                self.__spares.append(worker)
+                return
+        worker.stop()
+        worker.join()
+
+    def __measure(self, worker: Worker) -> Optional[Dict[str, int]]:
+        """
+        Reset peak memory of worker before a task.
+        :return: memory of worker before the task, None for not measuring it
+        """
+        if not reset_peak(worker.process.pid):
+            # peak of worker life is not memory of a task, stop learning
+            logger.warning('Peak memory of workers can not be reset, task memory is not learned')
+            self.__on_memory = None
+            return None
+        return worker.memory()
+
+    def apply(self, func: Callable, args: Tuple = (), kwargs: Dict = None, token: CancelToken = None) -> Any:
+        """
+        :param token: cancel or deadline of call, the worker is killed and replaced when it fires
+        """
+        return self.__apply(func, args, kwargs, token)
+
+    def __apply(self, func: Callable, args: Tuple, kwargs: Optional[Dict], token: Optional[CancelToken],
+                queued: bool = False) -> Any:
+        worker = self._acquire(token, queued)
+        before = self.__measure(worker) if self.__on_memory is not None else None
+        try:
+            worker.send(func, args, kwargs or {})
+            kind, value = worker.recv(token)
+            if kind == ITEM:
+                # generator in apply, collect items
+                items = []
+                while kind == ITEM:
+                    items.append(value)
+                    kind, value = worker.recv(token)
+                if kind == DONE:
+                    kind, value = OK, items
+        except BaseException:
+            self._release(worker, dead=True)
+            raise
+        if before is not None:
+            after = worker.memory()
+            if after is not None:
+                self.__on_memory(after['peak'] - before['rss'])
+        self._release(worker)
+        if kind == ERROR:
+            raise load_error(value)
+        return value
+
+    def apply_async(self, func: Callable, args: Tuple = (), kwargs: Dict = None) -> AsyncCall:
+        future = AsyncCall()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.__apply(func, args, kwargs, None, queued=True))
+            except BaseException as e:
+                future.set_exception(e)
+
+        self.__executor.submit(run)
+        return future
+
+    def iterate(self, func: Callable, args: Tuple = (), kwargs: Dict = None) -> WorkerIterator:
+        """
+        Start func in a worker, iterate items of the generator it returns as they are yielded.
+        """
+        worker = self._acquire()
+        try:
+            worker.send(func, args, kwargs or {})
+        except BaseException:
+            self._release(worker, dead=True)
+            raise
+        return WorkerIterator(self, worker)
+
+    def imap(self, func: Callable, iterable: Iterable, chunk_size: int = 1, ordered: bool = True) -> Iterator[Any]:
+        chunks = chunked(iterable, chunk_size)
+        pending: deque = deque()
+        done: queue.Queue = queue.Queue()
+
+        def submit() -> bool:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            future = self.apply_async(run_chunk, (func, chunk))
+            future.add_done_callback(done.put)
+            pending.append(future)
+            return True
+
+        # bounded submissions keep lazy iterables lazy
+        for _ in range(self.__processes * 2):
+            if not submit():
+                break
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                future = done.get()
+                pending.remove(future)
+            results = future.result()
+            submit()
+            yield from results
+
+    def map(self, func: Callable, iterable: Iterable, chunk_size: int = None) -> List[Any]:
+        items = list(iterable)
+        if chunk_size is None:
+            chunk_size, extra = divmod(len(items), self.__processes * 4)
+            if extra:
+                chunk_size += 1
+        return list(self.imap(func, items, chunk_size=max(chunk_size, 1)))
+
+    def close(self):
+        """
+        Stop workers after running tasks.
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+        self.__executor.shutdown(wait=True)
+        for _ in range(len(self.__workers)):
+            worker = self.__idle.get()
+            worker.stop()
+        for worker in self.__spares:
+            worker.stop()
+        for worker in self.__workers + self.__spares:
+            worker.process.join()
+            worker.conn.close()
+
+    def join(self):
+        for worker in self.__workers + self.__spares:
+            worker.process.join()
+
+    def terminate(self):
+        """
+        Kill workers, running and queued calls fail.
+        """
+        with self.__lock:
+            self.__closed = True
+            self.__terminated = True
+        self.__idle.put(None)
+        self.__executor.shutdown(wait=False)
+        for worker in self.__workers + self.__spares:
+            worker.process.kill()
+        for worker in self.__workers + self.__spares:
+            worker.process.join()
+            worker.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.terminate()
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List[Any]]:
+    iterator = iter(iterable)
+    while True:
+        chunk = []
+        for item in iterator:
+            chunk.append(item)
+            if len(chunk) >= size:
+                break
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_chunk(func: Callable, items: List[Any]) -> List[Any]:
+    return [func(item) for item in items]
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
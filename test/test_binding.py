@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+import zmq
+
+from quickdist.pyzmq.binding import LoadBalancer, Socket, READY
+
+
+def test_overflow_beyond_max_pending():
+    ctx = zmq.Context()
+    broker = LoadBalancer('inproc://test-frontend', 'inproc://test-backend', ctx, max_pending=1, overflow=b'busy')
+    threading.Thread(target=broker.run, daemon=True).start()
+    first = Socket(zmq.REQ, ctx)
+    second = Socket(zmq.REQ, ctx)
+    worker = Socket(zmq.REQ, ctx)
+    try:
+        first.socket.connect(broker.frontend)
+        second.socket.connect(broker.frontend)
+        first.socket.send(b'first')
+        # no worker yet, the first request waits and the second is refused
+        assert not first.socket.poll(100)
+        second.socket.send(b'second')
+        assert second.socket.poll(1000)
+        assert second.socket.recv() == b'busy'
+
+        worker.socket.connect(broker.backend)
+        worker.socket.send(READY)
+        client, empty, request = worker.socket.recv_multipart()
+        assert request == b'first'
+        worker.socket.send_multipart([client, empty, b'done'])
+        assert first.socket.poll(1000)
+        assert first.socket.recv() == b'done'
+    finally:
+        for socket in (first, second, worker):
+            socket.socket.close(linger=0)
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from quickdist.cache import ResultCache, script_digest
+from quickdist.file import File, Location
+
+
+def test_key_canonical():
+    cache = ResultCache()
+    script = script_digest('def main(x): return x')
+    key = cache.key(script, (1, [2, 3]), {'a': {'x': 1, 'y': 2}, 'b': {1, 2}})
+    assert key == cache.key(script, (1, [2, 3]), {'b': {2, 1}, 'a': {'y': 2, 'x': 1}})
+    assert key != cache.key(script, (1, (2, 3)), {'a': {'x': 1, 'y': 2}, 'b': {1, 2}})
+    assert key != cache.key(script_digest('def main(x): return -x'), (1, [2, 3]), {'a': {'x': 1, 'y': 2}, 'b': {1, 2}})
+
+
+def test_key_of_files():
+    cache = ResultCache()
+    file = File(Location.workdir, 'missing/data.bin', md5='0' * 32)
+    # keyed by content, not by location
+    local = File(Location.local, 'missing/data.bin', md5='0' * 32)
+    assert cache.key('script', (file, ), {}) == cache.key('script', (local, ), {})
+    assert cache.key('script', (File(Location.workdir, 'missing/data.bin', md5='1' * 32), ), {}) != \
+        cache.key('script', (file, ), {})
+    # no digest and no content to compute it, not cached
+    assert cache.key('script', (File(Location.workdir, 'missing/data.bin'), ), {}) is None
+
+
+def test_get_put(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = cache.key('script', (1, ), {})
+    assert cache.get(key) == (False, None)
+    cache.put(key, {'result': 1})
+    assert cache.get(key) == (True, {'result': 1})
+    assert ResultCache(str(tmp_path)).get(key) == (True, {'result': 1})
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=3500)
+    keys = [cache.key('script', (i, ), {}) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, bytes(1000))
+        # mtime orders entries, keep them apart on coarse clocks
+        path = os.path.join(str(tmp_path), key[:2], f'{key}.pkl')
+        os.utime(path, (i, i))
+    cache.get(keys[0])
+    cache.put(cache.key('script', (3, ), {}), bytes(1000))
+    assert cache.get(keys[0])[0]
+    assert not cache.get(keys[1])[0]
+    assert cache.get(keys[2])[0]
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
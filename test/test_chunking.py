@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from quickdist.chunking import AdaptiveChunker
+
+
+def test_grow_to_target():
+    chunker = AdaptiveChunker(slots=4)
+    assert chunker.size() == 1
+    sizes = []
+    for _ in range(5):
+        items = chunker.size()
+        # 10ms per item, 100ms of round trip beyond main
+        chunker.record('node', items, items * 0.01, items * 0.01 + 0.1)
+        sizes.append(chunker.size())
+    # grows at most 4 times a chunk, up to 0.1 * 0.95 / (0.05 * 0.01) items
+    assert sizes[:3] == [4, 16, 64]
+    assert sizes[3] == pytest.approx(190, abs=1) and sizes[4] == pytest.approx(190, abs=1)
+    item, overhead = chunker.timings()['node']
+    assert item == pytest.approx(0.01) and overhead == pytest.approx(0.1)
+
+
+def test_slowest_node_sizes_chunks():
+    chunker = AdaptiveChunker(slots=2, max_size=100)
+    for _ in range(8):
+        chunker.record('fast', 10, 10 * 0.001, 10 * 0.001 + 0.01)
+        chunker.record('slow', 10, 10 * 0.01, 10 * 0.01 + 0.01)
+    # fast node needs the larger chunks to keep its overhead under target, capped by max_size
+    assert chunker.size() == 100
+
+
+def test_shrink_at_tail():
+    chunker = AdaptiveChunker(slots=2, total=100, max_size=50)
+    for _ in range(4):
+        chunker.record('node', 1, 0.001, 1.0)
+    assert chunker.size() == 25
+    chunks = list(chunker.chunks(range(100)))
+    assert [item for chunk in chunks for item in chunk] == list(range(100))
+    assert len(chunks[-1]) == 1
+
+
+def test_overhead_range():
+    with pytest.raises(ValueError):
+        AdaptiveChunker(slots=1, overhead=0)
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from quickdist.journal import Journal, map_fingerprint
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / 'map.journal')
+    with Journal(path) as journal:
+        journal.put(0, 'a')
+        journal.put(2, 'c')
+    with Journal(path) as journal:
+        assert len(journal) == 2
+        assert 0 in journal and 1 not in journal and 2 in journal
+        journal.put(1, 'b')
+        assert list(journal.result(3)) == ['a', 'b', 'c']
+
+
+def test_torn_record_truncated(tmp_path):
+    path = str(tmp_path / 'map.journal')
+    with Journal(path) as journal:
+        journal.put(0, 'a')
+        journal.put(1, 'b' * 100)
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        f.truncate(size - 10)
+    with Journal(path) as journal:
+        assert journal.completed() == {0}
+        journal.put(1, 'b')
+        assert list(journal.result(2)) == ['a', 'b']
+
+
+def test_spill(tmp_path):
+    path = str(tmp_path / 'map.journal')
+    with Journal(path, spill_threshold=1000) as journal:
+        journal.put(0, bytes(2000))
+        journal.put(1, b'small')
+    assert os.path.exists(f'{path}.d/0.pkl')
+    with Journal(path) as journal:
+        assert journal.read(0) == bytes(2000)
+        assert journal.read(1) == b'small'
+
+
+def test_fingerprint(tmp_path):
+    path = str(tmp_path / 'map.journal')
+    fingerprint, items = map_fingerprint('script', iter(range(100)))
+    assert list(items) == list(range(100))
+    with Journal(path, fingerprint=fingerprint) as journal:
+        journal.put(0, 0)
+    with Journal(path, fingerprint=map_fingerprint('script', iter(range(100)))[0]) as journal:
+        assert journal.fingerprint == fingerprint
+        assert 0 in journal
+    other, _ = map_fingerprint('script', iter(range(1, 101)))
+    with pytest.raises(ValueError):
+        Journal(path, fingerprint=other)
+    assert map_fingerprint('script', [1, 2])[0] != map_fingerprint('script', [1, 2, 3])[0]
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+
+import pytest
+
+from quickdist.node import DirectTasks, MAX_DIRECT_CANCELLED
+
+
+def test_direct_cancel_running():
+    tasks = DirectTasks(multiprocessing.get_context('spawn'), 3)
+    assert tasks.start(1, 'a')
+    assert tasks.cancel('a') == 1
+    assert tasks.cancelled('a')
+    tasks.finish(1)
+    assert tasks.cancel('a') is None
+
+
+def test_direct_cancel_before_start():
+    tasks = DirectTasks(multiprocessing.get_context('spawn'), 2)
+    assert tasks.cancel('b') is None
+    assert not tasks.start(0, 'b')
+    assert tasks.start(0, 'c')
+
+
+def test_direct_cancelled_bounded():
+    tasks = DirectTasks(multiprocessing.get_context('spawn'), 1)
+    tasks.cancel('a')
+    for i in range(MAX_DIRECT_CANCELLED):
+        tasks.cancel(f'x{i}')
+    assert not tasks.cancelled('a')
+    assert tasks.start(0, 'a')
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+
+import pytest
+
+from quickdist.objects import ObjectRef, ObjectStore, put_request, resolve_arguments, set_namespace
+from quickdist.tunnel import Message
+
+
+@pytest.fixture
+def store():
+    store = ObjectStore(f't{os.getpid()}')
+    set_namespace(store.namespace)
+    yield store
+    set_namespace(None)
+    store.clear()
+
+
+def put(store: ObjectStore, obj) -> ObjectRef:
+    ref, request = put_request(obj)
+    msg = Message.load(request)
+    assert msg.cmd == 'PUT'
+    store.put(*msg.args)
+    return ref
+
+
+def test_ref_by_content():
+    ref, _ = put_request({'table': list(range(10))})
+    assert ref == put_request({'table': list(range(10))})[0]
+    assert ref != put_request({'table': list(range(11))})[0]
+    assert pickle.loads(pickle.dumps(ref)) == ref
+
+
+def test_resolve_arguments(store):
+    table = {'a': list(range(100))}
+    ref = put(store, table)
+    assert ref in store and len(store) == 1
+    args, kwargs = resolve_arguments((ref, [1, ref], 2), {'t': ref, 'd': {'x': ref}})
+    assert args == (table, [1, table], 2)
+    assert kwargs == {'t': table, 'd': {'x': table}}
+    # no reference, arguments are passed as they are
+    args = (1, 'a')
+    assert resolve_arguments(args, {})[0] is args
+
+
+def test_freed(store):
+    ref = put(store, b'x' * 1000)
+    assert store.free(ref)
+    assert not store.free(ref)
+    set_namespace(store.namespace)
+    with pytest.raises(KeyError):
+        resolve_arguments((ref, ), {})
+
+
+def test_out_of_node():
+    ref, _ = put_request(1)
+    set_namespace(None)
+    with pytest.raises(RuntimeError):
+        resolve_arguments((ref, ), {})
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
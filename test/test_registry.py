@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from quickdist.registry import NodeRegistry, ACTIVE, DRAINING, LEFT, DEAD
+
+
+def registry(max_nodes: int = 4, aging: float = 0) -> NodeRegistry:
+    return NodeRegistry(multiprocessing.get_context('spawn'), max_nodes, aging)
+
+
+def test_acquire_most_free():
+    nodes = registry()
+    a = nodes.add(('a', 1, 1), 1)
+    b = nodes.add(('b', 1, 1), 2)
+    assert nodes.record(b) == ('b', 1, 1)
+    assert nodes.capacity() == 3
+    assert nodes.acquire(0) == b
+    assert nodes.acquire(0) in (a, b)
+    assert nodes.acquire(0) in (a, b)
+    assert nodes.acquire(0) is None
+    nodes.release(a)
+    assert nodes.acquire(0) == a
+
+
+def test_drain_and_leave():
+    nodes = registry()
+    a = nodes.add(('a', 1, 1), 1)
+    assert nodes.acquire(0) == a
+    nodes.drain(a)
+    assert nodes.state(a) == DRAINING
+    assert nodes.active() == []
+    assert not nodes.leave(a, timeout=0.1)
+    nodes.release(a)
+    assert nodes.leave(a, timeout=0.1)
+    assert nodes.state(a) == LEFT
+    assert nodes.acquire(0) is None
+
+
+def test_rejoin_reuses_record():
+    nodes = registry(2)
+    a = nodes.add(('a', 1, 1), 2)
+    b = nodes.add(('b', 1, 1), 1)
+    assert nodes.acquire(0) == a
+    nodes.fail(a)
+    assert nodes.state(a) == DEAD
+    # the task on dead node is not released yet
+    assert nodes.add(('a', 1, 1), 2) == a
+    assert nodes.state(a) == ACTIVE
+    assert nodes.capacity() == 3
+    nodes.release(a)
+    assert nodes.capacity() == 3
+    assert nodes.leave(b)
+    assert nodes.add(('b', 1, 1), 1) == b
+
+
+def test_locality():
+    nodes = registry()
+    a = nodes.add(('a', 1, 1), 1)
+    b = nodes.add(('b', 1, 1), 4)
+    nodes.add_files(a, ['::x.bin:0'])
+    assert nodes.acquire(0, files=['::x.bin:0']) == a
+    # holder is busy, take the other node after locality delay
+    start = time.monotonic()
+    assert nodes.acquire(1, files=['::x.bin:0'], locality_delay=0.2) == b
+    assert time.monotonic() - start >= 0.2
+    nodes.release(a)
+    nodes.fail(a)
+    # files of a rejoined node are reported again
+    assert nodes.add(('a', 1, 1), 1) == a
+    assert nodes.acquire(0, files=['::x.bin:0']) == b
+
+
+def test_priority():
+    nodes = registry()
+    a = nodes.add(('a', 1, 1), 1)
+    assert nodes.acquire(0) == a
+    assert nodes.acquire(0) is None
+    # urgent tasks wait in node scheduler, up to twice the slots
+    assert nodes.acquire(0, priority=1) == a
+    assert nodes.acquire(0, priority=1) is None
+    nodes.release(a)
+
+    order = []
+
+    def wait(priority):
+        assert nodes.acquire(5, priority=priority) == a
+        order.append(priority)
+
+    threads = []
+    for priority in (-1, 0):
+        thread = threading.Thread(target=wait, args=(priority, ))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.2)
+    nodes.release(a)
+    threads[1].join(5)
+    nodes.release(a)
+    threads[0].join(5)
+    assert order == [0, -1]
+
+
+def test_busy_pause():
+    nodes = registry()
+    a = nodes.add(('a', 1, 1), 2)
+    b = nodes.add(('b', 1, 1), 1)
+    nodes.pause(a, 0.3)
+    assert nodes.acquire(0) == b
+    assert nodes.acquire(0.1) is None
+    assert nodes.acquire(1) == a
+
+
+def test_full():
+    nodes = registry(1)
+    nodes.add(('a', 1, 1), 1)
+    with pytest.raises(RuntimeError, match='full'):
+        nodes.add(('b', 1, 1), 1)
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+import pytest
+
+from quickdist.scheduler import PriorityScheduler
+from quickdist.workers import CancelToken, TaskCancelled
+
+
+def granted_order(scheduler: PriorityScheduler, priorities, delay: float = 0) -> list:
+    """
+    Queue one waiter of each priority in order behind a held slot, then free the slot.
+    :param delay: seconds between queueing the first waiter and the others
+    :return: indices of waiters in order of granted slots
+    """
+    order = []
+
+    def wait(index, priority):
+        scheduler.acquire(priority)
+        order.append(index)
+        scheduler.release()
+
+    scheduler.acquire()
+    threads = []
+    for index, priority in enumerate(priorities):
+        thread = threading.Thread(target=wait, args=(index, priority))
+        thread.start()
+        threads.append(thread)
+        while sum(scheduler.queued().values()) <= index:
+            time.sleep(0.01)
+        if index == 0:
+            time.sleep(delay)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_priority_order():
+    scheduler = PriorityScheduler(1, aging=0)
+    assert granted_order(scheduler, [0, 5, -1, 5, 2]) == [1, 3, 4, 0, 2]
+    assert scheduler.running == 0
+
+
+def test_aging():
+    # waited 4 levels, ranks over a later task of priority 2
+    assert granted_order(PriorityScheduler(1, aging=0.05), [0, 2], delay=0.2) == [0, 1]
+    assert granted_order(PriorityScheduler(1, aging=0), [0, 2], delay=0.2) == [1, 0]
+
+
+def test_cancel_while_waiting():
+    scheduler = PriorityScheduler(1)
+    scheduler.acquire()
+    token = CancelToken()
+    threading.Timer(0.1, token.cancel).start()
+    with pytest.raises(TaskCancelled):
+        scheduler.acquire(0, token)
+    assert scheduler.queued() == {}
+    scheduler.release()
+    assert scheduler.running == 0
+
+
+def test_slot():
+    scheduler = PriorityScheduler(2)
+    with scheduler.slot():
+        with scheduler.slot(1):
+            assert scheduler.running == 2
+    assert scheduler.running == 0
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+from quickdist.shm import SharedBuffer, SharedMemoryPool, share_arguments, load_arguments, share_result, load_result
+
+
+def test_arguments_round_trip():
+    pool = SharedMemoryPool()
+    try:
+        args, kwargs, blocks = share_arguments((b'a' * 100, b'small'), {'x': bytearray(200)}, pool, 64)
+        assert isinstance(args[0], SharedBuffer) and args[1] == b'small'
+        assert isinstance(kwargs['x'], SharedBuffer)
+        assert len(blocks) == 2
+        args, kwargs = load_arguments(args, kwargs)
+        assert args == (b'a' * 100, b'small')
+        assert kwargs == {'x': bytearray(200)} and isinstance(kwargs['x'], bytearray)
+        for block in blocks:
+            pool.release(block)
+    finally:
+        pool.close()
+
+
+def test_pool_reuse():
+    pool = SharedMemoryPool()
+    try:
+        block = pool.acquire(100)
+        name = block.name
+        pool.release(block)
+        assert pool.acquire(200).name == name
+    finally:
+        pool.close()
+
+
+def test_pool_close_unlinks():
+    pool = SharedMemoryPool()
+    block = pool.acquire(100)
+    name = block.name
+    pool.release(block)
+    pool.close()
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
+
+
+def test_result_owned_by_loader():
+    ret = share_result((b'r' * 100, 1), 64)
+    handle = ret[0]
+    assert isinstance(handle, SharedBuffer) and handle.owned
+    assert load_result(ret) == (b'r' * 100, 1)
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=handle.name)
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
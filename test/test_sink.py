@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from quickdist.sink import ResultSink, ListSink, CallbackSink, SpillSink
+
+
+def test_abstract():
+    with pytest.raises(TypeError):
+        ResultSink()
+
+
+def test_list_sink():
+    sink = ListSink()
+    for index in (2, 0, 1):
+        sink.put(index, index * 10)
+    assert sink.result(3) == [0, 10, 20]
+
+
+def test_callback_sink():
+    seen = []
+    sink = CallbackSink(lambda index, result: seen.append((index, result)))
+    sink.put(1, 'b')
+    sink.put(0, 'a')
+    assert sink.result(2) is None
+    assert seen == [(1, 'b'), (0, 'a')]
+
+
+def test_spill_sink_reads_while_growing():
+    with SpillSink() as sink:
+        path = sink.path
+        sink.put(1, 'b')
+        results = sink.result(2)
+        assert results[-1] == 'b'
+        # file grows after it is mapped
+        sink.put(0, bytes(1 << 16))
+        assert results[0] == bytes(1 << 16)
+        assert list(results) == [bytes(1 << 16), 'b']
+        assert results[::-1] == ['b', bytes(1 << 16)]
+        with pytest.raises(IndexError):
+            results[2]
+    assert not os.path.exists(path)
+
+
+def test_spill_sink_keeps_given_path(tmp_path):
+    path = str(tmp_path / 'results.spill')
+    with SpillSink(path) as sink:
+        sink.put(0, [1, 2, 3])
+        assert sink.read(0) == [1, 2, 3]
+    assert os.path.exists(path)
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import pickle
+
+import pytest
+
+from quickdist.stream import StreamTable
+
+
+def pull(table: StreamTable, stream_id: int) -> list:
+    values = []
+    data = []
+    while True:
+        for frame in table.next(stream_id):
+            if frame[0] == 'END':
+                return values
+            if frame[0] == 'PART':
+                sizes = frame[1]
+                data = []
+            else:
+                data.append(frame[1])
+                segments = b''.join(data)
+                if len(segments) == sum(sizes):
+                    offsets = [sum(sizes[:i]) for i in range(len(sizes) + 1)]
+                    parts = [segments[offsets[i]:offsets[i + 1]] for i in range(len(sizes))]
+                    values.append(pickle.loads(parts[0], buffers=parts[1:]))
+
+
+def test_pull_in_chunks():
+    table = StreamTable(chunk_size=16)
+    released = []
+    stream_id = table.open(iter(['a' * 100, b'b' * 50, 3]), release=lambda: released.append(True))
+    assert pull(table, stream_id) == ['a' * 100, b'b' * 50, 3]
+    assert released == [True]
+
+
+def test_release_on_drop_and_expiry():
+    released = []
+    table = StreamTable(ttl=0)
+    first = table.open(iter([1]), release=lambda: released.append(1))
+    table.drop(first)
+    assert released == [1]
+    table.open(iter([2]), release=lambda: released.append(2))
+    # expired streams are dropped when opening another
+    table.open(iter([3]))
+    assert released == [1, 2]
+
+
+def test_release_on_failure():
+    def values():
+        yield 1
+        raise ValueError('failed')
+
+    released = []
+    table = StreamTable()
+    stream_id = table.open(values(), release=lambda: released.append(True))
+    table.next(stream_id)
+    with pytest.raises(ValueError):
+        table.next(stream_id)
+    assert released == [True]
+    with pytest.raises(KeyError):
+        table.next(stream_id)
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import threading
+import multiprocessing
+
+import pytest
+
+from quickdist.workers import WorkerPool, CancelToken, TaskCancelled, TaskTimeout
+
+
+def square(x):
+    return x * x
+
+
+def slow_square(x):
+    time.sleep(0.2)
+    return x * x
+
+
+def count(n):
+    yield from range(n)
+
+
+def new_pool(processes=1, **kwargs) -> WorkerPool:
+    return WorkerPool(multiprocessing.get_context('spawn'), processes, **kwargs)
+
+
+def test_worker_death():
+    with new_pool(2) as pool:
+        with pytest.raises(RuntimeError, match='exited'):
+            pool.apply(os._exit, (3, ))
+        assert pool.map(square, range(10)) == [x * x for x in range(10)]
+
+
+def test_cancel_replaces_worker():
+    with new_pool() as pool:
+        pid = pool.apply(os.getpid)
+        token = CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        start = time.monotonic()
+        with pytest.raises(TaskCancelled):
+            pool.apply(time.sleep, (30, ), token=token)
+        assert time.monotonic() - start < 5
+        assert pool.apply(os.getpid) != pid
+        assert pool.apply(square, (3, )) == 9
+
+
+def test_timeout_replaces_worker():
+    with new_pool() as pool:
+        with pytest.raises(TaskTimeout):
+            pool.apply(time.sleep, (30, ), token=CancelToken(timeout=0.2))
+        assert pool.apply(square, (4, )) == 16
+
+
+def test_closed_iterator_replaces_worker():
+    with new_pool() as pool:
+        items = pool.iterate(count, (1000, ))
+        assert next(items) == 0
+        items.close()
+        assert list(pool.iterate(count, (3, ))) == [0, 1, 2]
+
+
+def test_close_while_busy():
+    pool = new_pool()
+    calls = [pool.apply_async(slow_square, (x, )) for x in range(3)]
+    time.sleep(0.1)
+    pool.close()
+    assert [call.get(0) for call in calls] == [0, 1, 4]
+    with pytest.raises(ValueError):
+        pool.apply(square, (1, ))
+
+
+def test_terminate_while_busy():
+    pool = new_pool()
+    calls = [pool.apply_async(time.sleep, (30, )) for _ in range(3)]
+    time.sleep(0.5)
+    start = time.monotonic()
+    pool.terminate()
+    for call in calls:
+        with pytest.raises((RuntimeError, ValueError)):
+            call.get(5)
+    assert time.monotonic() - start < 5
+
+
+def main():
+    pytest.main([__file__])
+
+
+if __name__ == '__main__':
+    main()